@@ -0,0 +1,134 @@
+"""Measure the throughput of decoding list query results, flat, with an
+included relation, lazily from raw BSON and into columns.
+
+    python -m benchmarks.decode
+
+This benchmark doesn't require a running database.
+"""
+from __future__ import annotations
+from datetime import datetime, date
+from typing import Any, Callable
+from timeit import timeit
+from bson import encode
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from jsonclasses import jsonclass, types
+from jsonclasses_pymongo import pymongo
+from jsonclasses_pymongo.decoder import Decoder
+from jsonclasses_pymongo.columns import ColumnReader, numpy
+
+
+@pymongo
+@jsonclass(class_graph='benchmark')
+class BenchmarkRecord:
+    id: str = types.readonly.str.primary.mongoid.required
+    name: str
+    title: str
+    description: str
+    age: int
+    score: float
+    rank: int
+    active: bool
+    tags: list[str]
+    birthday: date
+    created_at: datetime = types.readonly.datetime.tscreated.required
+    updated_at: datetime = types.readonly.datetime.tsupdated.required
+
+
+@pymongo
+@jsonclass(class_graph='benchmark')
+class BenchmarkAuthor:
+    id: str = types.readonly.str.primary.mongoid.required
+    name: str
+    posts: list[BenchmarkPost] = types.nonnull.listof('BenchmarkPost') \
+                                      .linkedby('author')
+
+
+@pymongo
+@jsonclass(class_graph='benchmark')
+class BenchmarkPost:
+    id: str = types.readonly.str.primary.mongoid.required
+    title: str
+    content: str
+    author: BenchmarkAuthor = types.linkto.objof('BenchmarkAuthor')
+
+
+def documents(count: int, tags: int = 3) -> list[dict]:
+    now = datetime.utcnow()
+    return [{
+        '_id': ObjectId(),
+        'name': f'name{i}',
+        'title': f'title{i}',
+        'description': 'description',
+        'age': i,
+        'score': i / 2,
+        'rank': i % 10,
+        'active': i % 2 == 0,
+        'tags': [f'tag{n}' for n in range(tags)],
+        'birthday': datetime(2000, 1, 1),
+        'createdAt': now,
+        'updatedAt': now
+    } for i in range(count)]
+
+
+def included_documents(count: int, authors: int = 100) -> list[dict]:
+    author_docs = [{'_id': ObjectId(), 'name': f'author{i}'}
+                   for i in range(authors)]
+    return [{
+        '_id': ObjectId(),
+        'title': f'title{i}',
+        'content': 'content',
+        'authorId': author_docs[i % authors]['_id'],
+        'author': author_docs[i % authors]
+    } for i in range(count)]
+
+
+def measure(name: str,
+            count: int,
+            repeat: int,
+            decode: Callable[[], Any]) -> None:
+    seconds = min(timeit(decode, number=1) for _ in range(repeat))
+    print(f'{name}: decoded {count} documents in {seconds:.3f}s, '
+          f'{count / seconds:,.0f} documents/s')
+
+
+def lazy_read(data: list[bytes], names: list[str]) -> None:
+    docs = [RawBSONDocument(item) for item in data]
+    objects = Decoder(lazy=True).decode_root_list(docs, BenchmarkRecord)
+    for obj in objects:
+        for name in names:
+            getattr(obj, name)
+
+
+def read_columns(docs: list[dict], names: list[str], arrays: bool) -> None:
+    reader = ColumnReader(BenchmarkRecord, names, arrays)
+    for doc in docs:
+        reader.feed(doc)
+    reader.finish()
+
+
+def main(count: int = 50000, included: int = 5000, repeat: int = 3) -> None:
+    docs = documents(count)
+    measure('flat', count, repeat,
+            lambda: Decoder().decode_root_list(docs, BenchmarkRecord))
+    data = [encode(doc) for doc in docs]
+    measure('lazy, reading 2 fields', count, repeat,
+            lambda: lazy_read(data, ['name', 'score']))
+    measure('columns, 2 fields', count, repeat,
+            lambda: read_columns(docs, ['score', 'createdAt'], False))
+    if numpy is not None:
+        measure('column arrays, 2 fields', count, repeat,
+                lambda: read_columns(docs, ['score', 'createdAt'], True))
+    docs = documents(count, tags=200)
+    measure('wide', count, repeat,
+            lambda: Decoder().decode_root_list(docs, BenchmarkRecord))
+    data = [encode(doc) for doc in docs]
+    measure('wide lazy, reading 2 fields', count, repeat,
+            lambda: lazy_read(data, ['name', 'score']))
+    docs = included_documents(included)
+    measure('included', included, repeat,
+            lambda: Decoder().decode_root_list(docs, BenchmarkPost))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""Measure the throughput of encoding new objects into write commands.
+
+    python -m benchmarks.encode
+
+Collections are looked up on a connected database, but nothing is written.
+"""
+from __future__ import annotations
+from datetime import date
+from timeit import timeit
+from jsonclasses_pymongo.encoder import Encoder
+from .decode import BenchmarkRecord
+
+
+def records(count: int) -> list[BenchmarkRecord]:
+    return [BenchmarkRecord(name=f'name{i}', title=f'title{i}',
+                            description='description', age=i, score=i / 2,
+                            rank=i % 10, active=i % 2 == 0,
+                            tags=['a', 'b', 'c'], birthday=date(2000, 1, 1))
+            for i in range(count)]
+
+
+def main(count: int = 20000, repeat: int = 3) -> None:
+    def run() -> None:
+        objects = records(count)
+        seconds.append(timeit(lambda: Encoder().encode_roots(objects),
+                              number=1))
+    seconds: list[float] = []
+    for _ in range(repeat):
+        run()
+    best = min(seconds)
+    print(f'encoded {count} objects in {best:.3f}s, '
+          f'{count / best:,.0f} objects/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""This module contains the columnar reading of list query results. Field
+values are collected from the fetched documents into one column per field,
+no object is built. Columns are lists of decoded values, or NumPy arrays if
+NumPy is installed:
+
+* int fields are int64 arrays, float64 arrays if a value is missing;
+* float fields are float64 arrays, missing values are NaN;
+* bool fields are bool arrays, object arrays if a value is missing;
+* datetime and date fields are datetime64 arrays, missing values are NaT;
+* other fields are object arrays of decoded values.
+"""
+from __future__ import annotations
+from typing import Any, Optional, TYPE_CHECKING
+from jsonclasses.fdef import FType
+from jsonclasses.mgraph import MGraph
+from .decoder import Decoder, FieldPlan, PRIMARY, EMBEDDED, decode_plan
+try:
+    import numpy
+except ImportError:
+    numpy = None
+if TYPE_CHECKING:
+    from .pobject import PObject
+
+
+ARRAY_DTYPES = {FType.INT: 'int64', FType.FLOAT: 'float64',
+                FType.BOOL: 'bool', FType.DATETIME: 'datetime64[ms]',
+                FType.DATE: 'datetime64[D]'}
+
+
+def column_fields(cls: type[PObject], names: list[str]) -> list[FieldPlan]:
+    """The fields of columns `names`. The primary key and embedded fields
+    can be read into columns.
+    """
+    fields = {field.name: field for field in decode_plan(cls).fields}
+    kds = cls.cdef.jconf.input_key_strategy
+    result: list[FieldPlan] = []
+    for name in names:
+        field = fields.get(kds(name))
+        if field is None or field.kind not in (PRIMARY, EMBEDDED):
+            raise ValueError(f'\'{name}\' is not a column of {cls.__name__}')
+        result.append(field)
+    return result
+
+
+def column_key(field: FieldPlan) -> str:
+    return '_id' if field.kind == PRIMARY else field.key
+
+
+class ColumnReader:
+    """Column reader collects the values of documents as they come off the
+    cursor, columns are built at last.
+    """
+
+    def __init__(self: ColumnReader,
+                 cls: type[PObject],
+                 names: list[str],
+                 arrays: bool = True) -> None:
+        if arrays and numpy is None:
+            raise ImportError('NumPy is required to read columns into '
+                              'arrays, install jsonclasses-pymongo[numpy]')
+        self.cls = cls
+        self.names = names
+        self.fields = column_fields(cls, names)
+        self.keys = [column_key(field) for field in self.fields]
+        self.arrays = arrays
+        self.values: list[list[Any]] = [[] for _ in self.fields]
+
+    def feed(self: ColumnReader, document: dict[str, Any]) -> None:
+        for key, values in zip(self.keys, self.values):
+            values.append(document.get(key))
+
+    def finish(self: ColumnReader) -> dict[str, Any]:
+        result: dict[str, Any] = {}
+        for name, field, values in zip(self.names, self.fields, self.values):
+            if self.arrays:
+                result[name] = self._array(field, values)
+            else:
+                result[name] = self._decode(field, values)
+        return result
+
+    def _decode(self: ColumnReader,
+                field: FieldPlan,
+                values: list[Any]) -> list[Any]:
+        if field.kind == PRIMARY:
+            return [None if v is None else str(v) for v in values]
+        decoder = Decoder()
+        graph = MGraph()
+        return [decoder.decode_embedded(v, self.cls, field, graph)
+                for v in values]
+
+    def _array(self: ColumnReader, field: FieldPlan, values: list[Any]) -> Any:
+        dtype: Optional[str] = None
+        if field.kind == EMBEDDED:
+            dtype = ARRAY_DTYPES.get(field.ftype)
+        if dtype in ('int64', 'bool') and any(v is None for v in values):
+            dtype = 'float64' if dtype == 'int64' else None
+        if dtype is not None:
+            return numpy.array(values, dtype=dtype)
+        return numpy.fromiter(self._decode(field, values), dtype=object,
+                              count=len(values))
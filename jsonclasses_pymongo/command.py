@@ -1,6 +1,11 @@
 from __future__ import annotations
-from typing import Any
+from typing import Any, Hashable, Optional, TYPE_CHECKING
 from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+from pymongo.operations import InsertOne, UpdateOne, DeleteOne
+from .excs import LinkedObjectNotSavedException
+if TYPE_CHECKING:
+    from .encoder import ObjectWrite
 
 
 class Command:
@@ -9,10 +14,30 @@ class Command:
         raise NotImplementedError(
             'Please use concrete subclasses of Command.')
 
+    def operation(self) -> Any:
+        raise NotImplementedError(
+            'Please use concrete subclasses of Command.')
+
+    @property
+    def target(self) -> Optional[Hashable]:
+        """The identity of the document this command writes to. Commands with
+        the same target cannot be reordered.
+        """
+        return None
+
     def __repr__(self) -> str:
         return '<Command()>'
 
 
+def _matcher_target(matcher: dict[str, Any]) -> Optional[Hashable]:
+    try:
+        target = tuple(sorted(matcher.items()))
+        hash(target)
+        return target
+    except TypeError:
+        return None
+
+
 class InsertOneCommand(Command):
 
     def __init__(self, collection: Collection, object: dict[str, Any]) -> None:
@@ -22,6 +47,15 @@ class InsertOneCommand(Command):
     def execute(self) -> None:
         self.collection.insert_one(self.object)
 
+    def operation(self) -> InsertOne:
+        return InsertOne(self.object)
+
+    @property
+    def target(self) -> Optional[Hashable]:
+        if self.object.get('_id') is None:
+            return None
+        return _matcher_target({'_id': self.object['_id']})
+
     def __repr__(self) -> str:
         return (f'<InsertOneCommand(collection={self.collection.name}, '
                 f'object={self.object})>')
@@ -44,6 +78,13 @@ class UpdateOneCommand(Command):
             update=self.object,
             upsert=self.upsert)
 
+    def operation(self) -> UpdateOne:
+        return UpdateOne(self.matcher, self.object, upsert=self.upsert)
+
+    @property
+    def target(self) -> Optional[Hashable]:
+        return _matcher_target(self.matcher)
+
     def __repr__(self) -> str:
         return (f'<UpdateOneCommand(collection={self.collection.name}, '
                 f'object={self.object}), matcher={self.matcher}>')
@@ -74,16 +115,231 @@ class DeleteOneCommand(Command):
     def execute(self) -> None:
         self.collection.delete_one(filter=self.matcher)
 
+    def operation(self) -> DeleteOne:
+        return DeleteOne(self.matcher)
+
+    @property
+    def target(self) -> Optional[Hashable]:
+        return _matcher_target(self.matcher)
+
     def __repr__(self) -> str:
         return (f'<UpsertOneCommand(collection={self.collection.name}, '
                 f'matcher={self.matcher}>')
 
 
-class BatchCommand(Command):
+class BulkCommand(Command):
+    """Bulk command writes several commands of a same collection in one
+    `bulk_write` round trip. The batch is unordered if no two commands target
+    the same document, otherwise the original order is kept.
+    """
 
-    def __init__(self, commands: list[Command]) -> None:
+    def __init__(self, collection: Collection, commands: list[Command]) -> None:
+        self.collection = collection
         self.commands = commands
+        self.written: list[Command] = []
+
+    @property
+    def ordered(self) -> bool:
+        targets: set[Hashable] = set()
+        for command in self.commands:
+            target = command.target
+            if target is None or target in targets:
+                return True
+            targets.add(target)
+        return False
 
     def execute(self) -> None:
+        if len(self.commands) == 1:
+            self.commands[0].execute()
+            self.written = list(self.commands)
+            return
+        operations = [command.operation() for command in self.commands]
+        ordered = self.ordered
+        try:
+            self.collection.bulk_write(operations, ordered=ordered)
+            self.written = list(self.commands)
+        except BulkWriteError as exception:
+            self.written = written_commands(self.commands, exception, ordered)
+            raise_duplicate_key_error(exception)
+            raise
+
+    def __repr__(self) -> str:
+        return (f'<BulkCommand(collection={self.collection.name}, '
+                f'commands={self.commands})>')
+
+
+def write_error(error: dict[str, Any]) -> WriteError:
+    """Convert a write error document of a bulk write into an exception."""
+    if error.get('code') == 11000:
+        return DuplicateKeyError(error.get('errmsg'), 11000, error)
+    return WriteError(error.get('errmsg'), error.get('code'), error)
+
+
+def written_commands(commands: list[Any],
+                     exception: BulkWriteError,
+                     ordered: bool) -> list[Any]:
+    """The commands of a failed bulk write which are written. An ordered bulk
+    write stops at its first error.
+    """
+    errors = exception.details.get('writeErrors', [])
+    if ordered:
+        return commands[:errors[0]['index']] if len(errors) > 0 else []
+    failed = {error['index'] for error in errors}
+    return [c for i, c in enumerate(commands) if i not in failed]
+
+
+def raise_duplicate_key_error(exception: BulkWriteError) -> None:
+    """Reraise the first duplicate key write error of a bulk write as a
+    `DuplicateKeyError`, thus callers handle unique constraints alike.
+    """
+    for error in exception.details.get('writeErrors', []):
+        if error.get('code') == 11000:
+            raise write_error(error) from None
+
+
+class BatchCommand(Command):
+    """Batch command writes the commands of an encoded root. `writes` are the
+    writes of the objects encoded for the root, `dependencies` are the writes
+    of the shared objects encoded for other roots. Successfully executed
+    commands are collected in `written`.
+    """
+
+    def __init__(self,
+                 commands: list[Command],
+                 bulk: bool = True,
+                 writes: Optional[list[ObjectWrite]] = None,
+                 dependencies: Optional[list[ObjectWrite]] = None) -> None:
+        self.commands = commands
+        self.bulk = bulk
+        self.writes = writes or []
+        self.dependencies = dependencies or []
+        self.written: set[Command] = set()
+
+    def bulk_commands(self) -> list[BulkCommand]:
+        """Group commands by collection into bulk commands. Collections are
+        written in the order they first appear and commands keep their
+        relative order inside each collection.
+        """
+        groups: dict[str, BulkCommand] = {}
         for command in self.commands:
-            command.execute()
+            collection = getattr(command, 'collection')
+            key = collection.full_name
+            if groups.get(key) is None:
+                groups[key] = BulkCommand(collection, [])
+            groups[key].commands.append(command)
+        return list(groups.values())
+
+    def execute(self) -> None:
+        if not self.bulk:
+            for command in self.commands:
+                command.execute()
+                self.written.add(command)
+            return
+        for command in self.bulk_commands():
+            try:
+                command.execute()
+            finally:
+                self.written.update(command.written)
+
+
+class ManyBatchCommand(Command):
+    """Many batch command writes the commands of many batch commands together.
+    Commands are grouped by collection and written in chunks of `chunk_size`
+    operations. A failed write is recorded for the batch it comes from, the
+    other batches are still written. A batch which depends on a shared object
+    of a failed batch fails, too. Batches are written after the preceding
+    batches they depend on.
+    """
+
+    def __init__(self,
+                 batches: list[BatchCommand],
+                 chunk_size: int = 1000) -> None:
+        if chunk_size < 1:
+            raise ValueError('chunk size should be a positive integer')
+        self.batches = batches
+        self.chunk_size = chunk_size
+        self.errors: dict[int, Exception] = {}
+        self.written: set[Command] = set()
+
+    def _levels(self) -> list[list[int]]:
+        levels: list[int] = []
+        for index, batch in enumerate(self.batches):
+            depends = [levels[d.batch] + 1 for d in batch.dependencies
+                       if d.batch < index]
+            levels.append(max(depends, default=0))
+        result: list[list[int]] = [[] for _ in set(levels)]
+        for index, level in enumerate(levels):
+            result[level].append(index)
+        return result
+
+    def _fail_dependents(self,
+                         indices: list[int],
+                         preceding: bool = False) -> list[int]:
+        """Fail the batches of `indices` which depend on an unsaved object,
+        the other batches are returned. If `preceding` is True, only objects
+        of the preceding batches are checked.
+        """
+        result: list[int] = []
+        for index in indices:
+            for dependency in self.batches[index].dependencies:
+                if preceding and dependency.batch > index:
+                    continue
+                command = dependency.command
+                if command is None or command in self.written:
+                    continue
+                obj = dependency.object
+                self.errors[index] = LinkedObjectNotSavedException(
+                    f'linked {obj.__class__.__name__} \'{obj._id}\' '
+                    'is not saved')
+                break
+            else:
+                result.append(index)
+        return result
+
+    def execute(self) -> None:
+        for indices in self._levels():
+            self._execute(self._fail_dependents(indices, preceding=True))
+        self._fail_dependents([index for index in range(len(self.batches))
+                               if index not in self.errors])
+
+    def _execute(self, indices: list[int]) -> None:
+        groups: dict[str, tuple[Collection, list[tuple[int, Command]]]] = {}
+        for index in indices:
+            for command in self.batches[index].commands:
+                collection = getattr(command, 'collection')
+                key = collection.full_name
+                if groups.get(key) is None:
+                    groups[key] = (collection, [])
+                groups[key][1].append((index, command))
+        for collection, items in groups.values():
+            for start in range(0, len(items), self.chunk_size):
+                chunk = items[start:start + self.chunk_size]
+                self._write(collection, chunk)
+
+    def _write(self,
+               collection: Collection,
+               items: list[tuple[int, Command]]) -> None:
+        items = [item for item in items if item[0] not in self.errors]
+        if len(items) == 0:
+            return
+        ordered = BulkCommand(collection, [c for _, c in items]).ordered
+        while len(items) > 0:
+            try:
+                operations = [command.operation() for _, command in items]
+                collection.bulk_write(operations, ordered=ordered)
+                self.written.update(command for _, command in items)
+                return
+            except BulkWriteError as exception:
+                errors = exception.details.get('writeErrors', [])
+                if len(errors) == 0:
+                    raise
+                self.written.update(command for _, command in
+                                    written_commands(items, exception, ordered))
+                for error in errors:
+                    index = items[error['index']][0]
+                    if index not in self.errors:
+                        self.errors[index] = write_error(error)
+                if not ordered:
+                    return
+                rest = items[errors[-1]['index'] + 1:]
+                items = [item for item in rest if item[0] not in self.errors]
@@ -7,12 +7,29 @@ from jsonclasses.uconf import uconf
 from pymongo.mongo_client import MongoClient
 from pymongo.database import Database
 from pymongo.collection import Collection
+from pymongo.asynchronous.mongo_client import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.asynchronous.collection import AsyncCollection
 if TYPE_CHECKING:
     from .pobject import PObject
     T = TypeVar('T', bound=PObject, covariant=True)
 
 
 ConnectedCallback = Callable[[Collection], None]
+KEYED_LOOKUP_WIRE_VERSION = 13
+
+
+def handshake_wire_version(
+        client: Optional[MongoClient | AsyncMongoClient]) -> Optional[int]:
+    """The wire version of the server a client is connected to. It's told by
+    the connection handshake, None if no server is known yet.
+    """
+    if client is None:
+        return None
+    for server in client.topology_description.server_descriptions().values():
+        if server.is_server_type_known:
+            return server.max_wire_version
+    return None
 
 
 class Connection:
@@ -34,6 +51,7 @@ class Connection:
         self._collections: dict[str, Collection] = {}
         self._connection_callbacks: dict[str, ConnectedCallback] = {}
         self._connected: bool = False
+        self._server_version: Optional[tuple[int, ...]] = None
         self.__class__._initialized_map[graph_name] = True
         return None
 
@@ -96,6 +114,32 @@ class Connection:
     def connected(self: Collection) -> bool:
         return self._connected
 
+    @property
+    def server_version(self: Connection) -> Optional[tuple[int, ...]]:
+        return self._server_version
+
+    def set_server_version(self: Connection,
+                           version: Optional[tuple[int, ...]]) -> None:
+        """Set the server version instead of reading the features of the
+        server from the connection handshake.
+        """
+        self._server_version = version
+
+    @property
+    def keyed_lookup(self: Connection) -> bool:
+        """Whether the server accepts `localField` and `foreignField`
+        together with `pipeline` in `$lookup`. It's False until a sync or
+        async connection of this graph is established, if the server version
+        isn't set. Nothing is sent to the server.
+        """
+        if self._server_version is not None:
+            return self._server_version >= (5, 0)
+        version = handshake_wire_version(self._client)
+        if version is None:
+            version = handshake_wire_version(
+                AsyncConnection(self.graph_name)._client)
+        return version is not None and version >= KEYED_LOOKUP_WIRE_VERSION
+
     def collection(self: Connection, name: str, index_keys: list[str] | None = None) -> Collection:
         if self._collections.get(name) is not None:
             return self._collections[name]
@@ -128,14 +172,106 @@ class Connection:
     @classmethod
     def get_collection(cls: type[Connection],
                        pmcls: type[T]) -> Collection:
-        graph = pmcls.cdef.jconf.cgraph.name
-        connection = Connection(graph)
-        return connection.collection_from(pmcls)
+        return cls.from_class(pmcls).collection_from(pmcls)
 
     @classmethod
     def from_class(cls: type[Connection],
                    pmcls: type[T]) -> Connection:
-        return Connection(pmcls.cdef.jconf.cgraph.name)
+        return Connection(pmcls.pconf.graph_name)
 
 
 Connection.default = Connection('default')
+
+
+class AsyncConnection:
+    """The asyncio counterpart of `Connection`. An async connection uses the
+    url of the `Connection` with the same graph name. Indexes are maintained
+    by `Connection`.
+    """
+    _graph_map: dict[str, AsyncConnection] = {}
+    _initialized_map: dict[str, bool] = {}
+
+    def __new__(cls: type[AsyncConnection],
+                graph_name: str) -> AsyncConnection:
+        if not cls._graph_map.get(graph_name):
+            cls._graph_map[graph_name] = \
+                super(AsyncConnection, cls).__new__(cls)
+        return cls._graph_map[graph_name]
+
+    def __init__(self: AsyncConnection, graph_name: str) -> None:
+        if self.__class__._initialized_map.get(graph_name):
+            return
+        self._graph_name: str = graph_name
+        self._client: Optional[AsyncMongoClient] = None
+        self._database: Optional[AsyncDatabase] = None
+        self._collections: dict[str, AsyncCollection] = {}
+        self._connected: bool = False
+        self.__class__._initialized_map[graph_name] = True
+        return None
+
+    @property
+    def graph_name(self: AsyncConnection) -> str:
+        return self._graph_name
+
+    @property
+    def url(self: AsyncConnection) -> str:
+        return Connection(self.graph_name).url
+
+    @property
+    def client(self: AsyncConnection) -> AsyncMongoClient:
+        if self._client is not None:
+            return self._client
+        self.connect()
+        return self._client
+
+    @property
+    def database(self: AsyncConnection) -> AsyncDatabase:
+        if self._database is not None:
+            return self._database
+        self.connect()
+        return self._database
+
+    def connect(self: AsyncConnection) -> None:
+        self._client = AsyncMongoClient(self.url)
+        self._database = self._client.get_database()
+        self._connected = True
+
+    async def disconnect(self: AsyncConnection) -> None:
+        if self._client is not None:
+            client = self._client
+            self._client = None
+            self._database = None
+            self._collections = {}
+            self._connected = False
+            await client.close()
+
+    @property
+    def connected(self: AsyncConnection) -> bool:
+        return self._connected
+
+    def collection(self: AsyncConnection, name: str) -> AsyncCollection:
+        if self._collections.get(name) is not None:
+            return self._collections[name]
+        coll = self.database.get_collection(name)
+        self._collections[name] = coll
+        return coll
+
+    def collection_from(self: AsyncConnection,
+                        cls: type[T]) -> AsyncCollection:
+        coll_name = cls.pconf.collection_name
+        return self.collection(coll_name)
+
+    default: ClassVar[AsyncConnection]
+
+    @classmethod
+    def get_collection(cls: type[AsyncConnection],
+                       pmcls: type[T]) -> AsyncCollection:
+        return cls.from_class(pmcls).collection_from(pmcls)
+
+    @classmethod
+    def from_class(cls: type[AsyncConnection],
+                   pmcls: type[T]) -> AsyncConnection:
+        return AsyncConnection(pmcls.pconf.graph_name)
+
+
+AsyncConnection.default = AsyncConnection('default')
@@ -1,27 +1,89 @@
 """This module defines encoding and decoding context objects."""
 from __future__ import annotations
-from typing import NamedTuple, Any, Union, TYPE_CHECKING
+from typing import Any, Optional, Union, cast, TYPE_CHECKING
+from jsonclasses.keypath import concat_keypath
 from jsonclasses.types import Types
 from jsonclasses.mgraph import MGraph
 if TYPE_CHECKING:
     from .pobject import PObject
 
 
-class EncodingContext(NamedTuple):
+class EncodingContext:
     """Encoding context contains necessary information for encoding JSON Class
     objects into database writing commands.
+
+    Keypaths are only needed for reporting, they are built from the chain of
+    contexts when they are read.
     """
-    value: Any
-    types: Types
-    keypath_root: str
-    root: PObject
-    keypath_owner: str
-    owner: PObject
-    keypath_parent: str
-    parent: Union[list[Any], dict[str, Any], PObject]
-    mark_graph: MGraph
-
-    def new(self, **kwargs):
+
+    __slots__ = ('value', 'types', 'root', 'owner', 'parent', 'mark_graph',
+                 'keypath_parent', '_base', '_owner_changed',
+                 '_keypath_root', '_keypath_owner')
+
+    def __init__(self: EncodingContext,
+                 value: Any,
+                 types: Types,
+                 keypath_root: Optional[str],
+                 root: PObject,
+                 keypath_owner: Optional[str],
+                 owner: PObject,
+                 keypath_parent: str,
+                 parent: Union[list[Any], dict[str, Any], PObject],
+                 mark_graph: MGraph) -> None:
+        self.value = value
+        self.types = types
+        self.root = root
+        self.owner = owner
+        self.parent = parent
+        self.mark_graph = mark_graph
+        self.keypath_parent = keypath_parent
+        self._base: Optional[EncodingContext] = None
+        self._owner_changed = False
+        self._keypath_root = keypath_root
+        self._keypath_owner = keypath_owner
+
+    @property
+    def keypath_root(self: EncodingContext) -> str:
+        if self._keypath_root is None:
+            self._keypath_root = concat_keypath(
+                cast(EncodingContext, self._base).keypath_root,
+                self.keypath_parent)
+        return self._keypath_root
+
+    @property
+    def keypath_owner(self: EncodingContext) -> str:
+        if self._keypath_owner is None:
+            if self._owner_changed:
+                self._keypath_owner = self.keypath_parent
+            else:
+                self._keypath_owner = concat_keypath(
+                    cast(EncodingContext, self._base).keypath_owner,
+                    self.keypath_parent)
+        return self._keypath_owner
+
+    def child(self: EncodingContext,
+              value: Any,
+              types: Types,
+              key: str | int,
+              parent: Union[list[Any], dict[str, Any], PObject],
+              owner: Optional[PObject] = None) -> EncodingContext:
+        """Return the context of a nested value at `key`. If `owner` is
+        provided, the owner keypath restarts from the nested value.
+        """
+        context = EncodingContext(value=value,
+                                  types=types,
+                                  keypath_root=None,
+                                  root=self.root,
+                                  keypath_owner=None,
+                                  owner=owner or self.owner,
+                                  keypath_parent=str(key),
+                                  parent=parent,
+                                  mark_graph=self.mark_graph)
+        context._base = self
+        context._owner_changed = owner is not None
+        return context
+
+    def new(self: EncodingContext, **kwargs: Any) -> EncodingContext:
         """Return a new encoding context by replacing provided values."""
         keys = kwargs.keys()
         return EncodingContext(
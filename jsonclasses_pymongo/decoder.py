@@ -4,6 +4,8 @@ from datetime import date, timezone
 from jsonclasses.types import Types
 from jsonclasses.fdef import FStore, FType
 from jsonclasses.mgraph import MGraph
+from jsonclasses.jfield import JField
+from jsonclasses.outils import to_owned_dict, to_owned_list
 from .utils import (ref_db_field_key, ref_db_field_keys)
 if TYPE_CHECKING:
     from .query import BaseQuery
@@ -11,7 +13,139 @@ if TYPE_CHECKING:
     T = TypeVar('T', bound=PObject)
 
 
+PRIMARY = 1
+FOREIGN_KEY_STORE = 2
+LOCAL_ONE_REF = 3
+LOCAL_MANY_REF = 4
+INST_FIELD = 5
+EMBEDDED = 6
+
+DIRECT_FTYPES = {FType.STR, FType.INT, FType.FLOAT, FType.BOOL,
+                 FType.DATETIME}
+
+
+class FieldPlan:
+    """Field plan holds everything the decoder needs to know about a field,
+    resolved once per class instead of once per document.
+    """
+
+    __slots__ = ('name', 'kind', 'key', 'types', 'ftype', 'direct', 'lazy',
+                 'inst_cls', 'item_cls', 'ref_key', 'ref_name')
+
+    def __init__(self: FieldPlan, cls: type[PObject], field: JField) -> None:
+        self.name = field.name
+        self.key = cls.pconf.to_db_key(field.name)
+        self.types = field.types
+        self.ftype = field.fdef.ftype
+        self.direct = False
+        self.lazy = False
+        self.inst_cls = None
+        self.item_cls = None
+        self.ref_key = None
+        self.ref_name = None
+        if field.is_primary:
+            self.kind = PRIMARY
+        elif field.is_foreign_key_store:
+            self.kind = FOREIGN_KEY_STORE
+            self.inst_cls = field.fdef.inst_cls
+            if field.fdef.item_types is not None:
+                self.item_cls = field.fdef.item_types.fdef.raw_inst_types
+        elif field.is_local_one_ref:
+            self.kind = LOCAL_ONE_REF
+            self.inst_cls = field.fdef.inst_cls
+            self.ref_key = ref_db_field_key(field.name, cls=cls)
+            self.ref_name = field.ref_name
+        elif field.is_local_many_ref:
+            self.kind = LOCAL_MANY_REF
+            self.inst_cls = field.fdef.inst_cls
+            self.ref_key = ref_db_field_keys(field.name, cls)
+            self.ref_name = field.ref_name
+        elif field.is_inst_field:
+            self.kind = INST_FIELD
+            self.inst_cls = field.fdef.inst_cls
+        else:
+            self.kind = EMBEDDED
+            self.direct = self.ftype in DIRECT_FTYPES
+            # a class attribute would shadow a pending field
+            self.lazy = not hasattr(cls, field.name)
+
+
+class DecodePlan:
+    """Decode plan of a class. Calculated fields are never decoded, they are
+    left out of the plan.
+    """
+
+    def __init__(self: DecodePlan, cls: type[PObject]) -> None:
+        self.fields = [FieldPlan(cls, field) for field in cls.cdef.fields
+                       if field.fdef.fstore != FStore.CALCULATED]
+        self.setattr = cls.__original_setattr__
+
+
+class QueryPlan:
+    """Query plan holds the subqueries and the picked fields of a query."""
+
+    def __init__(self: QueryPlan, query: BaseQuery | None) -> None:
+        self.query = query
+        self.subqueries: dict[str, BaseQuery | None] = {}
+        for subquery in getattr(query, 'subqueries', []):
+            self.subqueries.setdefault(subquery.name, subquery.query)
+        self.final_pick: list[str] | None = getattr(query, '_final_pick', None)
+
+
+class LazyFields:
+    """Lazy fields hold the raw document of a lazily decoded object and its
+    embedded fields which are not decoded yet. A pending field is removed
+    from the object and decoded on its first access.
+    """
+
+    __slots__ = ('document', 'pending')
+
+    def __init__(self: LazyFields,
+                 document: dict[str, Any],
+                 pending: dict[str, FieldPlan]) -> None:
+        self.document = document
+        self.pending = pending
+
+    def load(self: LazyFields, dest: PObject, name: str) -> None:
+        """Decode the pending field `name` of `dest`. The object is not
+        marked modified.
+        """
+        field = self.pending.pop(name)
+        plan = decode_plan(dest.__class__)
+        decoder = Decoder()
+        value = decoder.decode_embedded(self.document.get(field.key),
+                                        dest.__class__, field, MGraph())
+        if isinstance(value, list):
+            value = to_owned_list(dest, value, name)
+        elif isinstance(value, dict):
+            value = to_owned_dict(dest, value, name)
+        plan.setattr(dest, name, value)
+        decoder.mark_decoded()
+        if len(self.pending) == 0:
+            plan.setattr(dest, '_lazy_fields', None)
+
+
+_decode_plans: dict[type, DecodePlan] = {}
+
+
+def decode_plan(cls: type[PObject]) -> DecodePlan:
+    plan = _decode_plans.get(cls)
+    if plan is None:
+        plan = DecodePlan(cls)
+        _decode_plans[cls] = plan
+    return plan
+
+
 class Decoder:
+    """Decoder decodes documents into objects. A lazy decoder leaves embedded
+    fields in the raw documents until they are accessed, it's meant for
+    `RawBSONDocument` results.
+    """
+
+    def __init__(self: Decoder, lazy: bool = False) -> None:
+        self.lazy = lazy
+        self._query_plans: dict[int, QueryPlan] = {}
+        self._decoded: dict[int, PObject] = {}
 
     def decode_list(self,
                     value: list[Any],
@@ -76,82 +210,109 @@ class Decoder:
                         types: Types,
                         graph: MGraph,
                         query: BaseQuery | None = None) -> Any:
+        plan = decode_plan(cls)
+        qplan = self.query_plan(query)
         inst_id = str(value.get('_id')) if value.get('_id') is not None else None
         dest = graph.getp(cls, inst_id)
         exist = True
         if dest is None:
             dest = cls()
             exist = False
-        for field in cls.cdef.fields:
-            key = cls.pconf.to_db_key(field.name)
-            if field.is_primary:
+        pending: Optional[dict[str, FieldPlan]] = None
+        for field in plan.fields:
+            kind = field.kind
+            if kind == EMBEDDED:
+                if exist:
+                    continue
+                if self.lazy and field.lazy:
+                    if field.key in value:
+                        if pending is None:
+                            pending = {}
+                        pending[field.name] = field
+                        del dest.__dict__[field.name]
+                    continue
+                item = self.decode_embedded(value.get(field.key), cls, field,
+                                            graph)
+                if field.direct:
+                    plan.setattr(dest, field.name, item)
+                else:
+                    setattr(dest, field.name, item)
+            elif kind == PRIMARY:
                 if not exist:
                     setattr(dest, field.name, inst_id)
                     graph.put(dest)
-            elif field.is_foreign_key_store:
-                if value.get(key) is not None:
-                    subquery = None
-                    if query:
-                        subquery = next((s.query for s in query.subqueries if s.name == field.name), None)
-                    if isinstance(value.get(key), list):
-                        t = field.fdef.item_types
-                        new_cls = t.fdef.raw_inst_types
-                        setattr(dest, field.name,
-                                self.decode_list(
-                                    value[key], new_cls, field.types, graph, subquery))
+            elif kind == FOREIGN_KEY_STORE:
+                item = value.get(field.key)
+                if item is not None:
+                    subquery = qplan.subqueries.get(field.name)
+                    if isinstance(item, list):
+                        setattr(dest, field.name, self.decode_list(
+                            item, field.item_cls, field.types, graph, subquery))
                     else:
-                        new_cls = field.fdef.inst_cls
-                        setattr(dest, field.name,
-                                self.decode_instance(
-                                    cast(dict[str, Any], value.get(key)),
-                                    new_cls, field.types, graph, subquery))
-            elif field.is_local_one_ref:
-                if value.get(key) is not None:
-                    subquery = None
-                    if query:
-                        subquery = next((s.query for s in query.subqueries if s.name == field.name), None)
-                    new_cls = field.fdef.inst_cls
+                        setattr(dest, field.name, self.decode_instance(
+                            cast(dict[str, Any], item),
+                            field.inst_cls, field.types, graph, subquery))
+            elif kind == LOCAL_ONE_REF:
+                item = value.get(field.key)
+                if item is not None:
+                    subquery = qplan.subqueries.get(field.name)
                     inst = self.decode_item(
-                        value=value.get(key), types=field.types, cls=new_cls,
+                        value=item, types=field.types, cls=field.inst_cls,
                         graph=graph, query=subquery)
                     setattr(dest, field.name, inst)
-                ref_id = value.get(ref_db_field_key(field.name, cls=cls))
-                rfk = field.ref_name
-                setattr(dest, rfk, str(ref_id))
-                if query and hasattr(query, '_final_pick'):
-                    if rfk not in query._final_pick:
-                        setattr(dest, rfk, None)
-            elif field.is_local_many_ref:
-                if value.get(key) is not None:
-                    subquery = None
-                    if query:
-                        subquery = next((s.query for s in query.subqueries if s.name == field.name), None)
-                    new_cls = field.fdef.inst_cls
-                    setattr(dest, field.name,
-                            self.decode_list(
-                                value[key], new_cls, field.types, graph, subquery))
-                saved_keys = value.get(ref_db_field_keys(field.name, cls))
+                ref_id = str(value.get(field.ref_key))
+                if qplan.final_pick is not None:
+                    if field.ref_name not in qplan.final_pick:
+                        ref_id = None
+                if item is None:
+                    setattr(dest, field.ref_name, ref_id)
+                else:
+                    # setting the key would unset the included object
+                    plan.setattr(dest, field.ref_name, ref_id)
+            elif kind == LOCAL_MANY_REF:
+                item = value.get(field.key)
+                if item is not None:
+                    subquery = qplan.subqueries.get(field.name)
+                    setattr(dest, field.name, self.decode_list(
+                        item, field.inst_cls, field.types, graph, subquery))
+                saved_keys = value.get(field.ref_key)
                 if saved_keys:
                     setattr(dest, field.ref_name, [str(k) for k in saved_keys])
-            elif field.is_inst_field:
-                new_cls = field.fdef.inst_cls
+            elif kind == INST_FIELD:
                 setattr(dest, field.name, self.decode_item(
-                    value=value.get(key), types=field.types, cls=new_cls,
-                    graph=graph))
-            else:
-                if not exist and field.fdef.fstore != FStore.CALCULATED:
-                    setattr(
-                        dest,
-                        field.name,
-                        self.decode_item(value=value.get(key),
-                                         types=field.types,
-                                         cls=cls, graph=graph))
+                    value=value.get(field.key), types=field.types,
+                    cls=field.inst_cls, graph=graph))
+        if pending is not None:
+            plan.setattr(dest, '_lazy_fields', LazyFields(value, pending))
         # apply partial status
-        if hasattr(query, '_final_pick'):
+        if qplan.final_pick is not None:
             setattr(dest, '_is_partial', True)
-            setattr(dest, '_partial_picks', getattr(query, '_final_pick'))
+            setattr(dest, '_partial_picks', qplan.final_pick)
+        self._decoded[id(dest)] = dest
         return dest
 
+    def decode_embedded(self: Decoder,
+                        item: Any,
+                        cls: type[T],
+                        field: FieldPlan,
+                        graph: MGraph) -> Any:
+        if field.direct:
+            if field.ftype == FType.DATETIME and item is not None:
+                return item.replace(tzinfo=timezone.utc)
+            return item
+        return self.decode_item(value=item, cls=cls, types=field.types,
+                                graph=graph)
+
+    def query_plan(self: Decoder, query: BaseQuery | None) -> QueryPlan:
+        """Get the cached plan of a query. A decoder decodes a result with a
+        same query many times, thus subqueries are looked up once only.
+        """
+        plan = self._query_plans.get(id(query))
+        if plan is None or plan.query is not query:
+            plan = QueryPlan(query)
+            self._query_plans[id(query)] = plan
+        return plan
+
     def apply_unmodified_status(self, root: T,
                              graph: Optional[MGraph] = None) -> None:
         if graph is None:
@@ -169,6 +330,16 @@ class Decoder:
                         self.apply_unmodified_status(item, graph)
         root._mark_unmodified()
 
+    def mark_decoded(self: Decoder) -> None:
+        """Mark the objects decoded since the last call unmodified. Decoding
+        records every object it builds or reaches, thus the graph is not
+        walked again. Marking waits until decoding is done, linking an object
+        modifies the objects it's linked to.
+        """
+        for obj in self._decoded.values():
+            obj._mark_unmodified()
+        self._decoded.clear()
+
     def decode_root(self,
                     root: dict[str, Any],
                     cls: type[T],
@@ -178,7 +349,7 @@ class Decoder:
             graph = MGraph()
         types = Types().objof(cls)
         decoded = self.decode_instance(root, cls, types, graph, query)
-        self.apply_unmodified_status(decoded)
+        self.mark_decoded()
         return decoded
 
     def decode_root_list(self,
@@ -193,6 +364,5 @@ class Decoder:
         for root in root_list:
             decoded = self.decode_instance(root, cls, types, graph, query)
             results.append(decoded)
-        for result in results:
-            self.apply_unmodified_status(result)
+        self.mark_decoded()
         return results
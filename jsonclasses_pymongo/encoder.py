@@ -1,10 +1,10 @@
 from __future__ import annotations
-from typing import Any, NamedTuple, TypeVar, cast, TYPE_CHECKING
+from typing import Any, NamedTuple, Optional, TypeVar, cast, TYPE_CHECKING
+import builtins
 from datetime import datetime, timezone
 from bson.objectid import ObjectId
 from jsonclasses.jfield import JField
 from jsonclasses.fdef import FStore, FType
-from jsonclasses.keypath import concat_keypath
 from jsonclasses.mgraph import MGraph
 from jsonclasses.types import types
 from .utils import (
@@ -26,8 +26,143 @@ class EncodingResult(NamedTuple):
     commands: list[Command]
 
 
+PRIMARY = 1
+FOREIGN_ONE_REF = 2
+FOREIGN_MANY_REF = 3
+LOCAL_ONE_REF = 4
+LOCAL_MANY_REF = 5
+EMBEDDED = 6
+
+ENCODED_FTYPES = {FType.LIST, FType.DICT, FType.INSTANCE, FType.DATE,
+                  FType.ENUM}
+
+
+class FieldPlan:
+    """Field plan holds everything the encoder needs to know about a field,
+    resolved once per class instead of once per object.
+    """
+
+    __slots__ = ('field', 'name', 'kind', 'key', 'types', 'direct',
+                 'ref_name', 'foreign_primary', 'join_table')
+
+    def __init__(self: FieldPlan, cls: type[PObject], field: JField) -> None:
+        self.field = field
+        self.name = field.name
+        self.types = field.types
+        self.direct = False
+        self.ref_name = None
+        self.foreign_primary = None
+        self.join_table = False
+        if field.is_primary:
+            self.kind = PRIMARY
+            self.key = '_id'
+        elif field.is_foreign_one_ref:
+            self.kind = FOREIGN_ONE_REF
+            self.key = None
+        elif field.is_foreign_many_ref:
+            self.kind = FOREIGN_MANY_REF
+            self.key = None
+            self.join_table = field.is_join_table_ref
+        elif field.is_local_one_ref:
+            self.kind = LOCAL_ONE_REF
+            self.key = ref_db_field_key(field.name, cls)
+            self.ref_name = cls.cdef.jconf.ref_name_strategy(field)
+            self.foreign_primary = field.foreign_cdef.primary_field
+        elif field.is_local_many_ref:
+            self.kind = LOCAL_MANY_REF
+            self.key = ref_db_field_keys(field.name, cls)
+            self.ref_name = cls.cdef.jconf.ref_name_strategy(field)
+            self.foreign_primary = field.foreign_cdef.primary_field
+        else:
+            self.kind = EMBEDDED
+            self.key = cls.pconf.to_db_key(field.name)
+            self.direct = field.fdef.ftype not in ENCODED_FTYPES
+
+
+class EncodePlan:
+    """Encode plan of a class. Temporary and calculated fields are never
+    written, they are left out of the plan.
+    """
+
+    def __init__(self: EncodePlan, cls: type[PObject]) -> None:
+        self.fields = [FieldPlan(cls, field) for field in cls.cdef.fields
+                       if field.fdef.fstore not in (FStore.TEMP,
+                                                    FStore.CALCULATED)]
+
+
+_encode_plans: dict[type, EncodePlan] = {}
+
+
+def encode_plan(cls: type[PObject]) -> EncodePlan:
+    plan = _encode_plans.get(cls)
+    if plan is None:
+        plan = EncodePlan(cls)
+        _encode_plans[cls] = plan
+    return plan
+
+
+class ObjectWrite:
+    """The write of an encoded object. `command` is the command which saves
+    the object, None if the object has nothing to write. An embedded object is
+    saved by the command of the object it's embedded in. `batch` is the index
+    of the root it's encoded for.
+    """
+
+    __slots__ = ('object', 'command', 'embedded', 'batch')
+
+    def __init__(self: ObjectWrite,
+                 object: PObject,
+                 embedded: bool,
+                 batch: int) -> None:
+        self.object = object
+        self.command: Optional[Command] = None
+        self.embedded = embedded
+        self.batch = batch
+
+
+def mark_saved(writes: list[ObjectWrite], written: set[Command]) -> None:
+    """Mark the objects whose commands are written as saved. Objects which
+    fail to be written keep their new and modified status, thus they are
+    written again when saved again.
+    """
+    for write in writes:
+        if write.command is not None and write.command not in written:
+            continue
+        value = write.object
+        setattr(value, '_is_new', False)
+        setattr(value, '_is_modified', False)
+        setattr(value, '_modified_fields', set())
+        setattr(value, '_previous_values', {})
+
+
 class Encoder:
-    """Write commands encoder."""
+    """Write commands encoder. The encoder records the write of each encoded
+    object, objects are marked saved after their commands are written.
+    """
+
+    def __init__(self: Encoder) -> None:
+        self._batch = 0
+        self._writes: dict[int, ObjectWrite] = {}
+        self._objects: list[ObjectWrite] = []
+        self._dependencies: list[ObjectWrite] = []
+        self._dependents: list[tuple[int, ObjectWrite]] = []
+
+    def _depend(self, context: EncodingContext, write: ObjectWrite) -> None:
+        """Record the dependency between the batch being encoded and the
+        batch of a linked object `write`. The one which stores the reference
+        depends on the other.
+        """
+        owner = cast('PObject', context.owner)
+        stores_reference = True
+        if context.types.fdef.fstore == FStore.FOREIGN_KEY:
+            name = context.keypath_owner.split('.')[0]
+            field = owner.__class__.cdef.field_named(name)
+            stores_reference = field.is_join_table_ref
+        if stores_reference:
+            self._dependencies.append(write)
+        else:
+            owner_write = self._writes[builtins.id(owner)]
+            self._dependents.append((write.batch, owner_write))
 
     def encode_list(self, context: EncodingContext) -> EncodingResult:
         if context.value is None:
@@ -42,13 +177,8 @@ class Encoder:
         result = []
         commands = []
         for index, item in enumerate(value):
-            item_result, item_commands = self.encode_item(context.new(
-                value=item,
-                types=item_types,
-                keypath_root=concat_keypath(context.keypath_root, index),
-                keypath_owner=concat_keypath(context.keypath_owner, index),
-                keypath_parent=str(index),
-                parent=value))
+            item_result, item_commands = self.encode_item(context.child(
+                value=item, types=item_types, key=index, parent=value))
             result.append(item_result)
             commands.extend(item_commands)
         return EncodingResult(result, commands)
@@ -61,13 +191,8 @@ class Encoder:
         result = {}
         commands = []
         for key, item in value.items():
-            item_result, item_commands = self.encode_item(context.new(
-                value=item,
-                types=item_types,
-                keypath_root=concat_keypath(context.keypath_root, key),
-                keypath_owner=concat_keypath(context.keypath_owner, key),
-                keypath_parent=str(key),
-                parent=value))
+            item_result, item_commands = self.encode_item(context.child(
+                value=item, types=item_types, key=key, parent=value))
             result[key] = item_result
             commands.extend(item_commands)
         return EncodingResult(result, commands)
@@ -114,6 +239,46 @@ class Encoder:
         }
         return DeleteOneCommand(collection=collection, matcher=matcher)
 
+    def _join_table_commands(self,
+                             value: PObject,
+                             field: JField,
+                             item_result: list[Any]) -> list[Command]:
+        commands: list[Command] = []
+        for list_item in item_result:
+            if list_item.get('_id'):
+                join_command = self._join_command(
+                    value,
+                    field,
+                    list_inst_type(field),
+                    list_item['_id'])
+                commands.append(join_command)
+        if value.unlinked_objects.get(field.name) is not None:
+            for item in value.unlinked_objects[field.name]:
+                if item._id is not None:
+                    unlink_command = self._unlink_command(
+                        value,
+                        field,
+                        list_inst_type(field),
+                        dbid(item))
+                    commands.append(unlink_command)
+        if value._link_keys.get(field.name) is not None:
+            for k in value._link_keys.get(field.name):
+                join_command = self._join_command(
+                    value,
+                    field,
+                    list_inst_type(field),
+                    ObjectId(k))
+                commands.append(join_command)
+        if value._unlink_keys.get(field.name) is not None:
+            for k in value._unlink_keys.get(field.name):
+                unlink_command = self._unlink_command(
+                    value,
+                    field,
+                    list_inst_type(field),
+                    ObjectId(k))
+                commands.append(unlink_command)
+        return commands
+
     def encode_instance(self,
                         context: EncodingContext,
                         root: bool = False) -> EncodingResult:
@@ -124,13 +289,24 @@ class Encoder:
         cls = value.__class__
         id = cast(str | int, value._id)
         previous_id = cast(str | int, value._previous_id)
+        write = self._writes.get(builtins.id(value))
+        if write is not None and write.batch > self._batch:
+            self._depend(context, write)
+            return EncodingResult({'_id': dbid(value)}, commands=[])
         if context.mark_graph.getp(cls, id) is not None:
+            if write is not None and write.batch != self._batch:
+                self._depend(context, write)
             return EncodingResult({'_id': dbid(value)}, commands=[])
         context.mark_graph.put(value)
         instance_fd = context.types.fdef
         write_instance = instance_fd.fstore != FStore.EMBEDDED
         if root:
             write_instance = True
+        if write is None:
+            write = ObjectWrite(value, not write_instance, self._batch)
+            self._writes[builtins.id(value)] = write
+        start = len(self._objects)
+        self._objects.append(write)
         use_insert_command = False
         fields_need_update: set[str] = value.persisted_modified_fields
         if value.is_new:
@@ -140,154 +316,87 @@ class Encoder:
         result_unset = {}
         matcher = {}
         commands = []
-        for field in value.__class__.cdef.fields:
-            if field.fdef.fstore == FStore.TEMP:
-                continue
-            if field.fdef.fstore == FStore.CALCULATED:
-                continue
+        for field in encode_plan(cls).fields:
+            kind = field.kind
             fname = field.name
             fvalue = getattr(value, fname)
-            ftypes = field.types
-            if field.is_primary:
-                result_set['_id'] = idval(field, fvalue)
-                if use_insert_command:
-                    pass
+            if kind == EMBEDDED:
+                if field.direct or fvalue is None:
+                    item_result = fvalue
                 else:
-                    matcher['_id'] = idval(field, previous_id)
-            elif field.is_foreign_one_ref:
+                    item_result, item_commands = self.encode_item(
+                        context.child(value=fvalue, types=field.types,
+                                      key=fname, parent=value))
+                    commands.extend(item_commands)
+                if use_insert_command:
+                    if item_result is not None:
+                        result_set[field.key] = item_result
+                elif fname in fields_need_update:
+                    if item_result is None:
+                        result_unset[field.key] = None
+                    else:
+                        result_set[field.key] = item_result
+            elif kind == PRIMARY:
+                result_set['_id'] = idval(field.field, fvalue)
+                if not use_insert_command:
+                    matcher['_id'] = idval(field.field, previous_id)
+            elif kind == FOREIGN_ONE_REF:
                 if fvalue is None:
                     continue
-                _, item_commands = self.encode_instance(context.new(
-                    value=fvalue,
-                    types=ftypes,
-                    keypath_root=concat_keypath(context.keypath_root, fname),
-                    keypath_owner=fname,
-                    owner=value,
-                    keypath_parent=fname,
-                    parent=value))
+                _, item_commands = self.encode_instance(context.child(
+                    value=fvalue, types=field.types, key=fname,
+                    parent=value, owner=value))
                 commands.extend(item_commands)
-            elif field.is_foreign_many_ref:
+            elif kind == FOREIGN_MANY_REF:
                 if fvalue is None:
                     continue
-                item_result, item_commands = self.encode_list(context.new(
-                    value=fvalue,
-                    types=ftypes,
-                    keypath_root=concat_keypath(context.keypath_root, fname),
-                    keypath_owner=fname,
-                    owner=value,
-                    keypath_parent=fname,
-                    parent=value))
+                item_result, item_commands = self.encode_list(context.child(
+                    value=fvalue, types=field.types, key=fname,
+                    parent=value, owner=value))
                 commands.extend(item_commands)
-                if not field.is_join_table_ref:
-                    continue
-                for list_item in item_result:
-                    if list_item.get('_id'):
-                        join_command = self._join_command(
-                            value,
-                            field,
-                            list_inst_type(field),
-                            list_item['_id'])
-                        commands.append(join_command)
-                if value.unlinked_objects.get(field.name) is not None:
-                    for item in value.unlinked_objects[field.name]:
-                        if item._id is not None:
-                            unlink_command = self._unlink_command(
-                                value,
-                                field,
-                                list_inst_type(field),
-                                dbid(item))
-                            commands.append(unlink_command)
-                if value._link_keys.get(field.name) is not None:
-                    for k in value._link_keys.get(field.name):
-                        join_command = self._join_command(
-                            value,
-                            field,
-                            list_inst_type(field),
-                            ObjectId(k))
-                        commands.append(join_command)
-                if value._unlink_keys.get(field.name) is not None:
-                    for k in value._unlink_keys.get(field.name):
-                        unlink_command = self._unlink_command(
-                            value,
-                            field,
-                            list_inst_type(field),
-                            ObjectId(k))
-                        commands.append(unlink_command)
-            elif field.is_local_one_ref:
+                if field.join_table:
+                    commands.extend(self._join_table_commands(
+                        value, field.field, item_result))
+            elif kind == LOCAL_ONE_REF:
                 if fvalue is None:
-                    tsfm = value.__class__.cdef.jconf.ref_name_strategy
-                    if getattr(value, tsfm(field)) is not None:
+                    ref_id = getattr(value, field.ref_name)
+                    if ref_id is not None:
                         if use_insert_command or fname in fields_need_update:
-                            foreignid = idval(field.foreign_cdef.primary_field, getattr(value, tsfm(field)))
-                            result_set[ref_db_field_key(fname, cls)] = foreignid
-                    else:
-                        if use_insert_command:
-                            pass
-                        elif fname in fields_need_update:
-                            result_unset[ref_db_field_key(fname, cls)] = None
+                            result_set[field.key] = idval(
+                                field.foreign_primary, ref_id)
+                    elif not use_insert_command:
+                        if fname in fields_need_update:
+                            result_unset[field.key] = None
                     continue
-                item_result, item_commands = self.encode_instance(context.new(
-                    value=fvalue,
-                    types=ftypes,
-                    keypath_root=concat_keypath(context.keypath_root, fname),
-                    keypath_owner=fname,
-                    owner=value,
-                    keypath_parent=fname,
-                    parent=value))
+                item_result, item_commands = self.encode_instance(
+                    context.child(value=fvalue, types=field.types, key=fname,
+                                  parent=value, owner=value))
                 if use_insert_command or fname in fields_need_update:
-                    fname_ref = ref_db_field_key(fname, cls)
-                    result_set[fname_ref] = item_result['_id']
-                    setattr(value, field.ref_name,
-                                   str(item_result['_id']))
+                    result_set[field.key] = item_result['_id']
+                    setattr(value, field.ref_name, str(item_result['_id']))
                 commands.extend(item_commands)
-            elif field.is_local_many_ref:
+            elif kind == LOCAL_MANY_REF:
                 if fvalue is None:
                     if use_insert_command or fname in fields_need_update:
-                        result_set[ref_db_field_keys(fname, cls)] = None
+                        result_set[field.key] = None
                     continue
-                item_result, item_commands = self.encode_list(context.new(
-                    value=fvalue,
-                    types=ftypes,
-                    keypath_root=concat_keypath(context.keypath_root, fname),
-                    keypath_owner=fname,
-                    owner=value,
-                    keypath_parent=fname,
-                    parent=value))
-                if use_insert_command or fname in fields_need_update:
-                    tsfm = value.__class__.cdef.jconf.ref_name_strategy
-                    field_id_name = tsfm(field)
-                    id_list = [idval(field.foreign_cdef.primary_field, v) for v in getattr(value, field_id_name)]
-                    fname_ref = ref_db_field_keys(fname, cls)
-                    if use_insert_command:
-                        result_set[fname_ref] = id_list
-                    else:
-                        result_addtoset[fname_ref] = {'$each': id_list}
-                commands.extend(item_commands)
-            else:
-                item_result, item_commands = self.encode_item(context.new(
-                    value=fvalue,
-                    types=ftypes,
-                    keypath_root=concat_keypath(context.keypath_root, fname),
-                    keypath_owner=concat_keypath(context.keypath_owner, fname),
-                    owner=value,
-                    keypath_parent=fname,
-                    parent=value))
+                item_result, item_commands = self.encode_list(context.child(
+                    value=fvalue, types=field.types, key=fname,
+                    parent=value, owner=value))
                 if use_insert_command or fname in fields_need_update:
-                    efname = context.owner.__class__.pconf.to_db_key(fname)
+                    id_list = [idval(field.foreign_primary, v)
+                               for v in getattr(value, field.ref_name)]
                     if use_insert_command:
-                        if item_result is not None:
-                            result_set[efname] = item_result
+                        result_set[field.key] = id_list
                     else:
-                        if item_result is None:
-                            result_unset[efname] = None
-                        else:
-                            result_set[efname] = item_result
+                        result_addtoset[field.key] = {'$each': id_list}
                 commands.extend(item_commands)
         if write_instance:
             collection = Connection.get_collection(value.__class__)
             if use_insert_command:
                 insert_command = InsertOneCommand(collection, result_set)
                 commands.append(insert_command)
+                write.command = insert_command
             else:
                 updator = {}
                 if len(result_set) > 0:
@@ -299,11 +408,11 @@ class Encoder:
                 if len(updator) > 0:
                     update_c = UpdateOneCommand(collection, updator, matcher)
                     commands.append(update_c)
+                    write.command = update_c
+            for item in self._objects[start + 1:]:
+                if item.embedded and item.command is None:
+                    item.command = write.command
         value._clear_temp_fields()
-        setattr(value, '_is_new', False)
-        setattr(value, '_is_modified', False)
-        setattr(value, '_modified_fields', set())
-        setattr(value, '_previous_values', {})
         return EncodingResult(result_set, commands)
 
     def encode_item(self, context: EncodingContext) -> EncodingResult:
@@ -327,8 +436,8 @@ class Encoder:
         else:
             return EncodingResult(context.value, [])
 
-    def encode_root(self, root: T) -> BatchCommand:
-        commands = self.encode_instance(EncodingContext(
+    def _root_context(self, root: T, graph: MGraph) -> EncodingContext:
+        return EncodingContext(
             value=root,
             types=types.objof(root.__class__),
             keypath_root='',
@@ -337,5 +446,33 @@ class Encoder:
             owner=root,
             keypath_parent='',
             parent=root,
-            mark_graph=MGraph()), root=True)[1]
-        return BatchCommand(commands=commands)
+            mark_graph=graph)
+
+    def _encode_batch(self, root: T, graph: MGraph) -> BatchCommand:
+        self._objects = []
+        self._dependencies = []
+        context = self._root_context(root, graph)
+        commands = self.encode_instance(context, root=True)[1]
+        return BatchCommand(commands=commands,
+                            writes=self._objects,
+                            dependencies=self._dependencies)
+
+    def encode_root(self, root: T) -> BatchCommand:
+        return self._encode_batch(root, MGraph())
+
+    def encode_roots(self, roots: list[T]) -> list[BatchCommand]:
+        """Encode many roots with a shared mark graph. A linked object which
+        is shared by several roots is only encoded for the first of them, the
+        batches of the other roots depend on its write. A root is always
+        encoded for its own batch.
+        """
+        graph = MGraph()
+        batches: list[BatchCommand] = []
+        for index, root in enumerate(roots):
+            self._writes[id(root)] = ObjectWrite(root, False, index)
+        for index, root in enumerate(roots):
+            self._batch = index
+            batches.append(self._encode_batch(root, graph))
+        for index, write in self._dependents:
+            batches[index].dependencies.append(write)
+        return batches
@@ -6,3 +6,23 @@ class DatabaseNotConnectedException(Exception):
     def __init__(self, message: str):
         self.message = message
         super().__init__(self.message)
+
+
+class TooManyResultsException(Exception):
+    """This exception is raised when a list query returns more objects than
+    its `max_results`.
+    """
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+class LinkedObjectNotSavedException(Exception):
+    """This exception is raised for an object of `save_many` when a linked
+    object it shares with a failed object is not saved.
+    """
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,81 @@
+"""This module contains the summary of explained query plans. A plan is
+walked as a whole, thus find, aggregate and sharded plans are summarized
+alike.
+"""
+from __future__ import annotations
+from typing import Any, Iterator, NamedTuple, Optional
+
+
+VERBOSITIES = ('queryPlanner', 'executionStats', 'allPlansExecution')
+CANDIDATE_PLAN_KEYS = ('rejectedPlans', 'allPlansExecution')
+
+
+class Explanation(NamedTuple):
+    """The server plan of a query and a summary of it. Document counts and
+    unindexed lookups are only known with execution stats verbosities.
+    """
+    plan: dict[str, Any]
+    collscan: bool
+    indexes: list[str]
+    docs_examined: Optional[int]
+    docs_returned: Optional[int]
+    unindexed_lookups: list[str]
+
+
+def _walk(value: Any) -> Iterator[dict[str, Any]]:
+    """Iterate the dicts of a plan, candidate plans are left out."""
+    if isinstance(value, dict):
+        yield value
+        for key, item in value.items():
+            if key not in CANDIDATE_PLAN_KEYS:
+                yield from _walk(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _walk(item)
+
+
+def _docs_returned(plan: dict[str, Any]) -> Optional[int]:
+    stages = plan.get('stages')
+    if isinstance(stages, list) and len(stages) > 0:
+        last = stages[-1]
+        if 'nReturned' in last:
+            return last['nReturned']
+        if '$cursor' in last:
+            return _docs_returned(last['$cursor'])
+    stats = plan.get('executionStats')
+    if isinstance(stats, dict) and 'nReturned' in stats:
+        return stats['nReturned']
+    return None
+
+
+def _unindexed_lookups(plan: dict[str, Any]) -> list[str]:
+    result: list[str] = []
+    for item in _walk(plan):
+        lookup = item.get('$lookup')
+        if not isinstance(lookup, dict) or 'collectionScans' not in item:
+            continue
+        if item['collectionScans'] > 0:
+            result.append(lookup.get('from'))
+    return result
+
+
+def summarize(plan: dict[str, Any]) -> Explanation:
+    """Summarize an explained plan."""
+    collscan = False
+    indexes: list[str] = []
+    docs_examined: Optional[int] = None
+    for item in _walk(plan):
+        if item.get('stage') == 'COLLSCAN':
+            collscan = True
+        if isinstance(item.get('indexName'), str):
+            indexes.append(item['indexName'])
+        if isinstance(item.get('indexesUsed'), list):
+            indexes.extend(item['indexesUsed'])
+        if isinstance(item.get('totalDocsExamined'), int):
+            docs_examined = (docs_examined or 0) + item['totalDocsExamined']
+    return Explanation(plan=plan,
+                       collscan=collscan,
+                       indexes=list(dict.fromkeys(indexes)),
+                       docs_examined=docs_examined,
+                       docs_returned=_docs_returned(plan),
+                       unindexed_lookups=_unindexed_lookups(plan))
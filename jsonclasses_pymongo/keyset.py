@@ -0,0 +1,83 @@
+"""This module contains helpers of keyset pagination. A keyset token records
+the sort key values of a boundary document, the next page starts right after
+or before it.
+"""
+from __future__ import annotations
+from typing import Any, Optional
+from collections.abc import Mapping
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bson import decode, encode
+from bson.errors import BSONError
+
+
+class KeysetList(list):
+    """A page of keyset paginated objects. `next_token` continues after the
+    last object, `previous_token` continues before the first object. A token
+    is None if there's no more page in that direction.
+    """
+
+    def __init__(self: KeysetList,
+                 items: list[Any],
+                 next_token: Optional[str],
+                 previous_token: Optional[str]) -> None:
+        super().__init__(items)
+        self.next_token = next_token
+        self.previous_token = previous_token
+
+
+def keyset_sort(sort: Optional[list[tuple[str, int]]],
+                direction: int) -> list[tuple[str, int]]:
+    """The sort of a keyset paginated query. `_id` is appended to break ties.
+    The sort is reversed if pages are fetched backward.
+    """
+    result = list(sort or [])
+    if not any(key == '_id' for key, _ in result):
+        result.append(('_id', result[-1][1] if len(result) > 0 else 1))
+    if direction < 0:
+        result = [(key, -order) for key, order in result]
+    return result
+
+
+def keyset_matcher(sort: list[tuple[str, int]],
+                   values: list[Any]) -> dict[str, Any]:
+    """Match documents that come after `values` in `sort` order. Null and
+    missing values sort before any other value, comparisons never match them.
+    """
+    conditions = []
+    for index, (key, order) in enumerate(sort):
+        prefix = {k: v for (k, _), v in zip(sort[:index], values)}
+        value = values[index]
+        if order > 0:
+            if value is None:
+                conditions.append({**prefix, key: {'$ne': None}})
+            else:
+                conditions.append({**prefix, key: {'$gt': value}})
+        elif value is not None:
+            conditions.append({**prefix, key: {'$lt': value}})
+            conditions.append({**prefix, key: None})
+    return {'$or': conditions}
+
+
+def _value_at(document: dict[str, Any], key: str) -> Any:
+    value: Any = document
+    for name in key.split('.'):
+        value = value.get(name) if isinstance(value, Mapping) else None
+    return value
+
+
+def encode_token(document: dict[str, Any], sort: list[tuple[str, int]]) -> str:
+    keys = [key for key, _ in sort]
+    values = [_value_at(document, key) for key in keys]
+    data = encode({'k': keys, 'v': values})
+    return urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_token(token: str, sort: list[tuple[str, int]]) -> list[Any]:
+    keys = [key for key, _ in sort]
+    try:
+        data = decode(urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, BSONError):
+        raise ValueError('invalid cursor token') from None
+    if data.get('k') != keys or len(data.get('v', [])) != len(keys):
+        raise ValueError('cursor token does not match the query order')
+    return data['v']
@@ -0,0 +1,252 @@
+"""This module contains the batch loader of included objects. Instead of a
+`$lookup` per root document, related documents of an include are fetched with
+a single `$in` query per relation level after the root query. The fetched
+documents are put into the root documents as `$lookup` would, a document
+shared by several roots is fetched once.
+
+The loader is a generator which yields fetch requests and receives their
+results, thus it's driven by both sync and async queries.
+"""
+from __future__ import annotations
+from typing import (Any, Callable, Generator, NamedTuple, Optional,
+                    TYPE_CHECKING)
+from jsonclasses.fdef import FStore, FType
+from .connection import Connection, AsyncConnection
+from .utils import ref_db_field_key, ref_db_field_keys, join_table_name
+if TYPE_CHECKING:
+    from .pobject import PObject
+    from .query import BaseQuery, Subquery
+
+
+class LoadRequest(NamedTuple):
+    cls: type[PObject]
+    collection: str
+    pipeline: list[dict[str, Any]]
+
+
+Loader = Generator[LoadRequest, list[dict[str, Any]], Any]
+
+
+def batch_loader(cls: type[PObject],
+                 subqueries: list[Subquery],
+                 docs: list[dict[str, Any]]) -> Loader:
+    """Load the batch includes of `subqueries` into `docs`."""
+    for subquery in subqueries:
+        if subquery.strategy == 'batch' and len(docs) > 0:
+            yield from _load_include(cls, subquery, docs)
+
+
+def _unique(values: list[Any]) -> list[Any]:
+    return list(dict.fromkeys(v for v in values if v is not None))
+
+
+def _keep_keys(pipeline: list[dict[str, Any]], keys: list[str]) -> set[str]:
+    """Keep `keys` through the projections of `pipeline`. The keys which the
+    projections leave out are returned, they're stripped after stitching.
+    """
+    stripped: set[str] = set()
+    for index, stage in enumerate(pipeline):
+        if '$project' not in stage:
+            continue
+        project = dict(stage['$project'])
+        inclusive = any(v not in (0, False)
+                        for k, v in project.items() if k != '_id')
+        for key in keys:
+            value = project.get(key)
+            if value is None:
+                if not inclusive or key == '_id':
+                    continue
+            elif value not in (0, False):
+                continue
+            if inclusive:
+                project[key] = 1
+            else:
+                del project[key]
+            stripped.add(key)
+        pipeline[index] = {'$project': project}
+    return stripped
+
+
+def _loader_keys(cls: type[PObject], subqueries: list[Subquery]) -> list[str]:
+    """The keys of `cls` documents which its batch includes are loaded by."""
+    result = ['_id']
+    for subquery in subqueries:
+        if subquery.strategy != 'batch':
+            continue
+        field = cls.cdef.field_named(subquery.name)
+        if field.fdef.fstore != FStore.LOCAL_KEY:
+            continue
+        if field.fdef.ftype == FType.INSTANCE:
+            result.append(ref_db_field_key(subquery.name, cls))
+        else:
+            result.append(ref_db_field_keys(subquery.name, cls))
+    return result
+
+
+def _fetch(cls: type[PObject],
+           query: Optional[BaseQuery],
+           condition: dict[str, Any],
+           key: str = '_id') -> Loader:
+    """Fetch the related documents matching `condition`. The `_id` and the
+    `key` they're stitched by are kept even if the query picks them out, the
+    caller strips the returned keys after stitching.
+    """
+    pipeline = [{'$match': condition}]
+    stripped: set[str] = set()
+    if query is not None:
+        if getattr(query, '_window', None) is not None \
+                and query._window() != (None, None):
+            raise ValueError('batch include cannot be paginated')
+        pipeline.extend(query._aggregate_pipeline())
+        keys = _loader_keys(cls, query.subqueries)
+        stripped = _keep_keys(pipeline, [key, *keys])
+    related = yield LoadRequest(cls, cls.pconf.collection_name, pipeline)
+    if query is not None:
+        yield from batch_loader(cls, query.subqueries, related)
+    return related, stripped
+
+
+def _strip(related: list[dict[str, Any]], keys: set[str]) -> None:
+    for key in keys:
+        for item in related:
+            item.pop(key, None)
+
+
+def _group(related: list[dict[str, Any]],
+           key: str) -> dict[Any, list[dict[str, Any]]]:
+    result: dict[Any, list[dict[str, Any]]] = {}
+    for item in related:
+        values = item.get(key)
+        for value in values if isinstance(values, list) else [values]:
+            result.setdefault(value, []).append(item)
+    return result
+
+
+def _in_fetched_order(related: list[dict[str, Any]]
+                      ) -> Callable[[list[Any]], list[dict[str, Any]]]:
+    """Return a function which picks the related documents of some ids. The
+    documents are in the order they're fetched in, which is the order of the
+    related query.
+    """
+    by_id = {item['_id']: item for item in related}
+    rank = {item['_id']: index for index, item in enumerate(related)}
+
+    def pick(ids: list[Any]) -> list[dict[str, Any]]:
+        found = {i for i in ids if i in by_id}
+        return [by_id[i] for i in sorted(found, key=rank.__getitem__)]
+    return pick
+
+
+def _load_include(cls: type[PObject],
+                  subquery: Subquery,
+                  docs: list[dict[str, Any]]) -> Loader:
+    fname = subquery.name
+    dbfname = cls.pconf.to_db_key(fname)
+    field = cls.cdef.field_named(fname)
+    it = field.foreign_class
+    query = subquery.query
+    if field.fdef.fstore == FStore.LOCAL_KEY:
+        if field.fdef.ftype == FType.INSTANCE:
+            key = ref_db_field_key(fname, cls)
+            ids = _unique([doc.get(key) for doc in docs])
+        else:
+            key = ref_db_field_keys(fname, cls)
+            ids = _unique([i for doc in docs for i in doc.get(key) or []])
+        related, stripped = yield from _fetch(it, query,
+                                              {'_id': {'$in': ids}})
+        if field.fdef.ftype == FType.INSTANCE:
+            by_id = {item['_id']: item for item in related}
+            for doc in docs:
+                if doc.get(key) in by_id:
+                    doc[dbfname] = by_id[doc[key]]
+        else:
+            pick = _in_fetched_order(related)
+            for doc in docs:
+                doc[dbfname] = pick(doc.get(key) or [])
+        _strip(related, stripped)
+        return
+    root_ids = _unique([doc.get('_id') for doc in docs])
+    if field.fdef.ftype == FType.INSTANCE:
+        key = ref_db_field_key(field.fdef.foreign_key, it)
+        related, stripped = yield from _fetch(
+            it, query, {key: {'$in': root_ids}}, key)
+        groups = _group(related, key)
+        for doc in docs:
+            if doc['_id'] in groups:
+                doc[dbfname] = groups[doc['_id']][0]
+        _strip(related, stripped)
+        return
+    if field.fdef.use_join_table:
+        this_key = ref_db_field_key(cls.__name__, cls)
+        that_key = ref_db_field_key(it.__name__, it)
+        links = yield LoadRequest(cls, join_table_name(field), [
+            {'$match': {this_key: {'$in': root_ids}}}])
+        that_ids = _unique([link.get(that_key) for link in links])
+        related, stripped = yield from _fetch(it, query,
+                                              {'_id': {'$in': that_ids}})
+        by_root: dict[Any, list[Any]] = {}
+        for link in links:
+            by_root.setdefault(link.get(this_key), []).append(
+                link.get(that_key))
+        pick = _in_fetched_order(related)
+        for doc in docs:
+            doc[dbfname] = pick(by_root.get(doc['_id'], []))
+        _strip(related, stripped)
+        return
+    if field.foreign_field.fdef.ftype == FType.INSTANCE:
+        key = ref_db_field_key(field.fdef.foreign_key, it)
+    else:
+        key = ref_db_field_keys(field.fdef.foreign_key, it)
+    related, stripped = yield from _fetch(it, query,
+                                          {key: {'$in': root_ids}}, key)
+    groups = _group(related, key)
+    for doc in docs:
+        doc[dbfname] = groups.get(doc['_id'], [])
+    _strip(related, stripped)
+
+
+def fetch_options(subqueries: list[Subquery],
+                  options: Optional[dict[str, Any]]) -> dict[str, Any]:
+    """The execution options of a root query which apply to the fetches of
+    its batch includes. An index hint is for the root collection only.
+    """
+    options = options or {}
+    if options.get('lazy') and any(s.strategy == 'batch' for s in subqueries):
+        raise ValueError('batch include cannot be loaded into lazy results')
+    return {k: v for k, v in options.items() if k != 'hint'}
+
+
+def load(cls: type[PObject],
+         subqueries: list[Subquery],
+         docs: list[dict[str, Any]],
+         options: Optional[dict[str, Any]] = None) -> None:
+    from .query import aggregate
+    options = fetch_options(subqueries, options)
+    loader = batch_loader(cls, subqueries, docs)
+    try:
+        request = next(loader)
+        while True:
+            connection = Connection.from_class(request.cls)
+            collection = connection.collection(request.collection)
+            cursor = aggregate(collection, request.pipeline, options)
+            request = loader.send(list(cursor))
+    except StopIteration:
+        return
+
+
+async def aload(cls: type[PObject],
+                subqueries: list[Subquery],
+                docs: list[dict[str, Any]],
+                options: Optional[dict[str, Any]] = None) -> None:
+    from .query import aaggregate
+    options = fetch_options(subqueries, options)
+    loader = batch_loader(cls, subqueries, docs)
+    try:
+        request = next(loader)
+        while True:
+            connection = AsyncConnection.from_class(request.cls)
+            collection = connection.collection(request.collection)
+            cursor = await aaggregate(collection, request.pipeline, options)
+            request = loader.send(await cursor.to_list())
+    except StopIteration:
+        return
@@ -0,0 +1,53 @@
+"""This module contains a least recently used cache with hit counters."""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Generic, Hashable, NamedTuple, Optional, TypeVar
+V = TypeVar('V')
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    size: int
+    maxsize: int
+
+
+class LRUCache(Generic[V]):
+    """LRU cache keeps at most `maxsize` values. The least recently used value
+    is dropped when the cache is full.
+    """
+
+    def __init__(self: LRUCache, maxsize: int = 1024) -> None:
+        if maxsize < 1:
+            raise ValueError('max size should be a positive integer')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values: OrderedDict[Hashable, V] = OrderedDict()
+
+    def get(self: LRUCache, key: Hashable) -> Optional[V]:
+        value = self._values.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._values.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self: LRUCache, key: Hashable, value: V) -> None:
+        self._values[key] = value
+        self._values.move_to_end(key)
+        if len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+
+    def clear(self: LRUCache) -> None:
+        self._values.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self: LRUCache) -> CacheInfo:
+        return CacheInfo(hits=self.hits, misses=self.misses,
+                         size=len(self._values), maxsize=self.maxsize)
+
+    def __len__(self: LRUCache) -> int:
+        return len(self._values)
@@ -0,0 +1,291 @@
+"""This module contains the aggregation pipeline optimizer. The optimizer
+rewrites a generated pipeline into an equivalent one which filters earlier
+and moves less data:
+
+* a `$match` is hoisted ahead of `$lookup`, `$unwind`, `$unset`, `$set` and
+  `$sort` stages which don't touch the fields it filters;
+* a `$project` of paths inside a looked up field is pushed into the
+  `$lookup` sub-pipeline, for hand written pipelines (generated pipelines
+  already project inside the sub-pipeline);
+* adjacent `$match` and `$project` stages are merged;
+* an `$unset` of fields which a later `$project` drops anyway is removed.
+
+`$lookup` and `$facet` sub-pipelines are optimized likewise.
+"""
+from __future__ import annotations
+from typing import Any, Optional
+from logging import getLogger, DEBUG
+
+
+logger = getLogger(__name__)
+
+Pipeline = list[dict[str, Any]]
+
+OPAQUE_MATCH_OPERATORS = {'$expr', '$where', '$text', '$jsonSchema'}
+LOGICAL_MATCH_OPERATORS = {'$and', '$or', '$nor'}
+
+
+def optimize(pipeline: Pipeline) -> Pipeline:
+    """Optimize an aggregation pipeline. The input pipeline is not changed.
+    """
+    result = _optimize(pipeline)
+    if logger.isEnabledFor(DEBUG):
+        logger.debug('pipeline before optimization: %s', pipeline)
+        logger.debug('pipeline after optimization: %s', result)
+    return result
+
+
+def _optimize(pipeline: Pipeline) -> Pipeline:
+    result = [_optimize_stage(stage) for stage in pipeline]
+    result = _hoist_matches(result)
+    result = _push_projections(result)
+    result = _merge_stages(result)
+    result = _drop_unsets(result)
+    return result
+
+
+def _optimize_stage(stage: dict[str, Any]) -> dict[str, Any]:
+    if len(stage) != 1:
+        return stage
+    name, value = next(iter(stage.items()))
+    if name == '$lookup' and 'pipeline' in value:
+        return {name: {**value, 'pipeline': _optimize(value['pipeline'])}}
+    if name == '$facet':
+        return {name: {k: _optimize(v) for k, v in value.items()}}
+    return stage
+
+
+def _stage(stage: dict[str, Any]) -> tuple[Optional[str], Any]:
+    if len(stage) != 1:
+        return None, None
+    return next(iter(stage.items()))
+
+
+def _overlaps(path: str, other: str) -> bool:
+    return path == other or path.startswith(other + '.') \
+        or other.startswith(path + '.')
+
+
+def _any_overlaps(paths: set[str], others: set[str]) -> bool:
+    return any(_overlaps(p, o) for p in paths for o in others)
+
+
+def match_fields(matcher: Any) -> Optional[set[str]]:
+    """The field paths a `$match` filters. Returns None if they cannot be
+    known.
+    """
+    if not isinstance(matcher, dict):
+        return None
+    result: set[str] = set()
+    for key, value in matcher.items():
+        if key in OPAQUE_MATCH_OPERATORS:
+            return None
+        if key in LOGICAL_MATCH_OPERATORS:
+            if not isinstance(value, list):
+                return None
+            for item in value:
+                fields = match_fields(item)
+                if fields is None:
+                    return None
+                result |= fields
+        elif key.startswith('$'):
+            return None
+        else:
+            result.add(key)
+    return result
+
+
+def _written_fields(stage: dict[str, Any]) -> Optional[set[str]]:
+    """The fields a stage writes or removes if a `$match` on other fields
+    can be moved ahead of it. Returns None if no `$match` can.
+    """
+    name, value = _stage(stage)
+    if name == '$lookup':
+        return {value['as']}
+    if name == '$unwind':
+        path = value if isinstance(value, str) else value['path']
+        fields = {path[1:]}
+        if isinstance(value, dict) and 'includeArrayIndex' in value:
+            fields.add(value['includeArrayIndex'])
+        return fields
+    if name == '$unset':
+        return set(value) if isinstance(value, list) else {value}
+    if name in ('$set', '$addFields'):
+        return set(value.keys())
+    if name == '$sort':
+        return set()
+    return None
+
+
+def _hoist_matches(pipeline: Pipeline) -> Pipeline:
+    result: Pipeline = []
+    for stage in pipeline:
+        name, value = _stage(stage)
+        index = len(result)
+        if name == '$match':
+            fields = match_fields(value)
+            while fields is not None and index > 0:
+                written = _written_fields(result[index - 1])
+                if written is None or _any_overlaps(fields, written):
+                    break
+                index -= 1
+        result.insert(index, stage)
+    return result
+
+
+def _lookup_subpaths(project: dict[str, Any], field: str) -> dict[str, Any]:
+    prefix = field + '.'
+    return {k[len(prefix):]: v for k, v in project.items()
+            if k.startswith(prefix)}
+
+
+def _push_projections(pipeline: Pipeline) -> Pipeline:
+    """Push a later `$project` of paths inside a looked up field into the
+    `$lookup` sub-pipeline.
+
+    The query builders never emit such a projection: a pick or omit of an
+    include is built into the include's own sub-pipeline, and the outer
+    `$project` comes before the `$lookup` stages and names top level fields
+    only. This pass therefore applies to hand written pipelines and leaves
+    generated ones unchanged.
+    """
+    result = list(pipeline)
+    for index, stage in enumerate(result):
+        name, value = _stage(stage)
+        if name != '$lookup' or 'pipeline' not in value:
+            continue
+        field = value['as']
+        for later in result[index + 1:]:
+            lname, lvalue = _stage(later)
+            if lname == '$project':
+                if field in lvalue or not _plain_projection(lvalue):
+                    break
+                subpaths = _lookup_subpaths(lvalue, field)
+                if len(subpaths) == 0:
+                    break
+                if _inclusive(lvalue):
+                    subpaths.setdefault('_id', 1)
+                result[index] = {'$lookup': {
+                    **value,
+                    'pipeline': value['pipeline'] + [{'$project': subpaths}]}}
+                break
+            if lname == '$unwind':
+                continue
+            written = _written_fields(later)
+            if written is None or lname == '$lookup' \
+                    or _any_overlaps({field}, written):
+                break
+    return result
+
+
+def _plain_projection(project: dict[str, Any]) -> bool:
+    """Whether a projection only includes or only excludes fields."""
+    values = {bool(v) for k, v in project.items()
+              if k != '_id' and v in (0, 1, True, False)}
+    return len(values) < 2 and all(
+        v in (0, 1, True, False) for v in project.values())
+
+
+def _inclusive(project: dict[str, Any]) -> bool:
+    return any(bool(v) for k, v in project.items() if k != '_id')
+
+
+def _merge_matches(first: Any, second: Any) -> Any:
+    if not first:
+        return second
+    if not second:
+        return first
+    if not any(k.startswith('$') for k in [*first, *second]) \
+            and len(first.keys() & second.keys()) == 0:
+        return {**first, **second}
+    return {'$and': [first, second]}
+
+
+def _merge_projects(first: dict[str, Any],
+                    second: dict[str, Any]) -> Optional[dict[str, Any]]:
+    if not (_plain_projection(first) and _plain_projection(second)):
+        return None
+    keys = [k for k in [*first, *second] if k != '_id']
+    if any('.' in k for k in keys):
+        return None
+    id_included = bool(first.get('_id', 1)) and bool(second.get('_id', 1))
+    if not _inclusive(first) and not _inclusive(second):
+        result = {k: 0 for k in keys}
+    elif _inclusive(first) and _inclusive(second):
+        result = {k: 1 for k in second if k != '_id' and first.get(k)}
+        if len(result) == 0:
+            return None
+    else:
+        return None
+    if not id_included:
+        result['_id'] = 0
+    elif len(result) == 0:
+        return None
+    return result
+
+
+def _merge_stages(pipeline: Pipeline) -> Pipeline:
+    result: Pipeline = []
+    for stage in pipeline:
+        name, value = _stage(stage)
+        if name == '$match' and value == {}:
+            continue
+        if len(result) > 0:
+            last_name, last_value = _stage(result[-1])
+            if name == last_name == '$match':
+                result[-1] = {'$match': _merge_matches(last_value, value)}
+                continue
+            if name == last_name == '$project':
+                merged = _merge_projects(last_value, value)
+                if merged is not None:
+                    result[-1] = {'$project': merged}
+                    continue
+            if name == last_name == '$unset':
+                fields = [*_as_list(last_value), *_as_list(value)]
+                result[-1] = {'$unset': list(dict.fromkeys(fields))}
+                continue
+        result.append(stage)
+    return result
+
+
+def _as_list(value: Any) -> list[str]:
+    return value if isinstance(value, list) else [value]
+
+
+def _drop_unsets(pipeline: Pipeline) -> Pipeline:
+    result: Pipeline = []
+    for index, stage in enumerate(pipeline):
+        name, value = _stage(stage)
+        if name == '$unset' and _dropped_later(set(_as_list(value)),
+                                               pipeline[index + 1:]):
+            continue
+        result.append(stage)
+    return result
+
+
+def _dropped_later(fields: set[str], pipeline: Pipeline) -> bool:
+    """Whether a later `$project` drops all of `fields` before any stage reads
+    them.
+    """
+    for stage in pipeline:
+        name, value = _stage(stage)
+        if name == '$project':
+            if not _plain_projection(value):
+                return False
+            if _inclusive(value):
+                return not _any_overlaps(fields, set(value.keys()))
+            excluded = {k for k, v in value.items() if not v}
+            return all(f in excluded for f in fields)
+        if name in ('$skip', '$limit'):
+            continue
+        if name == '$sort':
+            if _any_overlaps(fields, set(value.keys())):
+                return False
+            continue
+        if name == '$match':
+            matched = match_fields(value)
+            if matched is None or _any_overlaps(fields, matched):
+                return False
+            continue
+        return False
+    return False
@@ -25,6 +25,9 @@ class PConf:
         if camelize_db_keys == False:
             self._db_key_encoding_strategy = identical_key
             self._db_key_decoding_strategy = identical_key
+        self._db_keys: dict[str, str] = {}
+        self._py_keys: dict[str, str] = {}
+        self._graph_name: str | None = None
 
     @property
     def collection_name(self: PConf) -> str:
@@ -38,8 +41,22 @@ class PConf:
     def db_key_decoding_strategy(self: PConf) -> Callable[[str], str]:
         return self._db_key_decoding_strategy
 
+    @property
+    def graph_name(self: PConf) -> str:
+        if self._graph_name is None:
+            self._graph_name = self._cls.cdef.jconf.cgraph.name
+        return self._graph_name
+
     def to_db_key(self: PConf, key: str) -> str:
-        return self.db_key_encoding_strategy(key)
+        db_key = self._db_keys.get(key)
+        if db_key is None:
+            db_key = self.db_key_encoding_strategy(key)
+            self._db_keys[key] = db_key
+        return db_key
 
     def to_py_key(self: PConf, key: str) -> str:
-        return self.db_key_decoding_strategy(key)
+        py_key = self._py_keys.get(key)
+        if py_key is None:
+            py_key = self.db_key_decoding_strategy(key)
+            self._py_keys[key] = py_key
+        return py_key
@@ -0,0 +1,72 @@
+"""This module contains the aggregation pipeline cache. Queries of a same
+shape share a pipeline template, literal values of a query are bound into the
+template's slots.
+"""
+from __future__ import annotations
+from typing import Any, Hashable, NamedTuple, Optional
+from .lru import LRUCache
+
+
+class Slot:
+    """A placeholder of a literal value inside a pipeline template."""
+
+    __slots__ = ('index',)
+
+    def __init__(self: Slot, index: int) -> None:
+        self.index = index
+
+    def __repr__(self: Slot) -> str:
+        return f'<Slot({self.index})>'
+
+
+SLOT = ('$slot',)
+
+
+class PipelineTemplate(NamedTuple):
+    pipeline: list[dict[str, Any]]
+    final_picks: list[Optional[list[str]]]
+
+
+pipeline_cache: LRUCache[PipelineTemplate] = LRUCache(maxsize=512)
+
+
+def slot_literals(value: Any, values: list[Any]) -> Any:
+    """Replace literal values of a matcher with slots. Dicts and lists of
+    dicts are the structure of a matcher, anything else is a literal which is
+    appended to `values`.
+    """
+    if isinstance(value, dict):
+        return {k: slot_literals(v, values) for k, v in value.items()}
+    if isinstance(value, list) and len(value) > 0 \
+            and all(isinstance(item, dict) for item in value):
+        return [slot_literals(item, values) for item in value]
+    return literal_slot(value, values)
+
+
+def literal_slot(value: Any, values: list[Any]) -> Slot:
+    values.append(value)
+    return Slot(len(values) - 1)
+
+
+def freeze(value: Any) -> Hashable:
+    """Convert a value into a hashable shape. Slots are all alike."""
+    if isinstance(value, Slot):
+        return SLOT
+    if isinstance(value, dict):
+        return ('$dict',) + tuple((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return ('$list',) + tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+    return value
+
+
+def bind(template: Any, values: list[Any]) -> Any:
+    """Copy a pipeline template with its slots filled by `values`."""
+    if isinstance(template, Slot):
+        return values[template.index]
+    if isinstance(template, dict):
+        return {k: bind(v, values) for k, v in template.items()}
+    if isinstance(template, list):
+        return [bind(item, values) for item in template]
+    return template
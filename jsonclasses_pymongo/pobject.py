@@ -9,6 +9,7 @@ if TYPE_CHECKING:
     from .pconf import PConf
     from .query import (BaseQuery, ListQuery, IDQuery, IDSQuery, SingleQuery,
                         ExistQuery, IterateQuery)
+    from .pymongofy import SaveManyResult
 
 
 T = TypeVar('T', bound='PObject')
@@ -52,6 +53,14 @@ class PObject(JObject):
     def iterate(cls: type[T], **kwargs: Any) -> IterateQuery[T]:
         ...
 
+    @classmethod
+    def save_many(cls: type[T],
+                  objects: list[T],
+                  chunk_size: int = 1000,
+                  validate_all_fields: bool = False,
+                  skip_validation: bool = False) -> SaveManyResult:
+        ...
+
     def _orm_delete(self: T, no_raise: bool = False) -> None:
         ...
 
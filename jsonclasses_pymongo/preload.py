@@ -18,7 +18,7 @@ _refkeycolls: dict[str, Collection] = {}
 
 def getrefkeycoll(cls: type[PObject]) -> Collection:
     global _refkeycolls
-    gname = cls.cdef.jconf.cgraph.name
+    gname = cls.pconf.graph_name
     if _refkeycolls.get(gname) is not None:
         return _refkeycolls.get(gname)
     coll = Connection(gname).collection('_refkeys')
@@ -33,7 +33,7 @@ def getrefkeycoll(cls: type[PObject]) -> Collection:
 def getidref(cls: type[PObject], id: str | int) -> str | int:
     coll = getrefkeycoll(cls)
     matcher = {
-        'graph': cls.cdef.jconf.cgraph.name, 'cls': cls.__name__, 'sid': id
+        'graph': cls.pconf.graph_name, 'cls': cls.__name__, 'sid': id
     }
     result = coll.find_one(matcher)
     if result is not None:
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import TypeVar, Any, cast
+from typing import TypeVar, Any, NamedTuple, cast
 from re import search
 from bson.objectid import ObjectId
 from jsonclasses.jfield import JField
@@ -11,7 +11,8 @@ from jsonclasses.excs import UniqueConstraintException
 from jsonclasses.excs import DeletionDeniedException
 from .pobject import PObject
 from .query import BaseQuery, ExistQuery, IDSQuery, IterateQuery, ListQuery, SingleQuery, IDQuery
-from .encoder import Encoder
+from .encoder import Encoder, mark_saved
+from .command import ManyBatchCommand
 from .connection import Connection
 from .utils import ref_db_field_key, join_table_name
 
@@ -19,6 +20,19 @@ from .utils import ref_db_field_key, join_table_name
 T = TypeVar('T', bound=PObject)
 
 
+class SaveFailure(NamedTuple):
+    """An object which is failed to be saved by `save_many`."""
+    index: int
+    object: PObject
+    exception: Exception
+
+
+class SaveManyResult(NamedTuple):
+    """The result of `save_many`."""
+    saved: list[PObject]
+    failures: list[SaveFailure]
+
+
 def find(cls: type[T], *args, **kwargs: Any) -> ListQuery[T]:
     if len(args) > 0:
         return ListQuery(cls=cls, filter=args[0])
@@ -62,30 +76,105 @@ def iterate(cls: type[T], **kwargs: Any) -> IterateQuery[T]:
     return IterateQuery(cls=cls, filter=kwargs)
 
 
+def _save_unlinked_objects(obj: PObject,
+                           validate_all_fields: bool,
+                           skip_validation: bool) -> None:
+    """Save the objects unlinked from `obj`. An object is kept in the unlinked
+    objects until it's saved, thus a failed save can be retried.
+    """
+    for _, lst in obj.unlinked_objects.items():
+        for item in list(lst):
+            item.save(validate_all_fields=validate_all_fields,
+                      skip_validation=skip_validation)
+            lst.remove(item)
+
+
+def _unique_exception(cls: type[T],
+                      exception: DuplicateKeyError) -> UniqueConstraintException:
+    result = search('index: (.+?) dup key', exception._message)
+    assert result is not None
+    index_key = result.group(1)
+    single_key = True
+    if index_key.endswith('_1'):
+        db_key = index_key[:-2]
+        single_key = True
+    else:
+        db_key = index_key
+        single_key = False
+    if single_key:
+        pt_key = cls.pconf.to_py_key(db_key)
+        return UniqueConstraintException(pt_key)
+    else:
+        results = []
+        for field in cls.cdef.fields:
+            if field.fdef.cindex and db_key in field.fdef.cindex_names:
+                results.append(field.name)
+        ek = cls.cdef.jconf.output_key_strategy
+        return UniqueConstraintException([ek(r) for r in results], f'voilated unique compound index \'{index_key}\'')
+
+
 def _database_write(self: T) -> None:
+    batch = Encoder().encode_root(self)
     try:
-        Encoder().encode_root(self).execute()
+        batch.execute()
     except DuplicateKeyError as exception:
-        result = search('index: (.+?) dup key', exception._message)
-        assert result is not None
-        index_key = result.group(1)
-        single_key = True
-        if index_key.endswith('_1'):
-            db_key = index_key[:-2]
-            single_key = True
-        else:
-            db_key = index_key
-            single_key = False
-        if single_key:
-            pt_key = self.__class__.pconf.to_py_key(db_key)
-            raise UniqueConstraintException(pt_key) from None
-        else:
-            results = []
-            for field in self.__class__.cdef.fields:
-                if field.fdef.cindex and db_key in field.fdef.cindex_names:
-                    results.append(field.name)
-            ek = self.__class__.cdef.jconf.output_key_strategy
-            raise UniqueConstraintException([ek(r) for r in results], f'voilated unique compound index \'{index_key}\'')
+        raise _unique_exception(self.__class__, exception) from None
+    finally:
+        mark_saved(batch.writes, batch.written)
+
+
+def save_many(cls: type[T],
+              objects: list[T],
+              chunk_size: int = 1000,
+              validate_all_fields: bool = False,
+              skip_validation: bool = False) -> SaveManyResult:
+    """Save many objects with chunked bulk writes. Objects that fail to be
+    validated or written are reported as failures, the others are saved. An
+    object whose unlinked objects fail to be saved is written, but reported
+    as a failure with the exception of the unlinked object.
+    """
+    failures: dict[int, SaveFailure] = {}
+    indices: list[int] = []
+    for index, obj in enumerate(objects):
+        try:
+            obj._can_create_or_update_check()
+            if obj.is_new:
+                obj._run_on_create_callbacks()
+            else:
+                obj._run_on_update_callbacks()
+            if not skip_validation:
+                obj.validate(all_fields=validate_all_fields)
+            obj._set_on_save()
+        except Exception as exception:
+            failures[index] = SaveFailure(index, obj, exception)
+            continue
+        indices.append(index)
+    batches = Encoder().encode_roots([objects[i] for i in indices])
+    command = ManyBatchCommand(batches, chunk_size)
+    try:
+        command.execute()
+    finally:
+        for batch in batches:
+            mark_saved(batch.writes, command.written)
+    for batch_index, error in command.errors.items():
+        index = indices[batch_index]
+        exception: Exception = error
+        if isinstance(error, DuplicateKeyError):
+            exception = _unique_exception(objects[index].__class__, error)
+        failures[index] = SaveFailure(index, objects[index], exception)
+    saved: list[PObject] = []
+    for index in indices:
+        if index in failures:
+            continue
+        obj = objects[index]
+        try:
+            _save_unlinked_objects(obj, validate_all_fields, skip_validation)
+        except Exception as exception:
+            failures[index] = SaveFailure(index, obj, exception)
+            continue
+        saved.append(obj)
+    return SaveManyResult(saved, [failures[i] for i in sorted(failures)])
+
 
 def _orm_delete(self: T, no_raise: bool = False) -> None:
     self_id = self._id
@@ -205,6 +294,18 @@ def _orm_restore(self: T) -> None:
     pass
 
 
+def _lazy_getattr(self: T, name: str) -> Any:
+    """Decode a lazily decoded field on its first access. Pending fields are
+    left out of the object dict, thus other attributes are not slowed down.
+    """
+    lazy = self.__dict__.get('_lazy_fields')
+    if lazy is None or name not in lazy.pending:
+        raise AttributeError(f'\'{self.__class__.__name__}\' object has no '
+                             f'attribute \'{name}\'')
+    lazy.load(self, name)
+    return self.__dict__[name]
+
+
 def pymongofy(class_: type) -> PObject:
     # do not install methods for subclasses
     if hasattr(class_, '__is_pymongo__'):
@@ -219,11 +320,14 @@ def pymongofy(class_: type) -> PObject:
     class_.linked = classmethod(linked)
     class_.exist = classmethod(exist)
     class_.iterate = classmethod(iterate)
+    class_.save_many = classmethod(save_many)
     # protected methods
     class_._database_write = _database_write
     class_._orm_delete = _orm_delete
     class_._orm_restore = _orm_restore
     class_._orm_complete = _orm_complete
+    # private methods
+    class_.__getattr__ = _lazy_getattr
     connection = Connection.from_class(class_)
     if class_.cdef.jconf.abstract:
         return class_
@@ -1,50 +1,440 @@
 """This module contains queries."""
 from __future__ import annotations
 from math import ceil
-from jsonclasses_pymongo.query_to_object import query_to_object
-from jsonclasses_pymongo.query_reader import QueryReader
+from itertools import islice
+from copy import copy
+from weakref import finalize
+from jsonclasses_pymongo.query_reader import QueryReader, read_query_string
+from asyncio import CancelledError, Queue, Task, ensure_future, sleep
 from typing import (
-    Iterator, Union, TypeVar, Generator, Optional, Any, Generic, NamedTuple,
-    cast
+    AsyncIterator, Awaitable, Callable, Hashable, Iterable, Iterator, Union,
+    TypeVar,
+    Generator, Optional, Any, Generic, NamedTuple, cast
 )
 from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo.collection import Collection
 from pymongo.cursor import Cursor
+from pymongo.command_cursor import CommandCursor
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.cursor import AsyncCursor
+from pymongo.asynchronous.command_cursor import AsyncCommandCursor
 from jsonclasses.fdef import FStore, FType
 from jsonclasses.jfield import JField
 from jsonclasses.mgraph import MGraph
+from jsonclasses.types import Types
 from jsonclasses.excs import ObjectNotFoundException
 from .decoder import Decoder
-from .connection import Connection
+from .columns import ColumnReader, column_fields, column_key
+from .excs import TooManyResultsException
+from .loader import load, aload
+from .optimizer import optimize
+from .explain import Explanation, VERBOSITIES, summarize
+from .connection import Connection, AsyncConnection
 from .pobject import PObject
 from .utils import idval, ref_db_field_key, ref_db_field_keys, join_table_name
+from .keyset import (
+    KeysetList, keyset_sort, keyset_matcher, encode_token, decode_token
+)
+from .pipeline_cache import (
+    PipelineTemplate, pipeline_cache, slot_literals, literal_slot, freeze, bind
+)
 T = TypeVar('T', bound=PObject)
 U = TypeVar('U', bound='BaseQuery')
 V = TypeVar('V', bound='BaseListQuery')
+C = TypeVar('C', Collection, AsyncCollection)
 
 
 class Subquery(NamedTuple):
     name: str
     query: Optional[BaseQuery]
+    strategy: str = 'lookup'
+
+
+INCLUDE_STRATEGIES = ('lookup', 'batch')
+
+
+FIND_STAGES = {'$match': 'filter', '$sort': 'sort', '$skip': 'skip',
+               '$limit': 'limit', '$project': 'projection'}
+FIND_STAGE_ORDER = list(FIND_STAGES.keys())
+
 
+def find_arguments(pipeline: list[dict[str, Any]]) -> Optional[dict[str, Any]]:
+    """Get the `find` arguments equivalent to a pipeline. Returns None if the
+    pipeline has other stages, or if its stages are not in the order of
+    match, sort, skip, limit and project.
+    """
+    result: dict[str, Any] = {}
+    position = 0
+    for stage in pipeline:
+        if len(stage) != 1:
+            return None
+        name, value = next(iter(stage.items()))
+        if name not in FIND_STAGES:
+            return None
+        index = FIND_STAGE_ORDER.index(name)
+        if index < position:
+            return None
+        position = index + 1
+        if name == '$sort':
+            value = list(value.items())
+        result[FIND_STAGES[name]] = value
+    return result
 
-class BaseQuery(Generic[T]):
+
+def merge_match(pipeline: list[dict[str, Any]],
+                condition: dict[str, Any]) -> list[dict[str, Any]]:
+    """Add `condition` to the last stage of a pipeline if it's a `$match`,
+    otherwise append a new `$match` stage.
+    """
+    if len(pipeline) > 0 and '$match' in pipeline[-1]:
+        match = pipeline[-1]['$match']
+        condition = {'$and': [match, condition]} if match else condition
+        return pipeline[:-1] + [{'$match': condition}]
+    return pipeline + [{'$match': condition}]
+
+
+def keyed_lookup(collection: str,
+                 local_field: str,
+                 foreign_field: str,
+                 pipeline: list[dict[str, Any]],
+                 as_field: str) -> dict[str, Any]:
+    lookup = {'from': collection,
+              'localField': local_field,
+              'foreignField': foreign_field,
+              'as': as_field}
+    if len(pipeline) > 0:
+        lookup['pipeline'] = pipeline
+    return {'$lookup': lookup}
+
+
+COMMAND_OPTIONS = {'hint': 'hint', 'max_time_ms': 'maxTimeMS',
+                   'batch_size': 'batchSize', 'allow_disk_use': 'allowDiskUse',
+                   'collation': 'collation', 'comment': 'comment'}
+COUNT_OPTIONS = ('hint', 'max_time_ms', 'collation', 'comment')
+ESTIMATED_COUNT_OPTIONS = ('max_time_ms', 'comment')
+
+
+def command_options(options: Optional[dict[str, Any]],
+                    names: Iterable[str] = COMMAND_OPTIONS.keys()
+                    ) -> dict[str, Any]:
+    """Convert execution options into command and `aggregate` arguments.
+    Options are named as the arguments of `find`.
+    """
+    if not options:
+        return {}
+    return {COMMAND_OPTIONS[k]: v for k, v in options.items() if k in names}
+
+
+def find_options(options: Optional[dict[str, Any]]) -> dict[str, Any]:
+    """The execution options which are arguments of `find`."""
+    if not options:
+        return {}
+    return {k: v for k, v in options.items() if k in COMMAND_OPTIONS}
+
+
+def raw_collection(collection: C, options: Optional[dict[str, Any]]) -> C:
+    """The collection to run a query with. Lazy queries read results as
+    `RawBSONDocument`.
+    """
+    if not options or not options.get('lazy'):
+        return collection
+    codec_options = collection.codec_options.with_options(
+        document_class=RawBSONDocument)
+    return collection.with_options(codec_options=codec_options)
+
+
+def aggregate(collection: Collection,
+              pipeline: list[dict[str, Any]],
+              options: Optional[dict[str, Any]] = None
+              ) -> Cursor | CommandCursor:
+    """Run a pipeline with `find` if it's equivalent to a find, otherwise with
+    `aggregate`. `options` are forwarded to the driver.
+    """
+    collection = raw_collection(collection, options)
+    arguments = find_arguments(pipeline)
+    if arguments is not None:
+        return collection.find(**arguments, **find_options(options))
+    return collection.aggregate(pipeline, **command_options(options))
+
+
+async def aaggregate(collection: AsyncCollection,
+                     pipeline: list[dict[str, Any]],
+                     options: Optional[dict[str, Any]] = None
+                     ) -> AsyncCursor | AsyncCommandCursor:
+    """The asyncio counterpart of `aggregate`."""
+    collection = raw_collection(collection, options)
+    arguments = find_arguments(pipeline)
+    if arguments is not None:
+        return collection.find(**arguments, **find_options(options))
+    return await collection.aggregate(pipeline, **command_options(options))
+
+
+def explain_command(collection: str,
+                    pipeline: list[dict[str, Any]],
+                    options: Optional[dict[str, Any]] = None
+                    ) -> dict[str, Any]:
+    """The command to explain, a find if the pipeline is run with `find`,
+    otherwise an aggregate.
+    """
+    arguments = find_arguments(pipeline)
+    command: dict[str, Any]
+    if arguments is None:
+        command = {'aggregate': collection, 'pipeline': pipeline, 'cursor': {}}
+        command.update(command_options(options))
+        if 'batchSize' in command:
+            command['cursor'] = {'batchSize': command.pop('batchSize')}
+        return command
+    command = {'find': collection}
+    for key, value in arguments.items():
+        command[key] = dict(value) if key == 'sort' else value
+    command.update(command_options(options))
+    return command
+
+
+class PipelineQuery:
+    """Pipeline query runs its pipeline with its execution options, and
+    explains it with the server plan and a summary of it.
+    """
+
+    def _explain_class(self) -> type[PObject]:
+        return getattr(self, 'list_query', self)._cls
+
+    def _execution_options(self) -> dict[str, Any]:
+        """The options of the list query. Aggregated results are read as
+        dicts, a lazy list query decodes its objects lazily only.
+        """
+        options = getattr(self, 'list_query', self)._options
+        return {k: v for k, v in options.items() if k != 'lazy'}
+
+    def _aggregate(self, collection: Collection) -> Cursor | CommandCursor:
+        return aggregate(collection, getattr(self, '_pipeline')(),
+                         self._execution_options())
+
+    async def _aaggregate(self, collection: AsyncCollection
+                          ) -> AsyncCursor | AsyncCommandCursor:
+        return await aaggregate(collection, getattr(self, '_pipeline')(),
+                                self._execution_options())
+
+    def _explain_command(self) -> dict[str, Any]:
+        cls = self._explain_class()
+        return explain_command(cls.pconf.collection_name,
+                               getattr(self, '_pipeline')(),
+                               self._execution_options())
+
+    def _explain_verbosity(self, verbosity: str) -> str:
+        if verbosity not in VERBOSITIES:
+            raise ValueError(f'unknown explain verbosity \'{verbosity}\'')
+        return verbosity
+
+    def explain(self, verbosity: str = 'executionStats') -> Explanation:
+        verbosity = self._explain_verbosity(verbosity)
+        database = Connection.from_class(self._explain_class()).database
+        plan = database.command('explain', self._explain_command(),
+                                verbosity=verbosity)
+        return summarize(plan)
+
+    async def aexplain(self,
+                       verbosity: str = 'executionStats') -> Explanation:
+        verbosity = self._explain_verbosity(verbosity)
+        database = AsyncConnection.from_class(self._explain_class()).database
+        plan = await database.command('explain', self._explain_command(),
+                                      verbosity=verbosity)
+        return summarize(plan)
+
+
+class BaseQuery(PipelineQuery, Generic[T]):
     """Base query is the base class of queries.
     """
 
     def __init__(self: U, cls: type[T]) -> None:
         self._cls = cls
         self.subqueries: list[Subquery] = []
+        self._options: dict[str, Any] = {}
+
+    def _explain_command(self: U) -> dict[str, Any]:
+        cls = cast(type[PObject], self._cls)
+        return explain_command(cls.pconf.collection_name,
+                               self._aggregate_pipeline(),
+                               self._options)
+
+    def hint(self: U, index: str | list[tuple[str, int]]) -> U:
+        """Use the index of `index` name or keys."""
+        if not isinstance(index, str):
+            cls = cast(type[PObject], self._cls)
+            kds = cls.cdef.jconf.input_key_strategy
+            index = [(cls.pconf.to_db_key(kds(k)), d) for k, d in index]
+        self._options['hint'] = index
+        return self
+
+    def max_time(self: U, ms: int) -> U:
+        """Abort the query if it runs longer than `ms` milliseconds."""
+        self._options['max_time_ms'] = ms
+        return self
+
+    def batch_size(self: U, n: int) -> U:
+        self._options['batch_size'] = n
+        return self
+
+    def allow_disk_use(self: U, allow: bool = True) -> U:
+        self._options['allow_disk_use'] = allow
+        return self
+
+    def collation(self: U, collation: dict[str, Any]) -> U:
+        self._options['collation'] = collation
+        return self
 
-    def include(self: U, name: str, query: Optional[BaseQuery] = None) -> U:
+    def comment(self: U, comment: str) -> U:
+        """Tag the query with `comment` for server side profiling."""
+        self._options['comment'] = comment
+        return self
+
+    def lazy(self: U, lazy: bool = True) -> U:
+        """Read results as raw BSON and decode the embedded fields of objects
+        on their first access. Suitable for reading a few fields of wide
+        documents.
+        """
+        self._options['lazy'] = lazy
+        return self
+
+    def include(self: U,
+                name: str,
+                query: Optional[BaseQuery] = None,
+                strategy: str = 'lookup') -> U:
+        """Include the objects of a relationship field. With the 'lookup'
+        strategy, they are joined in the pipeline with `$lookup`. With the
+        'batch' strategy, they are fetched after the root objects with one
+        `$in` query per relation level.
+        """
+        if strategy not in INCLUDE_STRATEGIES:
+            raise ValueError(f'unknown include strategy \'{strategy}\'')
         tcls = cast(type[PObject], self._cls)
         decoded_name = tcls.cdef.jconf.input_key_strategy(name)
-        self.subqueries.append(Subquery(decoded_name, query))
+        self.subqueries.append(Subquery(decoded_name, query, strategy))
         return self
 
+    def _template(self: U, values: list[Any]) -> Optional[U]:
+        """Return a copy of this query whose literal values are replaced with
+        slots, and append the literal values to `values`. Returns None if the
+        pipeline of this query cannot be cached.
+        """
+        return None
+
+    def _shape(self: U) -> Hashable:
+        """The shape of a query template. Queries of a same shape build a
+        same pipeline template.
+        """
+        return (type(self), self._cls,
+                tuple((s.name, None if s.query is None else s.query._shape(),
+                       s.strategy)
+                      for s in self.subqueries),
+                self._keyed_lookup())
+
+    def _keyed_lookup(self: U) -> bool:
+        """Whether includes are looked up with the keyed `$lookup` form. The
+        connection is only checked if there are such includes.
+        """
+        if all(s.strategy != 'lookup' for s in self.subqueries):
+            return False
+        cls = cast(type[PObject], self._cls)
+        return Connection.from_class(cls).keyed_lookup
+
+    def _final_picks(self: U) -> list[Optional[list[str]]]:
+        result = [getattr(self, '_final_pick', None)]
+        for subquery in self.subqueries:
+            if subquery.query is not None:
+                result.extend(subquery.query._final_picks())
+        return result
+
+    def _apply_final_picks(self: U,
+                           picks: Iterator[Optional[list[str]]]) -> None:
+        pick = next(picks)
+        if pick is not None:
+            setattr(self, '_final_pick', pick)
+        for subquery in self.subqueries:
+            if subquery.query is not None:
+                subquery.query._apply_final_picks(picks)
+
+    def _aggregate_pipeline(self: U,
+                            builder: str = '_build_aggregate_pipeline'
+                            ) -> list[dict[str, Any]]:
+        """Get the aggregation pipeline of this query from the pipeline cache.
+        The pipeline is built with the `builder` method, optimized and cached
+        if this query shape is new.
+        """
+        values: list[Any] = []
+        template = self._template(values)
+        if template is None:
+            return optimize(getattr(self, builder)())
+        key = (builder, template._shape())
+        try:
+            cached = pipeline_cache.get(key)
+        except TypeError:
+            return optimize(getattr(self, builder)())
+        if cached is None:
+            cached = PipelineTemplate(optimize(getattr(template, builder)()),
+                                      template._final_picks())
+            pipeline_cache.put(key, cached)
+        self._apply_final_picks(iter(cached.final_picks))
+        return bind(cached.pipeline, values)
+
+    def _keyed_lookup_stages(self: U,
+                             subquery: Subquery) -> list[dict[str, Any]]:
+        """Build the stages of an include in the keyed `$lookup` form. The
+        related documents are matched with the `_id` or the reference key
+        index instead of a `$expr` equality.
+        """
+        cls = cast(type[PObject], self._cls)
+        fname = subquery.name
+        dbfname = cls.pconf.to_db_key(fname)
+        field = cls.cdef.field_named(fname)
+        it = field.foreign_class
+        coll = it.pconf.collection_name
+        subpipeline = []
+        if subquery.query is not None:
+            subpipeline = subquery.query._build_aggregate_pipeline()
+        unwind = {'$unwind': {'path': '$' + dbfname,
+                              'preserveNullAndEmptyArrays': True}}
+        if field.fdef.fstore == FStore.LOCAL_KEY:
+            if field.fdef.ftype == FType.INSTANCE:
+                key = ref_db_field_key(fname, cls)
+                return [keyed_lookup(coll, key, '_id', subpipeline, dbfname),
+                        unwind]
+            key = ref_db_field_keys(fname, cls)
+            return [keyed_lookup(coll, key, '_id', subpipeline, dbfname)]
+        fk = cast(str, field.fdef.foreign_key)
+        if field.fdef.ftype == FType.INSTANCE:
+            key = ref_db_field_key(fk, it)
+            return [keyed_lookup(coll, '_id', key, subpipeline, dbfname),
+                    unwind]
+        if field.fdef.use_join_table:
+            this_key = ref_db_field_key(cls.__name__, cls)
+            that_key = ref_db_field_key(it.__name__, it)
+            inner = [s for s in subpipeline if '$match' in s or '$project' in s]
+            moveout = [s for s in subpipeline
+                       if '$match' not in s and '$project' not in s]
+            pipeline = [keyed_lookup(coll, that_key, '_id', inner, field.name),
+                        {'$unwind': {'path': '$' + field.name}},
+                        {'$replaceRoot': {'newRoot': '$' + field.name}},
+                        *moveout]
+            return [keyed_lookup(join_table_name(field), '_id', this_key,
+                                 pipeline, field.name)]
+        if field.foreign_field.fdef.ftype == FType.INSTANCE:
+            key = ref_db_field_key(fk, it)
+        else:
+            key = ref_db_field_keys(fk, it)
+        return [keyed_lookup(coll, '_id', key, subpipeline, dbfname)]
+
     def _build_aggregate_pipeline(self: U) -> list[dict[str, Any]]:
         cls = cast(type[PObject], self._cls)
         result: list[dict[str, Any]] = []
+        keyed = self._keyed_lookup()
         for subquery in self.subqueries:
+            if subquery.strategy == 'batch':
+                continue
+            if keyed:
+                result.extend(self._keyed_lookup_stages(subquery))
+                continue
             fname = subquery.name
             dbfname = cls.pconf.to_db_key(fname)
             field = cls.cdef.field_named(fname)
@@ -285,13 +675,22 @@ class BaseListQuery(BaseQuery[T]):
         self._use_omit: bool = False
         self._omit: Optional[dict[str, Any]] = None
         self._virtual: Optional[list[tuple[str, JField, Any]]] = None
+        self._cursor_direction: Optional[int] = None
+        self._cursor_token: Optional[str] = None
+        self._cursor_values: Optional[list[Any]] = None
+        self._resolved_window: Optional[tuple[Any, Any]] = None
+        self._lookahead: bool = True
+        self._max_results: Optional[int] = None
         if filter is not None:
             if type(filter) is str:
-                filter = query_to_object(filter)
-            self._set_matcher(cast(dict, filter))
+                self._set_result(read_query_string(filter, cls))
+            else:
+                self._set_matcher(cast(dict, filter))
 
     def _set_matcher(self: V, matcher: dict[str, Any]) -> None:
-        result = QueryReader(query=matcher, cls=self._cls).result()
+        self._set_result(QueryReader(query=matcher, cls=self._cls).result())
+
+    def _set_result(self: V, result: dict[str, Any]) -> None:
         if result.get('_virtual') is not None:
             self._virtual = result['_virtual']
         if result.get('_match') is not None:
@@ -312,6 +711,12 @@ class BaseListQuery(BaseQuery[T]):
         if result.get('_omit') is not None:
             self._use_omit = True
             self._omit = result['_omit']
+        if result.get('_after') is not None:
+            self.after(result['_after'] or None)
+        if result.get('_before') is not None:
+            self.before(result['_before'] or None)
+        if result.get('_options') is not None:
+            self._options.update(result['_options'])
         if result.get('_includes') is not None:
             for item in result['_includes']:
                 if type(item) is str:
@@ -343,6 +748,30 @@ class BaseListQuery(BaseQuery[T]):
         self._skip = n
         return self
 
+    def max_results(self: V, n: int) -> V:
+        """Raise `TooManyResultsException` as soon as more than `n` objects
+        come off the cursor.
+        """
+        self._max_results = n
+        return self
+
+    def after(self: V, token: Optional[str] = None) -> V:
+        """Paginate by keyset. Fetch the page after the object of `token`, or
+        the first page if `token` is None. The results carry the tokens of
+        their neighbor pages. Page size is the limit or the page size.
+        """
+        self._cursor_direction = 1
+        self._cursor_token = token
+        return self
+
+    def before(self: V, token: Optional[str] = None) -> V:
+        """Paginate by keyset. Fetch the page before the object of `token`,
+        or the last page if `token` is None.
+        """
+        self._cursor_direction = -1
+        self._cursor_token = token
+        return self
+
     def limit(self: V, n: int) -> V:
         self._limit = n
         return self
@@ -370,8 +799,134 @@ class BaseListQuery(BaseQuery[T]):
         self._omit = names
         return self
 
+    def _page_length(self: V) -> Optional[int]:
+        if self._page_size is not None:
+            return self._page_size
+        return self._limit
+
+    def _window(self: V) -> tuple[Any, Any]:
+        """The skip and limit of this query. A keyset paginated query fetches
+        one more object to know whether there's a next page, unless it's
+        without look-ahead.
+        """
+        if self._resolved_window is not None:
+            return self._resolved_window
+        if self._cursor_direction is not None:
+            length = self._page_length()
+            if length is not None and self._lookahead:
+                length += 1
+            return (None, length)
+        if self._page_number is not None and self._page_size is not None:
+            return ((self._page_number - 1) * self._page_size,
+                    self._page_size)
+        return (self._skip, self._limit)
+
+    def _keyset_sort(self: V) -> list[tuple[str, int]]:
+        return keyset_sort(self._sort, cast(int, self._cursor_direction))
+
+    def _without_lookahead(self: V) -> V:
+        """A copy of this query which selects exactly the objects of its keyset
+        page in order. It's used by queries which don't decode pages.
+        """
+        query = copy(self)
+        query._lookahead = False
+        return query
+
+    def _keyset_values(self: V) -> Optional[list[Any]]:
+        if self._cursor_values is not None:
+            return self._cursor_values
+        if self._cursor_token is None:
+            return None
+        return decode_token(self._cursor_token, keyset_sort(self._sort, 1))
+
+    def _template(self: V, values: list[Any]) -> Optional[V]:
+        template = copy(self)
+        if hasattr(template, '_final_pick'):
+            del template._final_pick
+        if self._match is not None:
+            template._match = slot_literals(self._match, values)
+        if self._cursor_direction is not None:
+            cursor_values = self._keyset_values()
+            if cursor_values is not None:
+                # null boundaries build different matchers, they're kept
+                template._cursor_values = [
+                    None if v is None else literal_slot(v, values)
+                    for v in cursor_values]
+            template._cursor_token = None
+        skip, limit = self._window()
+        template._resolved_window = (
+            None if skip is None else literal_slot(skip, values),
+            None if limit is None else literal_slot(limit, values))
+        template._skip = None
+        template._limit = None
+        template._page_number = None
+        template._page_size = None
+        template.subqueries = []
+        for subquery in self.subqueries:
+            subtemplate = None
+            if subquery.query is not None:
+                subtemplate = subquery.query._template(values)
+                if subtemplate is None:
+                    return None
+            template.subqueries.append(
+                Subquery(subquery.name, subtemplate, subquery.strategy))
+        return template
+
+    def _shape(self: V) -> Hashable:
+        return (super()._shape(), freeze(self._match), freeze(self._sort),
+                freeze(self._resolved_window),
+                self._use_pick, freeze(self._pick),
+                self._use_omit, freeze(self._omit),
+                freeze(self._virtual), self._cursor_direction,
+                freeze(self._cursor_values), self._lookahead)
+
     def _build_aggregate_pipeline(self: V) -> list[dict[str, Any]]:
         lookups = super()._build_aggregate_pipeline()
+        result = self._filter_stages()
+        keyset = self._keyset_stages()
+        if len(keyset) > 0:
+            result = merge_match(result, keyset[0]['$match'])
+        result.extend(self._window_stages())
+        result.extend(self._projection_stages())
+        result.extend(lookups)
+        return result
+
+    def _build_total_pipeline(self: V) -> list[dict[str, Any]]:
+        """Build a pipeline which returns a page of objects and the count of
+        all matched objects in a single document. The count branch only
+        filters.
+        """
+        lookups = super()._build_aggregate_pipeline()
+        items = self._keyset_stages()
+        items.extend(self._window_stages())
+        items.extend(self._projection_stages())
+        items.extend(lookups)
+        if len(items) == 0:
+            items.append({'$skip': 0})
+        result = self._filter_stages()
+        result.append({'$facet': {
+            'items': items,
+            'total': [{'$count': 'count'}]
+        }})
+        return result
+
+    def _build_group_pipeline(self: V) -> list[dict[str, Any]]:
+        """Build the stages that select the objects to group. Projection and
+        lookups are left out.
+        """
+        result = self._filter_stages()
+        keyset = self._keyset_stages()
+        if len(keyset) > 0:
+            result = merge_match(result, keyset[0]['$match'])
+        result.extend(self._window_stages())
+        return result
+
+    def _build_count_pipeline(self: V) -> list[dict[str, Any]]:
+        result = self._filter_stages()
+        result.append({'$count': 'count'})
+        return result
+
+    def _filter_stages(self: V) -> list[dict[str, Any]]:
         result: list[dict[str, Any]] = []
         if self._virtual is not None:
             for virtual in self._virtual:
@@ -422,16 +977,35 @@ class BaseListQuery(BaseQuery[T]):
                 result.append({'$unset': field.name})
         if self._match is not None:
             result.append({'$match': self._match})
-        if self._sort is not None:
-            result.append({'$sort': dict(self._sort)})
-        if self._page_number is not None and self._page_size is not None:
-            result.append({'$skip': (self._page_number - 1) * self._page_size})
-            result.append({'$limit': self._page_size})
-        else:
-            if self._skip is not None:
-                result.append({'$skip': self._skip})
-            if self._limit is not None:
-                result.append({'$limit': self._limit})
+        return result
+
+    def _keyset_stages(self: V) -> list[dict[str, Any]]:
+        if self._cursor_direction is None:
+            return []
+        cursor_values = self._keyset_values()
+        if cursor_values is None:
+            return []
+        return [{'$match': keyset_matcher(self._keyset_sort(),
+                                          cursor_values)}]
+
+    def _window_stages(self: V) -> list[dict[str, Any]]:
+        result: list[dict[str, Any]] = []
+        sort = self._sort
+        if self._cursor_direction is not None:
+            sort = self._keyset_sort()
+        if sort is not None:
+            result.append({'$sort': dict(sort)})
+        skip, limit = self._window()
+        if skip is not None:
+            result.append({'$skip': skip})
+        if limit is not None:
+            result.append({'$limit': limit})
+        if not self._lookahead and self._cursor_direction == -1:
+            result.append({'$sort': dict(keyset_sort(self._sort, 1))})
+        return result
+
+    def _projection_stages(self: V) -> list[dict[str, Any]]:
+        result: list[dict[str, Any]] = []
         if self._use_omit or self._use_pick:
             kds = self._cls.cdef.jconf.input_key_strategy
             if self._omit and self._pick:
@@ -461,16 +1035,129 @@ class BaseListQuery(BaseQuery[T]):
             pdict = {k: 1 for k in finalpick}
             if omit_primary:
                 pdict['_id'] = 0
+            if self._cursor_direction is not None:
+                # keyset tokens are read from the sort keys
+                for key, _ in self._keyset_sort():
+                    pdict[key] = 1
             result.append({'$project': pdict})
-        result.extend(lookups)
         return result
 
+    def _batch_loaded(self: V) -> bool:
+        return any(s.strategy == 'batch' for s in self.subqueries)
+
     def _exec(self: V) -> list[T]:
-        pipeline = self._build_aggregate_pipeline()
+        pipeline = self._aggregate_pipeline()
         collection = Connection.get_collection(self._cls)
-        cursor = collection.aggregate(pipeline)
-        results = [result for result in cursor]
-        return Decoder().decode_root_list(results, self._cls, None, self)
+        cursor = aggregate(collection, pipeline, self._options)
+        stream = ListDecoder(self)
+        try:
+            if self._batch_loaded():
+                results = [result for result in cursor]
+                load(self._cls, self.subqueries, results, self._options)
+                stream.feed_list(results)
+            else:
+                for result in cursor:
+                    if not stream.feed(result):
+                        break
+        finally:
+            cursor.close()
+        return stream.finish()
+
+    async def _aexec(self: V) -> list[T]:
+        pipeline = self._aggregate_pipeline()
+        collection = AsyncConnection.get_collection(self._cls)
+        cursor = await aaggregate(collection, pipeline, self._options)
+        stream = ListDecoder(self)
+        try:
+            if self._batch_loaded():
+                results = await cursor.to_list()
+                await aload(self._cls, self.subqueries, results,
+                            self._options)
+                stream.feed_list(results)
+            else:
+                async for result in cursor:
+                    if not stream.feed(result):
+                        break
+        finally:
+            await cursor.close()
+        return stream.finish()
+
+    def _decode(self: V, results: list[dict[str, Any]]) -> list[T]:
+        stream = ListDecoder(self)
+        stream.feed_list(results)
+        return stream.finish()
+
+
+class ListDecoder(Generic[T]):
+    """List decoder decodes the documents of a list query as they come off
+    the cursor, a raw document is released once it's decoded. The objects are
+    marked unmodified together at last, shared objects are marked once.
+    Keyset pages keep their first and last documents for the page tokens.
+    """
+
+    def __init__(self, query: BaseListQuery[T]) -> None:
+        self.query = query
+        self.decoder = Decoder(query._options.get('lazy', False))
+        self.graph = MGraph()
+        self.types = Types().objof(query._cls)
+        self.objects: list[T] = []
+        self.length: Optional[int] = None
+        if query._cursor_direction is not None:
+            self.length = query._page_length()
+        self.has_more = False
+        self.first: Optional[dict[str, Any]] = None
+        self.last: Optional[dict[str, Any]] = None
+
+    def feed(self, document: dict[str, Any]) -> bool:
+        """Decode a document. Returns False if no more documents are
+        needed.
+        """
+        count = len(self.objects)
+        if self.length is not None and count == self.length:
+            self.has_more = True
+            return False
+        limit = self.query._max_results
+        if limit is not None and count == limit:
+            raise TooManyResultsException(
+                f'{self.query._cls.__name__} query returns more than '
+                f'{limit} results.')
+        if self.query._cursor_direction is not None:
+            if self.first is None:
+                self.first = document
+            self.last = document
+        self.objects.append(self.decoder.decode_instance(
+            document, self.query._cls, self.types, self.graph, self.query))
+        return True
+
+    def feed_list(self, documents: list[dict[str, Any]]) -> None:
+        for index, document in enumerate(documents):
+            documents[index] = cast(dict[str, Any], None)
+            if not self.feed(document):
+                return
+
+    def finish(self) -> list[T]:
+        self.decoder.mark_decoded()
+        if self.query._cursor_direction is None:
+            return self.objects
+        backward = self.query._cursor_direction < 0
+        first, last = self.first, self.last
+        if backward:
+            self.objects.reverse()
+            first, last = last, first
+        sort = keyset_sort(self.query._sort, 1)
+        first_token, last_token = None, None
+        if first is not None and last is not None:
+            first_token = encode_token(first, sort)
+            last_token = encode_token(last, sort)
+        token_given = self.query._cursor_token is not None \
+            or self.query._cursor_values is not None
+        if backward:
+            next_token = last_token if token_given else None
+            previous_token = first_token if self.has_more else None
+        else:
+            next_token = last_token if self.has_more else None
+            previous_token = first_token if token_given else None
+        return KeysetList(self.objects, next_token, previous_token)
 
 
 class ListQuery(BaseListQuery[T]):
@@ -480,9 +1167,11 @@ class ListQuery(BaseListQuery[T]):
     def exec(self) -> list[T]:
         return self._exec()
 
-    def __await__(self) -> Generator[None, None, list[T]]:
-        yield
-        return self.exec()
+    async def aexec(self) -> list[T]:
+        return await self._aexec()
+
+    def __await__(self) -> Generator[Any, None, list[T]]:
+        return self.aexec().__await__()
 
     def avg(self, field_name: str) -> AvgQuery:
         return AvgQuery(self, field_name)
@@ -499,6 +1188,36 @@ class ListQuery(BaseListQuery[T]):
     def pages(self) -> PagesQuery:
         return PagesQuery(self)
 
+    def stats(self,
+              avg: Optional[list[str]] = None,
+              min: Optional[list[str]] = None,
+              max: Optional[list[str]] = None,
+              sum: Optional[list[str]] = None,
+              count: bool = False) -> StatsQuery:
+        return StatsQuery(self, avg=avg, min=min, max=max, sum=sum,
+                          count=count)
+
+    def group_by(self, *fields: str, unit: Optional[str] = None,
+                 buckets: Optional[int] = None) -> GroupQuery:
+        return GroupQuery(self, list(fields), unit=unit, buckets=buckets)
+
+    def count(self, estimated: bool = False) -> CountQuery:
+        return CountQuery(self, estimated)
+
+    def with_total(self) -> TotalQuery:
+        return TotalQuery(self)
+
+    def to_columns(self, names: list[str],
+                   arrays: bool = True) -> ColumnsQuery:
+        return ColumnsQuery(self, names, arrays)
+
+    def paginate(self, page_number: int,
+                 page_size: Optional[int] = None) -> TotalQuery:
+        if page_size is not None:
+            self.page_size(page_size)
+        self.page_number(page_number)
+        return TotalQuery(self)
+
 
 class SingleQuery(BaseListQuery[T]):
     """Queries only one object from the query.
@@ -506,19 +1225,25 @@ class SingleQuery(BaseListQuery[T]):
 
     def exec(self) -> T:
         self._limit = 1
-        results = self._exec()
+        return self._one(self._exec())
+
+    async def aexec(self) -> T:
+        self._limit = 1
+        return self._one(await self._aexec())
+
+    def _one(self, results: list[T]) -> T:
         if len(results) == 0:
             raise ObjectNotFoundException('object is not found')
         return results[0]
 
-    def __await__(self) -> Generator[None, None, T]:
-        yield
-        return self.exec()
+    def __await__(self) -> Generator[Any, None, T]:
+        return self.aexec().__await__()
 
     @property
     def optional(self) -> OptionalSingleQuery:
         query = OptionalSingleQuery(cls=self._cls)
         query.subqueries = self.subqueries
+        query._options = self._options
         query._match = self._match
         query._sort = self._sort
         query._page_number = self._page_number
@@ -538,14 +1263,19 @@ class OptionalSingleQuery(BaseListQuery[T]):
 
     def exec(self) -> Optional[T]:
         self._limit = 1
-        results = self._exec()
+        return self._one(self._exec())
+
+    async def aexec(self) -> Optional[T]:
+        self._limit = 1
+        return self._one(await self._aexec())
+
+    def _one(self, results: list[T]) -> Optional[T]:
         if len(results) == 0:
             return None
         return results[0]
 
-    def __await__(self) -> Generator[None, None, Optional[T]]:
-        yield
-        return self.exec()
+    def __await__(self) -> Generator[Any, None, Optional[T]]:
+        return self.aexec().__await__()
 
 
 class BaseIDQuery(BaseQuery[T]):
@@ -560,12 +1290,15 @@ class BaseIDQuery(BaseQuery[T]):
         self.list_query = ListQuery(cls=cls, filter=matcher)
         self._id = id
 
-    def include(self: U, name: str, query: Optional[BaseQuery] = None) -> U:
-        self.list_query.include(name, query)
+    def include(self: U,
+                name: str,
+                query: Optional[BaseQuery] = None,
+                strategy: str = 'lookup') -> U:
+        self.list_query.include(name, query, strategy)
         return self
 
     def _build_aggregate_pipeline(self: BaseIDQuery) -> list[dict[str, Any]]:
-        list_query_results = self.list_query._build_aggregate_pipeline()
+        list_query_results = self.list_query._aggregate_pipeline()
         idvalue = idval(self._cls.cdef.primary_field, self._id)
         result = [{'$match': {'_id': idvalue}}]
         for v in list_query_results:
@@ -576,13 +1309,28 @@ class BaseIDQuery(BaseQuery[T]):
         return result
 
     def _exec(self) -> Optional[T]:
-        pipeline = self._build_aggregate_pipeline()
+        pipeline = self._aggregate_pipeline()
         collection = Connection.get_collection(self._cls)
-        cursor = collection.aggregate(pipeline)
+        cursor = aggregate(collection, pipeline, self._options)
         results = [result for result in cursor]
+        load(self._cls, self.list_query.subqueries, results,
+             self._options)
+        return self._decode(results)
+
+    async def _aexec(self) -> Optional[T]:
+        pipeline = self._aggregate_pipeline()
+        collection = AsyncConnection.get_collection(self._cls)
+        cursor = await aaggregate(collection, pipeline, self._options)
+        results = await cursor.to_list()
+        await aload(self._cls, self.list_query.subqueries, results,
+             self._options)
+        return self._decode(results)
+
+    def _decode(self, results: list[dict[str, Any]]) -> Optional[T]:
         if len(results) == 0:
             return None
-        return Decoder().decode_root(results[0], self._cls, None, self)
+        decoder = Decoder(self._options.get('lazy', False))
+        return decoder.decode_root(results[0], self._cls, None, self)
 
 
 class IDQuery(BaseIDQuery[T]):
@@ -591,20 +1339,26 @@ class IDQuery(BaseIDQuery[T]):
     """
 
     def exec(self) -> T:
-        result = self._exec()
+        return self._found(self._exec())
+
+    async def aexec(self) -> T:
+        return self._found(await self._aexec())
+
+    def _found(self, result: Optional[T]) -> T:
         if result is not None:
             return result
         raise ObjectNotFoundException(
             f'{self._cls.__name__}(_id={self._id}) not found.')
 
-    def __await__(self) -> Generator[None, None, T]:
-        yield
-        return self.exec()
+    def __await__(self) -> Generator[Any, None, T]:
+        return self.aexec().__await__()
 
     @property
     def optional(self) -> OptionalIDQuery:
         new_query = OptionalIDQuery(cls=self._cls, id=self._id)
         new_query.subqueries = self.subqueries
+        new_query.list_query = self.list_query
+        new_query._options = self._options
         return new_query
 
 
@@ -615,9 +1369,11 @@ class OptionalIDQuery(BaseIDQuery[T]):
     def exec(self) -> Optional[T]:
         return self._exec()
 
-    def __await__(self) -> Generator[None, None, Optional[T]]:
-        yield
-        return self.exec()
+    async def aexec(self) -> Optional[T]:
+        return await self._aexec()
+
+    def __await__(self) -> Generator[Any, None, Optional[T]]:
+        return self.aexec().__await__()
 
 
 class IDSQuery(BaseQuery[T]):
@@ -629,12 +1385,15 @@ class IDSQuery(BaseQuery[T]):
         self.list_query = ListQuery(cls=cls, filter=matcher)
         self._ids = ids
 
-    def include(self: U, name: str, query: Optional[BaseQuery] = None) -> U:
-        self.list_query.include(name, query)
+    def include(self: U,
+                name: str,
+                query: Optional[BaseQuery] = None,
+                strategy: str = 'lookup') -> U:
+        self.list_query.include(name, query, strategy)
         return self
 
     def _build_aggregate_pipeline(self: BaseIDQuery) -> list[dict[str, Any]]:
-        list_query_results = self.list_query._build_aggregate_pipeline()
+        list_query_results = self.list_query._aggregate_pipeline()
         ids = [ObjectId(id) for id in self._ids]
         result = [{'$match': {'_id': {'$in': ids}}}]
         for v in list_query_results:
@@ -647,139 +1406,697 @@ class IDSQuery(BaseQuery[T]):
     def exec(self) -> list[T]:
         return self._exec()
 
+    async def aexec(self) -> list[T]:
+        return await self._aexec()
+
     def _exec(self) -> list[T]:
-        pipeline = self._build_aggregate_pipeline()
+        pipeline = self._aggregate_pipeline()
         collection = Connection.get_collection(self._cls)
-        cursor = collection.aggregate(pipeline)
+        cursor = aggregate(collection, pipeline, self._options)
         results = [result for result in cursor]
-        return Decoder().decode_root_list(results, self._cls, None, self)
+        load(self._cls, self.list_query.subqueries, results,
+             self._options)
+        decoder = Decoder(self._options.get('lazy', False))
+        return decoder.decode_root_list(results, self._cls, None, self)
+
+    async def _aexec(self) -> list[T]:
+        pipeline = self._aggregate_pipeline()
+        collection = AsyncConnection.get_collection(self._cls)
+        cursor = await aaggregate(collection, pipeline, self._options)
+        results = await cursor.to_list()
+        await aload(self._cls, self.list_query.subqueries, results,
+             self._options)
+        decoder = Decoder(self._options.get('lazy', False))
+        return decoder.decode_root_list(results, self._cls, None, self)
 
-    def __await__(self) -> Generator[None, None, list[T]]:
-        yield
-        return self.exec()
+    def __await__(self) -> Generator[Any, None, list[T]]:
+        return self.aexec().__await__()
 
 
 class ExistQuery(BaseListQuery[T]):
 
+    def _explain_command(self) -> dict[str, Any]:
+        return explain_command(self._cls.pconf.collection_name,
+                               [{'$match': self._match or {}}, {'$limit': 1}],
+                               self._options)
+
     def exec(self) -> bool:
         collection = Connection.get_collection(self._cls)
-        result = collection.count_documents(self._match or {}, limit=1)
+        result = collection.count_documents(
+            self._match or {}, limit=1,
+            **command_options(self._options, COUNT_OPTIONS))
+        return False if result == 0 else True
+
+    async def aexec(self) -> bool:
+        collection = AsyncConnection.get_collection(self._cls)
+        result = await collection.count_documents(
+            self._match or {}, limit=1,
+            **command_options(self._options, COUNT_OPTIONS))
         return False if result == 0 else True
 
-    def __await__(self) -> Generator[None, None, bool]:
-        yield
-        return self.exec()
+    def __await__(self) -> Generator[Any, None, bool]:
+        return self.aexec().__await__()
 
 
 class QueryIterator(Generic[T]):
+    """Query iterator reads the cursor in batches of `batch_size` documents,
+    batch includes are loaded once per batch. If `window` is given, the
+    identity map is dropped every `window` objects, thus memory stays flat
+    while objects inside a window are still deduplicated.
+    """
 
-    def __init__(self, cls: type[T], cursor: Cursor):
+    def __init__(self,
+                 cls: type[T],
+                 cursor: Cursor | CommandCursor,
+                 subqueries: Optional[list[Subquery]] = None,
+                 batch_size: int = 100,
+                 options: Optional[dict[str, Any]] = None,
+                 window: Optional[int] = None):
         self.cls = cls
         self.cursor = cursor
+        self.subqueries = subqueries or []
+        self.options = options
+        self.batch_size = batch_size
+        self.window = window
         self.graph = MGraph()
+        self.decoder = Decoder((options or {}).get('lazy', False))
+        self._count: int = 0
+        self._batch: list[Optional[dict[str, Any]]] = []
+        self._index: int = 0
 
     def __iter__(self):
         return self
 
     def __next__(self) -> T:
-        value = self.cursor.__next__()
-        return Decoder().decode_root(value, self.cls, self.graph, self)
+        if self._index >= len(self._batch):
+            batch = list(islice(self.cursor, self.batch_size))
+            if len(batch) == 0:
+                raise StopIteration
+            load(self.cls, self.subqueries, batch, self.options)
+            self._batch = cast(list[Optional[dict[str, Any]]], batch)
+            self._index = 0
+        value = cast(dict[str, Any], self._batch[self._index])
+        self._batch[self._index] = None
+        self._index += 1
+        return self._decode(value)
+
+    def _decode(self, value: dict[str, Any]) -> T:
+        if self.window is not None and self._count % self.window == 0:
+            self.graph = MGraph()
+        self._count += 1
+        return self.decoder.decode_root(value, self.cls, self.graph, self)
+
+
+class AsyncQueryIterator(Generic[T]):
+    """Async query iterator fetches cursor batches in a background task while
+    the current batch is being decoded. At most `prefetch` fetched batches
+    are waiting to be decoded. The identity map is windowed as the one of
+    `QueryIterator`.
+
+    Leaving the iteration before it's exhausted should stop the background
+    task and close the cursor. Iterate inside `async with` or call `aclose`
+    to do this. An iterator which is left without either stops its task when
+    it's garbage collected, and the task closes the cursor.
+    """
+
+    def __init__(self,
+                 cls: type[T],
+                 open_cursor: Callable[
+                     [], Awaitable[AsyncCursor | AsyncCommandCursor]],
+                 batch_size: int = 100,
+                 prefetch: int = 1,
+                 subqueries: Optional[list[Subquery]] = None,
+                 options: Optional[dict[str, Any]] = None,
+                 window: Optional[int] = None):
+        self.cls = cls
+        self.open_cursor = open_cursor
+        self.subqueries = subqueries or []
+        self.options = options
+        self.window = window
+        self._count: int = 0
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.graph = MGraph()
+        self.decoder = Decoder((options or {}).get('lazy', False))
+        self._queue: Optional[Queue[list[dict[str, Any]] | Exception]] = None
+        self._task: Optional[Task[None]] = None
+        self._batch: list[Optional[dict[str, Any]]] = []
+        self._index: int = 0
+        self._done: bool = False
+
+    def __aiter__(self):
+        return self
+
+    async def __aenter__(self) -> AsyncQueryIterator[T]:
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.aclose()
+
+    async def __anext__(self) -> T:
+        while self._index >= len(self._batch):
+            if self._done:
+                raise StopAsyncIteration
+            if self._task is None:
+                self._queue = Queue(maxsize=self.prefetch)
+                self._task = ensure_future(_prefetch(
+                    self.open_cursor, self.batch_size, self._queue))
+                # the task doesn't refer to this iterator
+                finalize(self, self._task.cancel)
+            item = await cast(Queue, self._queue).get()
+            if isinstance(item, Exception):
+                self._done = True
+                raise item
+            if len(item) == 0:
+                self._done = True
+                raise StopAsyncIteration
+            await aload(self.cls, self.subqueries, item, self.options)
+            self._batch = item
+            self._index = 0
+            # let the fetching task request the next batch before decoding
+            await sleep(0)
+        value = cast(dict[str, Any], self._batch[self._index])
+        self._batch[self._index] = None
+        self._index += 1
+        return self._decode(value)
+
+    def _decode(self, value: dict[str, Any]) -> T:
+        if self.window is not None and self._count % self.window == 0:
+            self.graph = MGraph()
+        self._count += 1
+        return self.decoder.decode_root(value, self.cls, self.graph, self)
+
+    async def aclose(self) -> None:
+        """Stop prefetching and close the cursor. Call this when leaving the
+        iteration before it's exhausted.
+        """
+        self._done = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+
+
+async def _prefetch(open_cursor: Callable[
+                        [], Awaitable[AsyncCursor | AsyncCommandCursor]],
+                    batch_size: int,
+                    queue: Queue[list[dict[str, Any]] | Exception]) -> None:
+    """Put the batches of a cursor into `queue`, and an empty batch at the
+    end. The cursor is closed when this is done or cancelled.
+    """
+    cursor: Optional[AsyncCursor | AsyncCommandCursor] = None
+    try:
+        cursor = await open_cursor()
+        while True:
+            batch = await cursor.to_list(batch_size)
+            await queue.put(batch)
+            if len(batch) == 0:
+                return
+    except Exception as exception:
+        await queue.put(exception)
+    finally:
+        if cursor is not None:
+            await cursor.close()
 
 
 class IterateQuery(BaseListQuery[T]):
 
-    def exec(self) -> Iterator[T]:
-        pipeline = self._build_aggregate_pipeline()
-        collection = Connection.get_collection(self._cls)
-        cursor = collection.aggregate(pipeline)
-        return QueryIterator(cls=self._cls, cursor=cursor)
+    def __init__(self: IterateQuery,
+                 cls: type[T],
+                 filter: Union[dict[str, Any], str, None] = None) -> None:
+        super().__init__(cls, filter)
+        self._lookahead = False
+        self._prefetch: int = 1
+        self._window_size: Optional[int] = None
+
+    def prefetch(self: IterateQuery, n: int) -> IterateQuery:
+        self._prefetch = n
+        return self
+
+    def window(self: IterateQuery, n: int) -> IterateQuery:
+        """Keep the identity map of at most `n` iterated objects."""
+        if n < 1:
+            raise ValueError('window should be a positive integer')
+        self._window_size = n
+        return self
 
-    def __await__(self) -> Generator[None, None, Iterator[T]]:
-        yield
-        return self.exec()
+    @property
+    def _iterate_options(self) -> dict[str, Any]:
+        return {'batch_size': 100, **self._options}
 
+    def exec(self) -> Iterator[T]:
+        pipeline = self._aggregate_pipeline()
+        collection = Connection.get_collection(self._cls)
+        options = self._iterate_options
+        cursor = aggregate(collection, pipeline, options)
+        return QueryIterator(cls=self._cls,
+                             cursor=cursor,
+                             subqueries=self.subqueries,
+                             batch_size=options['batch_size'],
+                             options=options,
+                             window=self._window_size)
+
+    async def _open_cursor(self) -> AsyncCursor | AsyncCommandCursor:
+        pipeline = self._aggregate_pipeline()
+        collection = AsyncConnection.get_collection(self._cls)
+        return await aaggregate(collection, pipeline, self._iterate_options)
+
+    async def aexec(self) -> AsyncQueryIterator[T]:
+        return self.__aiter__()
+
+    def __aiter__(self) -> AsyncQueryIterator[T]:
+        return AsyncQueryIterator(cls=self._cls,
+                                  open_cursor=self._open_cursor,
+                                  batch_size=self._iterate_options[
+                                      'batch_size'],
+                                  prefetch=self._prefetch,
+                                  subqueries=self.subqueries,
+                                  options=self._iterate_options,
+                                  window=self._window_size)
+
+    def __await__(self) -> Generator[Any, None, AsyncQueryIterator[T]]:
+        return self.aexec().__await__()
+
+
+class AccumulatorQuery(PipelineQuery):
+    """Accumulator query groups the results of a list query into a single
+    value with an accumulator operator.
+    """
 
-class AvgQuery:
+    operator: str
 
     def __init__(self, list_query: ListQuery, field_name: str):
         self.list_query = list_query
         self.filed_name = field_name
 
-    def exec(self) -> int | float:
-        result = self.list_query._build_aggregate_pipeline()
-        result.append({'$group': {'_id': None, self.filed_name: {'$avg': '$' + self.filed_name}}})
+    def _pipeline(self) -> list[dict[str, Any]]:
+        result = self.list_query._without_lookahead()._aggregate_pipeline()
+        cls = self.list_query._cls
+        name = cls.cdef.jconf.input_key_strategy(self.filed_name)
+        key = cls.pconf.to_db_key(name)
+        result.append({'$group': {'_id': None, self.filed_name: {self.operator: '$' + key}}})
+        return result
+
+    def exec(self) -> Any:
         coll = Connection.get_collection(self.list_query._cls)
-        return list(coll.aggregate(result))[0][self.filed_name]
+        return list(self._aggregate(coll))[0][self.filed_name]
 
-    def __await__(self) -> Generator[None, None, int | float]:
-        yield
-        return self.exec()
+    async def aexec(self) -> Any:
+        coll = AsyncConnection.get_collection(self.list_query._cls)
+        cursor = await self._aaggregate(coll)
+        return (await cursor.to_list())[0][self.filed_name]
 
+    def __await__(self) -> Generator[Any, None, Any]:
+        return self.aexec().__await__()
 
 
-class MinQuery:
+class AvgQuery(AccumulatorQuery):
 
-    def __init__(self, list_query: ListQuery, field_name: str):
+    operator = '$avg'
+
+
+class MinQuery(AccumulatorQuery):
+
+    operator = '$min'
+
+
+class MaxQuery(AccumulatorQuery):
+
+    operator = '$max'
+
+
+class SumQuery(AccumulatorQuery):
+
+    operator = '$sum'
+
+
+class Stats(NamedTuple):
+    avg: dict[str, Any]
+    min: dict[str, Any]
+    max: dict[str, Any]
+    sum: dict[str, Any]
+    count: Optional[int]
+
+
+class StatsQuery(PipelineQuery):
+    """Stats query computes several accumulators of a list query in a single
+    `$group` stage.
+    """
+
+    operators = ('avg', 'min', 'max', 'sum')
+
+    def __init__(self,
+                 list_query: ListQuery,
+                 avg: Optional[list[str]] = None,
+                 min: Optional[list[str]] = None,
+                 max: Optional[list[str]] = None,
+                 sum: Optional[list[str]] = None,
+                 count: bool = False):
         self.list_query = list_query
-        self.filed_name = field_name
+        self.fields = {'avg': avg or [], 'min': min or [],
+                       'max': max or [], 'sum': sum or []}
+        self.count = count
+
+    def _db_key(self, name: str) -> str:
+        cls = self.list_query._cls
+        return cls.pconf.to_db_key(cls.cdef.jconf.input_key_strategy(name))
+
+    def _accumulators(self) -> dict[str, Any]:
+        result: dict[str, Any] = {}
+        for operator in self.operators:
+            for index, name in enumerate(self.fields[operator]):
+                result[f'{operator}{index}'] = {
+                    '$' + operator: '$' + self._db_key(name)}
+        if self.count:
+            result['count'] = {'$sum': 1}
+        return result
 
-    def exec(self) -> Any:
-        result = self.list_query._build_aggregate_pipeline()
-        result.append({'$group': {'_id': None, self.filed_name: {'$min': '$' + self.filed_name}}})
+    def _pipeline(self) -> list[dict[str, Any]]:
+        query = self.list_query._without_lookahead()
+        result = query._aggregate_pipeline('_build_group_pipeline')
+        result.append({'$group': {'_id': None, **self._accumulators()}})
+        return result
+
+    def _values(self, result: dict[str, Any]) -> dict[str, Any]:
+        values: dict[str, Any] = {}
+        for operator in self.operators:
+            empty = 0 if operator == 'sum' else None
+            values[operator] = {
+                name: result.get(f'{operator}{index}', empty)
+                for index, name in enumerate(self.fields[operator])}
+        values['count'] = result.get('count', 0) if self.count else None
+        return values
+
+    def _stats(self, results: list[dict[str, Any]]) -> Stats:
+        return Stats(**self._values(results[0] if len(results) > 0 else {}))
+
+    def exec(self) -> Stats:
         coll = Connection.get_collection(self.list_query._cls)
-        return list(coll.aggregate(result))[0][self.filed_name]
+        return self._stats(list(self._aggregate(coll)))
 
-    def __await__(self) -> Generator[None, None, Any]:
-        yield
-        return self.exec()
+    async def aexec(self) -> Stats:
+        coll = AsyncConnection.get_collection(self.list_query._cls)
+        cursor = await self._aaggregate(coll)
+        return self._stats(await cursor.to_list())
 
+    def __await__(self) -> Generator[Any, None, Stats]:
+        return self.aexec().__await__()
 
-class MaxQuery:
 
-    def __init__(self, list_query: ListQuery, field_name: str):
-        self.list_query = list_query
-        self.filed_name = field_name
+class GroupRow(NamedTuple):
+    key: dict[str, Any]
+    avg: dict[str, Any]
+    min: dict[str, Any]
+    max: dict[str, Any]
+    sum: dict[str, Any]
+    count: Optional[int]
 
-    def exec(self) -> Any:
-        result = self.list_query._build_aggregate_pipeline()
-        result.append({'$group': {'_id': None, self.filed_name: {'$max': '$' + self.filed_name}}})
+
+DATE_UNITS = ('year', 'quarter', 'week', 'month', 'day', 'hour', 'minute',
+              'second', 'millisecond')
+
+
+class GroupQuery(StatsQuery):
+    """Group query computes accumulators of a list query per group. Date and
+    datetime fields are truncated to `unit` if it's provided. A numeric field
+    is grouped into `buckets` ranges of similar sizes if it's provided, the
+    key of a bucket is a dict of its `min` and `max`. Rows are streamed from
+    the cursor.
+    """
+
+    def __init__(self,
+                 list_query: ListQuery,
+                 fields: list[str],
+                 unit: Optional[str] = None,
+                 buckets: Optional[int] = None):
+        super().__init__(list_query)
+        if len(fields) == 0:
+            raise ValueError('group by at least one field')
+        cls = list_query._cls
+        ftypes = [cls.cdef.field_named(cls.cdef.jconf.input_key_strategy(name))
+                  .fdef.ftype for name in fields]
+        if unit is not None:
+            if unit not in DATE_UNITS:
+                raise ValueError(f'unknown date unit \'{unit}\'')
+            if all(t not in (FType.DATE, FType.DATETIME) for t in ftypes):
+                raise ValueError('unit truncates date or datetime fields, '
+                                 f'none of {", ".join(fields)} is')
+        if buckets is not None:
+            if len(fields) != 1:
+                raise ValueError('buckets group by exactly one field')
+            if buckets < 1:
+                raise ValueError('buckets should be a positive integer')
+            if ftypes[0] not in (FType.INT, FType.FLOAT):
+                raise ValueError('buckets group by numeric field, '
+                                 f'{fields[0]} is not numeric')
+        self.group_fields = fields
+        self.group_ftypes = ftypes
+        self.unit = unit
+        self.buckets = buckets
+
+    def agg(self,
+            avg: Optional[list[str]] = None,
+            min: Optional[list[str]] = None,
+            max: Optional[list[str]] = None,
+            sum: Optional[list[str]] = None,
+            count: bool = False) -> GroupQuery:
+        self.fields = {'avg': avg or [], 'min': min or [],
+                       'max': max or [], 'sum': sum or []}
+        self.count = count
+        return self
+
+    def _group_key(self, name: str, ftype: FType) -> Any:
+        key = '$' + self._db_key(name)
+        if self.unit is not None and ftype in (FType.DATE, FType.DATETIME):
+            return {'$dateTrunc': {'date': key, 'unit': self.unit}}
+        return key
+
+    def _pipeline(self) -> list[dict[str, Any]]:
+        query = self.list_query._without_lookahead()
+        result = query._aggregate_pipeline('_build_group_pipeline')
+        if self.buckets is not None:
+            result.append({'$bucketAuto': {
+                'groupBy': self._group_key(self.group_fields[0],
+                                           self.group_ftypes[0]),
+                'buckets': self.buckets,
+                'output': {**self._accumulators(), 'count': {'$sum': 1}}
+            }})
+            return result
+        key = {f'k{index}': self._group_key(name, ftype)
+               for index, (name, ftype)
+               in enumerate(zip(self.group_fields, self.group_ftypes))}
+        result.append({'$group': {'_id': key, **self._accumulators()}})
+        result.append({'$sort': {'_id': 1}})
+        return result
+
+    def _row(self, result: dict[str, Any]) -> GroupRow:
+        values = self._values(result)
+        if self.buckets is not None:
+            key = {self.group_fields[0]: result['_id']}
+            values['count'] = result.get('count', 0)
+        else:
+            key = {name: result['_id'].get(f'k{index}')
+                   for index, name in enumerate(self.group_fields)}
+        return GroupRow(key=key, **values)
+
+    def exec(self) -> Iterator[GroupRow]:
         coll = Connection.get_collection(self.list_query._cls)
-        return list(coll.aggregate(result))[0][self.filed_name]
+        for result in self._aggregate(coll):
+            yield self._row(result)
 
-    def __await__(self) -> Generator[None, None, Any]:
-        yield
-        return self.exec()
+    async def aexec(self) -> AsyncIterator[GroupRow]:
+        return self.__aiter__()
 
+    async def __aiter__(self) -> AsyncIterator[GroupRow]:
+        coll = AsyncConnection.get_collection(self.list_query._cls)
+        cursor = await self._aaggregate(coll)
+        async for result in cursor:
+            yield self._row(result)
 
-class SumQuery:
+    def __await__(self) -> Generator[Any, None, AsyncIterator[GroupRow]]:
+        return self.aexec().__await__()
 
-    def __init__(self, list_query: ListQuery, field_name: str):
+
+class CountQuery(PipelineQuery):
+    """Count query counts the objects matching a list query, regardless of
+    its pagination. Nothing is looked up or decoded. An estimated count reads
+    the collection metadata, it's only available for unfiltered queries.
+    """
+
+    def __init__(self, list_query: ListQuery, estimated: bool = False):
         self.list_query = list_query
-        self.filed_name = field_name
+        self.estimated = estimated
+        if estimated and (list_query._match or list_query._virtual):
+            raise ValueError('estimated count cannot be filtered')
+
+    def _pipeline(self) -> list[dict[str, Any]]:
+        return self.list_query._aggregate_pipeline('_build_count_pipeline')
+
+    def _explain_command(self) -> dict[str, Any]:
+        collection = self.list_query._cls.pconf.collection_name
+        options = self.list_query._options
+        if self.estimated:
+            return {'count': collection, **command_options(
+                options, ESTIMATED_COUNT_OPTIONS)}
+        if self.list_query._virtual is None:
+            return explain_command(collection, [
+                {'$match': self.list_query._match or {}},
+                {'$count': 'count'}], options)
+        return explain_command(collection, self._pipeline(), options)
+
+    def _count(self, results: list[dict[str, Any]]) -> int:
+        return results[0]['count'] if len(results) > 0 else 0
 
-    def exec(self) -> int | float:
-        result = self.list_query._build_aggregate_pipeline()
-        result.append({'$group': {'_id': None, self.filed_name: {'$sum': '$' + self.filed_name}}})
+    def exec(self) -> int:
         coll = Connection.get_collection(self.list_query._cls)
-        return list(coll.aggregate(result))[0][self.filed_name]
+        options = self.list_query._options
+        if self.estimated:
+            return coll.estimated_document_count(
+                **command_options(options, ESTIMATED_COUNT_OPTIONS))
+        if self.list_query._virtual is None:
+            return coll.count_documents(
+                self.list_query._match or {},
+                **command_options(options, COUNT_OPTIONS))
+        return self._count(list(self._aggregate(coll)))
+
+    async def aexec(self) -> int:
+        coll = AsyncConnection.get_collection(self.list_query._cls)
+        options = self.list_query._options
+        if self.estimated:
+            return await coll.estimated_document_count(
+                **command_options(options, ESTIMATED_COUNT_OPTIONS))
+        if self.list_query._virtual is None:
+            return await coll.count_documents(
+                self.list_query._match or {},
+                **command_options(options, COUNT_OPTIONS))
+        cursor = await self._aaggregate(coll)
+        return self._count(await cursor.to_list())
+
+    def __await__(self) -> Generator[Any, None, int]:
+        return self.aexec().__await__()
+
+
+class Page(NamedTuple):
+    items: list[Any]
+    total: int
+
+
+class TotalQuery(PipelineQuery):
+    """Total query fetches a page of a list query and the count of all objects
+    matching the list query in one round trip. The page is limited by the 16MB
+    document size of `$facet`.
+    """
 
-    def __await__(self) -> Generator[None, None, int | float]:
-        yield
-        return self.exec()
+    def __init__(self, list_query: ListQuery):
+        self.list_query = list_query
+
+    def _pipeline(self) -> list[dict[str, Any]]:
+        return self.list_query._aggregate_pipeline('_build_total_pipeline')
+
+    def _result(self, results: list[dict[str, Any]]) -> dict[str, Any]:
+        result = results[0] if len(results) > 0 else {}
+        result['items'] = result.get('items') or []
+        return result
+
+    def _page(self, result: dict[str, Any]) -> Page:
+        total = result.get('total') or [{'count': 0}]
+        items = self.list_query._decode(result['items'])
+        return Page(items=items, total=total[0]['count'])
+
+    def exec(self) -> Page:
+        query = self.list_query
+        coll = Connection.get_collection(query._cls)
+        result = self._result(list(self._aggregate(coll)))
+        load(query._cls, query.subqueries, result['items'], query._options)
+        return self._page(result)
 
+    async def aexec(self) -> Page:
+        query = self.list_query
+        coll = AsyncConnection.get_collection(query._cls)
+        cursor = await self._aaggregate(coll)
+        result = self._result(await cursor.to_list())
+        await aload(query._cls, query.subqueries, result['items'],
+                    query._options)
+        return self._page(result)
 
-class PagesQuery:
+    def __await__(self) -> Generator[Any, None, Page]:
+        return self.aexec().__await__()
+
+
+class PagesQuery(PipelineQuery):
 
     def __init__(self, list_query: ListQuery):
         self.list_query = list_query
 
-    def exec(self) -> int:
-        result = self.list_query._build_aggregate_pipeline()
+    def _pipeline(self) -> list[dict[str, Any]]:
+        result = self.list_query._without_lookahead()._aggregate_pipeline()
         result.append({'$count': 'count'})
-        coll = Connection.get_collection(self.list_query._cls)
+        return result
+
+    def _pages(self, results: list[dict[str, Any]]) -> int:
         page_size = self.list_query._page_size if self.list_query._page_size is not None else 30
-        return ceil(list(coll.aggregate(result))[0]['count'] / page_size)
+        return ceil(results[0]['count'] / page_size)
 
-    def __await__(self) -> Generator[None, None, int]:
-        yield
-        return self.exec()
+    def exec(self) -> int:
+        coll = Connection.get_collection(self.list_query._cls)
+        return self._pages(list(self._aggregate(coll)))
+
+    async def aexec(self) -> int:
+        coll = AsyncConnection.get_collection(self.list_query._cls)
+        cursor = await self._aaggregate(coll)
+        return self._pages(await cursor.to_list())
+
+    def __await__(self) -> Generator[Any, None, int]:
+        return self.aexec().__await__()
+
+
+class ColumnsQuery(PipelineQuery):
+    """Columns query reads fields of the objects of a list query into
+    columns. Only these fields are fetched, the objects are never built.
+    Includes of the list query are left out.
+    """
+
+    def __init__(self, list_query: ListQuery, names: list[str],
+                 arrays: bool = True):
+        self.list_query = list_query
+        self.names = names
+        self.arrays = arrays
+        self.fields = column_fields(list_query._cls, names)
+
+    def _pipeline(self) -> list[dict[str, Any]]:
+        query = self.list_query._without_lookahead()
+        result = query._aggregate_pipeline('_build_group_pipeline')
+        project = {column_key(field): 1 for field in self.fields}
+        project.setdefault('_id', 0)
+        result.append({'$project': project})
+        return result
+
+    def _reader(self) -> ColumnReader:
+        return ColumnReader(self.list_query._cls, self.names, self.arrays)
+
+    def exec(self) -> dict[str, Any]:
+        reader = self._reader()
+        coll = Connection.get_collection(self.list_query._cls)
+        cursor = self._aggregate(coll)
+        try:
+            for document in cursor:
+                reader.feed(document)
+        finally:
+            cursor.close()
+        return reader.finish()
+
+    async def aexec(self) -> dict[str, Any]:
+        reader = self._reader()
+        coll = AsyncConnection.get_collection(self.list_query._cls)
+        cursor = await self._aaggregate(coll)
+        try:
+            async for document in cursor:
+                reader.feed(document)
+        finally:
+            await cursor.close()
+        return reader.finish()
+
+    def __await__(self) -> Generator[Any, None, dict[str, Any]]:
+        return self.aexec().__await__()
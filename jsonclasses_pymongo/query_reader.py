@@ -4,14 +4,35 @@ from datetime import datetime, date, timedelta
 from re import compile, escape, IGNORECASE
 from bson.objectid import ObjectId
 from jsonclasses.fdef import FStore, FType, FDef, FSubtype
-from .utils import dbid, idval
+from .utils import dbid, idval, copy_structure
 from .pobject import PObject
+from .query_to_object import query_to_object
+from .lru import LRUCache
 from .readers import (
     readstr, readbool, readdate, readdatetime, readenum, readfloat, readint,
     readorder
 )
 
 
+OPTION_INSTRUCTORS = {'_hint': 'hint', '_max_time': 'max_time_ms',
+                      '_batch_size': 'batch_size',
+                      '_allow_disk_use': 'allow_disk_use',
+                      '_collation': 'collation', '_comment': 'comment'}
+query_string_cache: LRUCache[dict[str, Any]] = LRUCache(maxsize=1024)
+
+
+def read_query_string(query: str, cls: type[PObject]) -> dict[str, Any]:
+    """Read a query string of a class. Results are cached by class and query
+    string, a copy of the cached result is returned.
+    """
+    key = (cls, query)
+    result = query_string_cache.get(key)
+    if result is None:
+        result = QueryReader(query=query_to_object(query), cls=cls).result()
+        query_string_cache.put(key, result)
+    return copy_structure(result)
+
+
 class QueryReader:
 
     def __init__(self: QueryReader,
@@ -59,8 +80,26 @@ class QueryReader:
                 result['_omit'] = value
             elif key == '_pick':
                 result['_pick'] = value
+            elif key == '_after':
+                result['_after'] = readstr(value) or ''
+            elif key == '_before':
+                result['_before'] = readstr(value) or ''
+            elif key in OPTION_INSTRUCTORS:
+                options = result.setdefault('_options', {})
+                options[OPTION_INSTRUCTORS[key]] = self.readoption(key, value)
         return result
 
+    def readoption(self: QueryReader, key: str, value: Any) -> Any:
+        if key == '_hint':
+            return value if isinstance(value, str) else self.readorders(value)
+        if key in ('_max_time', '_batch_size'):
+            return readint(value)
+        if key == '_allow_disk_use':
+            return readbool(value)
+        if key == '_collation':
+            return {'locale': value} if isinstance(value, str) else value
+        return readstr(value)
+
     def readorders(self: QueryReader, val: Any) -> list[tuple[str, int]]:
         result = []
         if isinstance(val, dict):
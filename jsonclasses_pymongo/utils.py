@@ -1,11 +1,11 @@
 from __future__ import annotations
-from typing import cast, TYPE_CHECKING
+from typing import Any, cast, TYPE_CHECKING
+from functools import lru_cache
 from jsonclasses.fdef import FSubtype
 from jsonclasses.jobject import JObject
 from jsonclasses.jfield import JField
 from inflection import singularize
 from bson.objectid import ObjectId
-from .connection import Connection
 if TYPE_CHECKING:
     from .pobject import PObject
 
@@ -22,6 +22,7 @@ def ref_db_field_key(key: str, cls: type[PObject]) -> str:
     return db_field_name
 
 
+@lru_cache(maxsize=None)
 def ref_field_keys(key: str) -> str:
     return singularize(key) + '_ids'
 
@@ -32,6 +33,17 @@ def ref_db_field_keys(key: str, cls: type[PObject]) -> str:
     return db_field_name
 
 
+def copy_structure(value: Any) -> Any:
+    """Copy the dicts, lists and tuples of a value, leaves are shared."""
+    if isinstance(value, dict):
+        return {k: copy_structure(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_structure(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(copy_structure(item) for item in value)
+    return value
+
+
 def idval(field: JField, val: str) -> str | ObjectId:
     if field.fdef.fsubtype == FSubtype.MONGOID:
         return ObjectId(val)
@@ -49,16 +61,21 @@ def list_inst_type(field: JField) -> type[PObject]:
     return cast(PObject, field.types.fdef.item_types.fdef.inst_cls)
 
 
+_join_table_names: dict[JField, str] = {}
+
+
 def join_table_name(this: JField) -> str:
     from .pobject import PObject
+    name = _join_table_names.get(this)
+    if name is not None:
+        return name
     that = this.foreign_field
     this_cls = cast(type[PObject], this.cdef.cls)
     that_cls = cast(type[PObject], that.cdef.cls)
     this_fname = this_cls.pconf.to_db_key(this.name)
     that_fname = that_cls.pconf.to_db_key(that.name)
-    connection = Connection.from_class(this_cls)
-    cabase = connection.collection_from(this_cls).name
-    cbbase = connection.collection_from(that_cls).name
-    ca = cabase + this_fname.lower()
-    cb = cbbase + that_fname.lower()
-    return ca + cb if ca < cb else cb + ca
+    ca = this_cls.pconf.collection_name + this_fname.lower()
+    cb = that_cls.pconf.collection_name + that_fname.lower()
+    name = ca + cb if ca < cb else cb + ca
+    _join_table_names[this] = name
+    return name
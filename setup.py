@@ -22,7 +22,10 @@ setup(name='jsonclasses-pymongo',
       include_package_data=True,
       python_requires='>=3.10',
       install_requires=[
-            'pymongo>=4.0.1,<5.0.0',
+            'pymongo>=4.13.0,<5.0.0',
             'inflection-plus>=0.1.0,<2.0.0',
             'qsparser>=1.1.0,<2.0.0'
-      ])
+      ],
+      extras_require={
+            'numpy': ['numpy>=1.23.0']
+      })
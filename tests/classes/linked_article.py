@@ -0,0 +1,25 @@
+from __future__ import annotations
+from datetime import datetime
+from jsonclasses import jsonclass, types
+from jsonclasses_pymongo import pymongo
+
+
+@pymongo
+@jsonclass(class_graph='linked')
+class LinkedWriter:
+    id: str = types.readonly.str.primary.mongoid.required
+    name: str = types.str.unique.required
+    articles: list[LinkedArticle] = types.nonnull.listof('LinkedArticle') \
+                                         .linkedby('writer')
+    created_at: datetime = types.readonly.datetime.tscreated.required
+    updated_at: datetime = types.readonly.datetime.tsupdated.required
+
+
+@pymongo
+@jsonclass(class_graph='linked')
+class LinkedArticle:
+    id: str = types.readonly.str.primary.mongoid.required
+    title: str = types.str.unique.required
+    writer: LinkedWriter = types.linkto.objof('LinkedWriter')
+    created_at: datetime = types.readonly.datetime.tscreated.required
+    updated_at: datetime = types.readonly.datetime.tsupdated.required
@@ -0,0 +1,163 @@
+from __future__ import annotations
+import gc
+from asyncio import sleep
+from unittest import IsolatedAsyncioTestCase
+from jsonclasses.excs import ObjectNotFoundException
+from jsonclasses_pymongo.connection import Connection, AsyncConnection
+from tests.classes.simple_song import SimpleSong
+from tests.classes.simple_score import SimpleScore
+from tests.classes.linked_author import LinkedAuthor
+from tests.classes.linked_post import LinkedPost
+
+
+class TestAsync(IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        connection = Connection('simple')
+        connection.set_url('mongodb://localhost:27017/simple')
+        connection.connect()
+        connection = Connection('linked')
+        connection.set_url('mongodb://localhost:27017/linked')
+        connection.connect()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        connection = Connection('simple')
+        connection.disconnect()
+        connection = Connection('linked')
+        connection.disconnect()
+
+    def setUp(self) -> None:
+        collection = Connection.get_collection(SimpleSong)
+        collection.delete_many({})
+        collection = Connection.get_collection(SimpleScore)
+        collection.delete_many({})
+        collection = Connection.get_collection(LinkedAuthor)
+        collection.delete_many({})
+        collection = Connection.get_collection(LinkedPost)
+        collection.delete_many({})
+
+    async def asyncTearDown(self) -> None:
+        await AsyncConnection('simple').disconnect()
+        await AsyncConnection('linked').disconnect()
+
+    async def test_await_list_query_returns_objects(self):
+        SimpleSong(name='A', year=2020, artist='Thao').save()
+        SimpleSong(name='B', year=2021, artist='Thao').save()
+        songs = await SimpleSong.find(year={'_gt': 2020})
+        self.assertEqual(len(songs), 1)
+        self.assertEqual(songs[0].name, 'B')
+        self.assertEqual(songs[0].is_modified, False)
+
+    async def test_await_single_query_returns_object(self):
+        SimpleSong(name='A', year=2020, artist='Thao').save()
+        song = await SimpleSong.one(name='A')
+        self.assertEqual(song.year, 2020)
+        with self.assertRaises(ObjectNotFoundException):
+            await SimpleSong.one(name='B')
+        self.assertIsNone(await SimpleSong.one(name='B').optional)
+
+    async def test_await_id_query_returns_object_with_includes(self):
+        author = LinkedAuthor(name='A', posts=[
+            {'title': 'P1', 'content': 'C1'},
+            {'title': 'P2', 'content': 'C2'}])
+        author.save()
+        result = await LinkedAuthor.id(author.id).include('posts')
+        self.assertEqual(result.name, 'A')
+        self.assertEqual(len(result.posts), 2)
+
+    async def test_await_list_query_loads_batch_includes(self):
+        LinkedAuthor(name='A', posts=[
+            {'title': 'P1', 'content': 'C1'},
+            {'title': 'P2', 'content': 'C2'}]).save()
+        posts = await LinkedPost.find().order('title') \
+                                .include('author', strategy='batch')
+        self.assertEqual([p.author.name for p in posts], ['A', 'A'])
+
+    async def test_await_exist_query_returns_bool(self):
+        SimpleSong(name='A', year=2020, artist='Thao').save()
+        self.assertTrue(await SimpleSong.exist(name='A'))
+        self.assertFalse(await SimpleSong.exist(name='B'))
+
+    async def test_await_accumulator_query_returns_value(self):
+        SimpleScore(name='a', score=1).save()
+        SimpleScore(name='b', score=3).save()
+        self.assertEqual(await SimpleScore.find().sum('score'), 4)
+        self.assertEqual(await SimpleScore.find().avg('score'), 2)
+
+    async def test_await_iterate_query_returns_async_iterator(self):
+        for i in range(5):
+            SimpleSong(name=f'S{i}', year=2020, artist='Thao').save()
+        names = []
+        async for song in await SimpleSong.iterate():
+            names.append(song.name)
+        self.assertEqual(names, [f'S{i}' for i in range(5)])
+
+    async def test_async_for_iterates_with_prefetched_batches(self):
+        for i in range(25):
+            SimpleScore(name=f's{i}', score=i).save()
+        scores = []
+        async for score in SimpleScore.iterate().batch_size(4).prefetch(2):
+            scores.append(score.score)
+        self.assertEqual(scores, list(range(25)))
+
+    async def test_async_iterator_can_be_closed_before_exhausted(self):
+        for i in range(10):
+            SimpleScore(name=f's{i}', score=i).save()
+        iterator = SimpleScore.iterate().batch_size(3).__aiter__()
+        scores = []
+        async for score in iterator:
+            scores.append(score.score)
+            if len(scores) == 4:
+                break
+        await iterator.aclose()
+        self.assertEqual(scores, [0, 1, 2, 3])
+
+    async def test_async_iterator_stops_prefetching_when_left_early(self):
+        for i in range(10):
+            SimpleScore(name=f's{i}', score=i).save()
+        query = SimpleScore.iterate().batch_size(2)
+        closed = []
+
+        async def open_cursor():
+            cursor = await query._open_cursor()
+            close = cursor.close
+
+            async def record_close():
+                closed.append(True)
+                await close()
+            cursor.close = record_close
+            return cursor
+        iterator = query.__aiter__()
+        iterator.open_cursor = open_cursor
+        async with iterator:
+            async for score in iterator:
+                if score.score == 2:
+                    break
+        self.assertTrue(iterator._task.done())
+        self.assertEqual(closed, [True])
+        iterator = query.__aiter__()
+        async for score in iterator:
+            break
+        task = iterator._task
+        del iterator
+        gc.collect()
+        await sleep(0)
+        self.assertTrue(task.cancelled())
+
+    async def test_await_count_query_returns_count(self):
+        SimpleScore(name='a', score=1).save()
+        SimpleScore(name='b', score=3).save()
+        self.assertEqual(await SimpleScore.find(score={'_gt': 2}).count(), 1)
+        self.assertEqual(await SimpleScore.find().count(estimated=True), 2)
+
+    async def test_async_for_streams_grouped_rows(self):
+        SimpleScore(name='a', score=1).save()
+        SimpleScore(name='a', score=3).save()
+        SimpleScore(name='b', score=5).save()
+        rows = []
+        async for row in SimpleScore.find().group_by('name').agg(
+                avg=['score']):
+            rows.append((row.key['name'], row.avg['score']))
+        self.assertEqual(rows, [('a', 2), ('b', 5)])
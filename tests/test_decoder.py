@@ -256,3 +256,32 @@ class TestDecoder(TestCase):
         instance = Decoder().decode_root(data, MediumDecodeCamelizeDictKeys)
         self.assertEqual(
             instance.val, {'keyOne': 'val_one', 'keyTwo': 'val_two'})
+
+    def test_decode_root_list_marks_linked_objects_unmodified(self):
+        @pymongo
+        @jsonclass
+        class SimpleDecodeMarkAuthor:
+            id: str = types.readonly.str.primary.mongoid.required
+            name: str
+            posts: list[SimpleDecodeMarkPost] = types.listof(
+                'SimpleDecodeMarkPost').linkedby('author')
+
+        @pymongo
+        @jsonclass
+        class SimpleDecodeMarkPost:
+            id: str = types.readonly.str.primary.mongoid.required
+            title: str
+            author: SimpleDecodeMarkAuthor = types.linkto.objof(
+                SimpleDecodeMarkAuthor)
+        author = {'_id': ObjectId(), 'name': 'A'}
+        data = [{'_id': ObjectId(), 'title': f'P{i}',
+                 'authorId': author['_id'], 'author': author}
+                for i in range(3)]
+        posts = Decoder().decode_root_list(data, SimpleDecodeMarkPost)
+        self.assertIs(posts[0].author, posts[2].author)
+        self.assertEqual(len(posts[0].author.posts), 3)
+        self.assertFalse(posts[0].author.is_modified)
+        self.assertEqual(posts[0].author.modified_fields, ())
+        for post in posts:
+            self.assertFalse(post.is_new)
+            self.assertFalse(post.is_modified)
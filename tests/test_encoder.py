@@ -280,6 +280,20 @@ class TestEncoder(TestCase):
         self.assertEqual(address_0_data['ownerId'], owner_data['_id'])
         self.assertEqual(address_1_data['ownerId'], owner_data['_id'])
 
+    def test_encode_root_groups_commands_by_collection(self):
+        author = LinkedAuthor(name='A', posts=[
+            {'title': 'P1', 'content': 'C1'},
+            {'title': 'P2', 'content': 'C2'},
+            {'title': 'P3', 'content': 'C3'}])
+        batch_command = Encoder().encode_root(author)
+        bulk_commands = batch_command.bulk_commands()
+        self.assertEqual(len(bulk_commands), 2)
+        self.assertEqual(bulk_commands[0].collection.name, 'linkedposts')
+        self.assertEqual(len(bulk_commands[0].commands), 3)
+        self.assertEqual(bulk_commands[0].ordered, False)
+        self.assertEqual(bulk_commands[1].collection.name, 'linkedauthors')
+        self.assertEqual(len(bulk_commands[1].commands), 1)
+
     def test_encode_local_keys_instance_list(self):
         @pymongo
         @jsonclass
@@ -0,0 +1,66 @@
+from __future__ import annotations
+from unittest import TestCase
+from jsonclasses_pymongo.connection import Connection
+from jsonclasses_pymongo.explain import summarize
+from tests.classes.simple_score import SimpleScore
+
+
+class TestExplain(TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        connection = Connection('simple')
+        connection.set_url('mongodb://localhost:27017/simple')
+        connection.connect()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        connection = Connection('simple')
+        connection.disconnect()
+
+    def setUp(self) -> None:
+        collection = Connection.get_collection(SimpleScore)
+        collection.delete_many({})
+
+    def test_summarize_reads_find_plan(self):
+        plan = {
+            'queryPlanner': {
+                'winningPlan': {'stage': 'FETCH', 'inputStage': {
+                    'stage': 'IXSCAN', 'indexName': 'name_1'}},
+                'rejectedPlans': [{'stage': 'COLLSCAN'}]},
+            'executionStats': {'nReturned': 2, 'totalDocsExamined': 2}}
+        result = summarize(plan)
+        self.assertFalse(result.collscan)
+        self.assertEqual(result.indexes, ['name_1'])
+        self.assertEqual(result.docs_examined, 2)
+        self.assertEqual(result.docs_returned, 2)
+        self.assertEqual(result.unindexed_lookups, [])
+
+    def test_summarize_reads_aggregate_plan_with_lookups(self):
+        plan = {'stages': [
+            {'$cursor': {
+                'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}},
+                'executionStats': {'nReturned': 5, 'totalDocsExamined': 9}}},
+            {'$lookup': {'from': 'authors', 'as': 'author'},
+             'totalDocsExamined': 5, 'collectionScans': 0,
+             'indexesUsed': ['_id_'], 'nReturned': 5},
+            {'$lookup': {'from': 'tags', 'as': 'tags'},
+             'totalDocsExamined': 40, 'collectionScans': 5,
+             'indexesUsed': [], 'nReturned': 3}]}
+        result = summarize(plan)
+        self.assertTrue(result.collscan)
+        self.assertEqual(result.indexes, ['_id_'])
+        self.assertEqual(result.docs_examined, 54)
+        self.assertEqual(result.docs_returned, 3)
+        self.assertEqual(result.unindexed_lookups, ['tags'])
+
+    def test_explain_returns_server_plan_of_queries(self):
+        SimpleScore(name='a', score=1).save()
+        SimpleScore(name='b', score=3).save()
+        result = SimpleScore.find(score={'_gt': 2}).explain()
+        self.assertEqual(result.docs_returned, 1)
+        self.assertIn('queryPlanner', result.plan)
+        result = SimpleScore.find().count().explain('queryPlanner')
+        self.assertIsNone(result.docs_returned)
+        with self.assertRaises(ValueError):
+            SimpleScore.find().explain('all')
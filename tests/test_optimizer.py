@@ -0,0 +1,72 @@
+from __future__ import annotations
+from unittest import TestCase
+from jsonclasses_pymongo.optimizer import optimize
+from tests.classes.linked_author import LinkedAuthor
+from tests.classes.linked_post import LinkedPost
+
+
+class TestOptimizer(TestCase):
+
+    def test_optimize_hoists_match_ahead_of_lookup(self):
+        lookup = {'$lookup': {'from': 'b', 'localField': 'bId',
+                              'foreignField': '_id', 'as': 'b'}}
+        pipeline = [lookup, {'$unwind': '$b'}, {'$unset': 'b'},
+                    {'$match': {'name': 'a'}}, {'$sort': {'name': 1}}]
+        self.assertEqual(optimize(pipeline), [
+            {'$match': {'name': 'a'}}, lookup, {'$unwind': '$b'},
+            {'$unset': 'b'}, {'$sort': {'name': 1}}])
+
+    def test_optimize_keeps_match_on_looked_up_field_in_place(self):
+        pipeline = [{'$lookup': {'from': 'b', 'localField': 'bId',
+                                 'foreignField': '_id', 'as': 'b'}},
+                    {'$match': {'b.name': 'a'}}]
+        self.assertEqual(optimize(pipeline), pipeline)
+        pipeline = [{'$unset': 'b'}, {'$match': {'$expr': {'$eq': [1, 1]}}}]
+        self.assertEqual(optimize(pipeline), pipeline)
+
+    def test_optimize_merges_adjacent_matches_and_projects(self):
+        pipeline = [{'$match': {'a': 1}}, {'$match': {'b': 2}},
+                    {'$match': {'a': {'$gt': 0}}}, {'$match': {}},
+                    {'$project': {'a': 1, 'b': 1}}, {'$project': {'a': 1}}]
+        self.assertEqual(optimize(pipeline), [
+            {'$match': {'$and': [{'a': 1, 'b': 2}, {'a': {'$gt': 0}}]}},
+            {'$project': {'a': 1}}])
+
+    def test_optimize_drops_unset_of_fields_projected_away(self):
+        pipeline = [{'$unset': 'b'}, {'$sort': {'a': 1}}, {'$limit': 2},
+                    {'$project': {'a': 1}}]
+        self.assertEqual(optimize(pipeline), pipeline[1:])
+        pipeline = [{'$unset': 'b'}, {'$sort': {'b': 1}},
+                    {'$project': {'a': 1}}]
+        self.assertEqual(optimize(pipeline), pipeline)
+
+    def test_optimize_pushes_projection_into_lookup_pipeline(self):
+        lookup = {'$lookup': {'from': 'b', 'localField': 'bId',
+                              'foreignField': '_id', 'as': 'b',
+                              'pipeline': [{'$match': {'x': 1}}]}}
+        project = {'$project': {'name': 1, 'b.name': 1}}
+        result = optimize([lookup, {'$unwind': '$b'}, project])
+        self.assertEqual(result[0]['$lookup']['pipeline'], [
+            {'$match': {'x': 1}}, {'$project': {'name': 1, '_id': 1}}])
+        self.assertEqual(result[1:], [{'$unwind': '$b'}, project])
+        self.assertEqual(lookup['$lookup']['pipeline'], [{'$match': {'x': 1}}])
+
+    def test_optimize_keeps_exclusive_projection_id_in_lookup_pipeline(self):
+        lookup = {'$lookup': {'from': 'b', 'localField': 'bId',
+                              'foreignField': '_id', 'as': 'b',
+                              'pipeline': []}}
+        result = optimize([lookup, {'$project': {'b.content': 0}}])
+        self.assertEqual(result[0]['$lookup']['pipeline'],
+                         [{'$project': {'content': 0}}])
+
+    def test_optimize_leaves_generated_include_projections_in_place(self):
+        query = LinkedPost.find().pick(['title']).include(
+            'author', LinkedAuthor.find().pick(['name']))
+        result = optimize(query._build_aggregate_pipeline())
+        names = [next(iter(s)) for s in result]
+        self.assertEqual(names, ['$project', '$lookup', '$unwind'])
+        self.assertEqual(result[0]['$project'], {'title': 1, '_id': 0})
+        subpipeline = result[1]['$lookup']['pipeline']
+        self.assertEqual(subpipeline[-1], {'$project': {'name': 1, '_id': 0}})
+        self.assertEqual(
+            [s for s in subpipeline if '$project' in s], subpipeline[-1:])
@@ -1,9 +1,15 @@
 from __future__ import annotations
 from datetime import date, datetime, time, timezone
-from unittest import TestCase
+from unittest import TestCase, skipIf
 from math import ceil
 from statistics import mean
 from jsonclasses_pymongo.connection import Connection
+from jsonclasses_pymongo.pipeline_cache import pipeline_cache
+from jsonclasses_pymongo.query_reader import query_string_cache
+from jsonclasses_pymongo.query import find_arguments
+from jsonclasses_pymongo.decoder import Decoder
+from jsonclasses_pymongo.excs import TooManyResultsException
+from jsonclasses_pymongo.columns import numpy
 from tests.classes.simple_animal import SimpleAnimal
 from tests.classes.simple_datetime import SimpleDatetime
 from tests.classes.simple_score import SimpleScore
@@ -20,6 +26,7 @@ from tests.classes.linked_record import LinkedRecord, LinkedContent
 from tests.classes.linked_favorite import LinkedCourse, LinkedStudent
 from tests.classes.linked_song import LinkedSong, LinkedSinger
 from tests.classes.simple_hiphop_album import SimpleHiphopAlbum
+from tests.classes.simple_album import SimpleAlbum
 
 
 class TestQuery(TestCase):
@@ -84,6 +91,8 @@ class TestQuery(TestCase):
         collection.delete_many({})
         collection = Connection.get_collection(SimpleHiphopAlbum)
         collection.delete_many({})
+        collection = Connection.get_collection(SimpleAlbum)
+        collection.delete_many({})
 
     def test_query_objects_from_database(self):
         song0 = SimpleSong(name='Long', year=2020, artist='Thao')
@@ -1398,3 +1407,267 @@ class TestQuery(TestCase):
         results = SimpleHiphopAlbum.find({'_order': '-releaseYear'}).exec()
         years = [result.release_year for result in results]
         self.assertEqual(years, [2040, 2030, 2021, 2019, 2015, 1997])
+
+    def test_queries_of_a_same_shape_reuse_cached_pipeline(self):
+        SimpleSong(name='A', year=2018, artist='Thao').save()
+        SimpleSong(name='B', year=2019, artist='Thao').save()
+        SimpleSong(name='C', year=2020, artist='Thao').save()
+        pipeline_cache.clear()
+        results = SimpleSong.find(year={'_gt': 2018}).order('year').exec()
+        self.assertEqual([r.name for r in results], ['B', 'C'])
+        results = SimpleSong.find(year={'_gt': 2019}).order('year').exec()
+        self.assertEqual([r.name for r in results], ['C'])
+        self.assertEqual(pipeline_cache.misses, 1)
+        self.assertEqual(pipeline_cache.hits, 1)
+        results = SimpleSong.find(year={'_lt': 2019}).order('year').exec()
+        self.assertEqual([r.name for r in results], ['A'])
+        self.assertEqual(pipeline_cache.misses, 2)
+
+    def test_query_strings_are_read_once(self):
+        SimpleSong(name='A', year=2018, artist='Thao').save()
+        SimpleSong(name='B', year=2019, artist='Thao').save()
+        query_string_cache.clear()
+        query = 'year[_gte]=2019&_order=name'
+        results = SimpleSong.find(query).order('year', -1).exec()
+        self.assertEqual([r.name for r in results], ['B'])
+        results = SimpleSong.find(query).exec()
+        self.assertEqual([r.name for r in results], ['B'])
+        self.assertEqual(query_string_cache.misses, 1)
+        self.assertEqual(query_string_cache.hits, 1)
+        self.assertEqual(SimpleSong.find(query)._sort, [('name', 1)])
+
+    def test_query_execution_options_are_read_and_forwarded(self):
+        SimpleSong(name='A', year=2020, artist='Thao').save()
+        query = SimpleSong.find({'_maxTime': '500', '_comment': 'export',
+                                 '_hint': {'name': 1}, '_batchSize': 50,
+                                 '_allowDiskUse': 'true', '_collation': 'en'})
+        self.assertEqual(query._options, {
+            'max_time_ms': 500, 'comment': 'export', 'hint': [('name', 1)],
+            'batch_size': 50, 'allow_disk_use': True,
+            'collation': {'locale': 'en'}})
+        query = SimpleSong.find().max_time(100).comment('c').batch_size(10)
+        self.assertEqual([s.name for s in query.exec()], ['A'])
+        command = query._explain_command()
+        self.assertEqual((command['maxTimeMS'], command['comment'],
+                          command['batchSize']), (100, 'c', 10))
+        count = SimpleSong.find().max_time(100).count()
+        self.assertEqual(count._explain_command()['maxTimeMS'], 100)
+        self.assertEqual(count.exec(), 1)
+
+    def test_query_max_results_raises_if_exceeded(self):
+        for i in range(3):
+            SimpleSong(name=f'S{i}', year=2020, artist='Thao').save()
+        songs = SimpleSong.find().order('name').max_results(3).exec()
+        self.assertEqual([s.name for s in songs], ['S0', 'S1', 'S2'])
+        self.assertEqual([s.is_modified for s in songs], [False] * 3)
+        with self.assertRaises(TooManyResultsException):
+            SimpleSong.find().max_results(2).exec()
+        page = SimpleSong.find().order('name').limit(2).max_results(2) \
+                         .after().exec()
+        self.assertEqual([s.name for s in page], ['S0', 'S1'])
+        self.assertIsNotNone(page.next_token)
+
+    def test_find_fast_path_returns_same_objects_as_aggregate(self):
+        for i in range(5):
+            SimpleSong(name=f'S{i}', year=2016 + i, artist='Thao').save()
+        query = SimpleSong.find(year={'_gte': 2017}).order('year', -1) \
+            .skip(1).limit(2).pick(['name', 'year'])
+        pipeline = query._aggregate_pipeline()
+        self.assertIsNotNone(find_arguments(pipeline))
+        found = query.exec()
+        collection = Connection.get_collection(SimpleSong)
+        aggregated = Decoder().decode_root_list(
+            list(collection.aggregate(pipeline)), SimpleSong, None, query)
+        self.assertEqual([(s.id, s.name, s.year) for s in found],
+                         [(s.id, s.name, s.year) for s in aggregated])
+        self.assertEqual([s.name for s in found], ['S3', 'S2'])
+        pipeline = LinkedAuthor.find().include('posts')._aggregate_pipeline()
+        self.assertIsNone(find_arguments(pipeline))
+
+    def test_keyset_pagination_walks_pages_with_tokens(self):
+        for i in range(7):
+            SimpleScore(name=f's{i}', score=i % 3).save()
+        names = []
+        page = SimpleScore.find().order('score', -1).limit(3).after().exec()
+        self.assertIsNone(page.previous_token)
+        while True:
+            names.extend(s.name for s in page)
+            if page.next_token is None:
+                break
+            page = SimpleScore.find().order('score', -1).limit(3) \
+                .after(page.next_token).exec()
+        scores = [SimpleScore.one(name=n).exec().score for n in names]
+        self.assertEqual(len(set(names)), 7)
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        previous = SimpleScore.find().order('score', -1).limit(3) \
+            .before(page.previous_token).exec()
+        self.assertEqual([s.name for s in previous], names[3:6])
+
+    def test_keyset_pagination_walks_sparse_sort_field(self):
+        for i in range(6):
+            SimpleAlbum(name=f's{i}', year=None if i % 2 else i).save()
+        for order in (1, -1):
+            names = []
+            page = SimpleAlbum.find().order('year', order).limit(2).after() \
+                .exec()
+            while True:
+                names.extend(s.name for s in page)
+                if page.next_token is None:
+                    break
+                page = SimpleAlbum.find().order('year', order).limit(2) \
+                    .after(page.next_token).exec()
+            self.assertEqual(len(names), 6)
+            self.assertEqual(len(set(names)), 6)
+            previous = SimpleAlbum.find().order('year', order).limit(2) \
+                .before(page.previous_token).exec()
+            self.assertEqual([s.name for s in previous], names[2:4])
+
+    def test_keyset_pagination_accepts_after_instructor(self):
+        for i in range(4):
+            SimpleScore(name=f's{i}', score=i).save()
+        page = SimpleScore.find('_order=score&_limit=2&_after=').exec()
+        self.assertEqual([s.name for s in page], ['s0', 's1'])
+        page = SimpleScore.find(
+            f'_order=score&_limit=2&_after={page.next_token}').exec()
+        self.assertEqual([s.name for s in page], ['s2', 's3'])
+        self.assertIsNone(page.next_token)
+
+    def test_query_with_total_returns_page_and_total_count(self):
+        for i in range(25):
+            SimpleScore(name=f's{i}', score=i).save()
+        page = SimpleScore.find(score={'_gte': 5}).order('score') \
+            .paginate(2, 10).exec()
+        self.assertEqual(page.total, 20)
+        self.assertEqual([s.score for s in page.items], list(range(15, 25)))
+        page = SimpleScore.find(score={'_gte': 100}).with_total().exec()
+        self.assertEqual(page.total, 0)
+        self.assertEqual(page.items, [])
+
+    def test_query_count_counts_matched_objects(self):
+        for i in range(12):
+            SimpleScore(name=f's{i}', score=i).save()
+        self.assertEqual(SimpleScore.find(score={'_gte': 4}).count().exec(), 8)
+        self.assertEqual(
+            SimpleScore.find(score={'_gte': 4}).limit(2).count().exec(), 8)
+        self.assertEqual(SimpleScore.find().count(estimated=True).exec(), 12)
+        with self.assertRaises(ValueError):
+            SimpleScore.find(score=1).count(estimated=True)
+
+    def test_query_stats_computes_accumulators_in_one_query(self):
+        SimpleScore(name='a', score=1).save()
+        SimpleScore(name='b', score=2).save()
+        SimpleScore(name='c', score=6).save()
+        stats = SimpleScore.find().stats(avg=['score'], min=['score', 'name'],
+                                         max=['score'], sum=['score'],
+                                         count=True).exec()
+        self.assertEqual(stats.avg, {'score': 3})
+        self.assertEqual(stats.min, {'score': 1, 'name': 'a'})
+        self.assertEqual(stats.max, {'score': 6})
+        self.assertEqual(stats.sum, {'score': 9})
+        self.assertEqual(stats.count, 3)
+        stats = SimpleScore.find(score={'_gt': 10}).stats(
+            avg=['score'], sum=['score'], count=True).exec()
+        self.assertEqual(stats.avg, {'score': None})
+        self.assertEqual(stats.sum, {'score': 0})
+        self.assertEqual(stats.count, 0)
+
+    def test_query_group_by_computes_accumulators_per_group(self):
+        SimpleSong(name='A', year=2018, artist='Thao').save()
+        SimpleSong(name='B', year=2018, artist='Thao').save()
+        SimpleSong(name='C', year=2020, artist='Kieu').save()
+        rows = list(SimpleSong.find().group_by('artist')
+                    .agg(min=['year'], max=['name'], count=True).exec())
+        self.assertEqual([r.key for r in rows],
+                         [{'artist': 'Kieu'}, {'artist': 'Thao'}])
+        self.assertEqual([r.min['year'] for r in rows], [2020, 2018])
+        self.assertEqual([r.max['name'] for r in rows], ['C', 'B'])
+        self.assertEqual([r.count for r in rows], [1, 2])
+
+    def test_query_group_by_buckets_numeric_field(self):
+        for i in range(10):
+            SimpleScore(name=f's{i}', score=i).save()
+        rows = list(SimpleScore.find().group_by('score', buckets=2)
+                    .agg(sum=['score']).exec())
+        self.assertEqual([r.key for r in rows],
+                         [{'score': {'min': 0, 'max': 5}},
+                          {'score': {'min': 5, 'max': 9}}])
+        self.assertEqual([r.sum['score'] for r in rows], [10, 35])
+        self.assertEqual([r.count for r in rows], [5, 5])
+
+    def test_query_group_by_rejects_invalid_grouping_when_built(self):
+        with self.assertRaises(ValueError):
+            SimpleSong.find().group_by('name', buckets=2)
+        with self.assertRaises(ValueError):
+            SimpleScore.find().group_by('score', buckets=0)
+        with self.assertRaises(ValueError):
+            SimpleSong.find().group_by('artist', unit='day')
+        with self.assertRaises(ValueError):
+            SimpleSong.find().group_by('createdAt', unit='days')
+        with self.assertRaises(ValueError):
+            SimpleSong.find().group_by('title')
+        SimpleSong.find().group_by('artist', 'createdAt', unit='day')
+
+    def test_lazy_query_decodes_fields_on_access(self):
+        LinkedAuthor(name='A', posts=[{'title': 'P1', 'content': 'C1'}]).save()
+        posts = LinkedPost.find().lazy().include('author').exec()
+        self.assertNotIn('content', posts[0].__dict__)
+        self.assertEqual(posts[0].title, 'P1')
+        self.assertEqual(posts[0].author.name, 'A')
+        self.assertFalse(posts[0].is_modified)
+        post = LinkedPost.id(posts[0].id).lazy().exec()
+        post.content = 'C2'
+        self.assertEqual(post.modified_fields, ('content',))
+        post.save()
+        self.assertEqual(LinkedPost.id(post.id).exec().content, 'C2')
+        page = LinkedPost.find().lazy().with_total().exec()
+        self.assertEqual(page.total, 1)
+        self.assertEqual(page.items[0].content, 'C2')
+        with self.assertRaises(ValueError):
+            LinkedPost.find().lazy().include('author', strategy='batch') \
+                      .exec()
+
+    def test_query_to_columns_reads_fields_without_objects(self):
+        SimpleSong(name='A', year=2018, artist='Thao').save()
+        SimpleSong(name='B', year=2020, artist='Kieu').save()
+        SimpleSong(name='C', year=2021, artist='Thao').save()
+        query = SimpleSong.find(artist='Thao').order('year', -1)
+        columns = query.to_columns(['name', 'year', 'createdAt'],
+                                   arrays=False).exec()
+        self.assertEqual(columns['name'], ['C', 'A'])
+        self.assertEqual(columns['year'], [2021, 2018])
+        self.assertEqual(columns['createdAt'][0].tzinfo, timezone.utc)
+        with self.assertRaises(ValueError):
+            SimpleSong.find().to_columns(['title'])
+
+    def test_keyset_page_is_selected_exactly_without_decoding(self):
+        for i in range(6):
+            SimpleScore(name=f's{i}', score=i).save()
+        query = SimpleScore.find().order('score').limit(2)
+        page = query.after().exec()
+        stats = SimpleScore.find().order('score').limit(2).after() \
+            .stats(sum=['score'], count=True).exec()
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(stats.sum, {'score': 1})
+        names = [s.name for s in SimpleScore.iterate().order('score')
+                 .limit(2).after(page.next_token).exec()]
+        self.assertEqual(names, ['s2', 's3'])
+        page = query.after(page.next_token).exec()
+        columns = SimpleScore.find().order('score').limit(2) \
+            .before(page.next_token) \
+            .to_columns(['name'], arrays=False).exec()
+        self.assertEqual(columns['name'], ['s1', 's2'])
+
+    @skipIf(numpy is None, 'NumPy is not installed')
+    def test_query_to_columns_reads_fields_into_typed_arrays(self):
+        song = SimpleSong(name='A', year=2018, artist='Thao').save()
+        SimpleScore(name='a', score=1.5).save()
+        columns = SimpleSong.find().to_columns(
+            ['id', 'name', 'year', 'created_at']).exec()
+        self.assertEqual(columns['id'].tolist(), [song.id])
+        self.assertEqual(columns['name'].dtype, object)
+        self.assertEqual(columns['year'].dtype, numpy.int64)
+        self.assertEqual(columns['year'].tolist(), [2018])
+        self.assertEqual(columns['created_at'].dtype.kind, 'M')
+        columns = SimpleScore.find().to_columns(['score']).exec()
+        self.assertEqual(columns['score'].dtype, numpy.float64)
+        self.assertEqual(columns['score'].tolist(), [1.5])
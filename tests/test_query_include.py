@@ -1,6 +1,8 @@
 from __future__ import annotations
 from unittest import TestCase
 from jsonclasses_pymongo.connection import Connection
+from jsonclasses_pymongo.loader import load
+from jsonclasses_pymongo.query import Subquery
 from tests.classes.simple_song import SimpleSong
 from tests.classes.simple_artist import SimpleArtist
 from tests.classes.linked_author import LinkedAuthor
@@ -576,3 +578,130 @@ class TestQueryInclude(TestCase):
         self.assertEqual(len(result.music_users), 1)
         result = MusicProduct.one().include('musicUsers').exec()
         self.assertEqual(len(result.music_users), 1)
+
+    def test_include_uses_keyed_lookup_if_server_supports(self):
+        connection = Connection('linked')
+        query = LinkedPost.find().include('author', LinkedAuthor.find())
+        stages = query._build_aggregate_pipeline()
+        lookup = next(s['$lookup'] for s in stages if '$lookup' in s)
+        self.assertEqual(lookup['localField'], 'authorId')
+        self.assertEqual(lookup['foreignField'], '_id')
+        self.assertNotIn('let', lookup)
+        connection.set_server_version((4, 4))
+        try:
+            stages = query._build_aggregate_pipeline()
+        finally:
+            connection.set_server_version(None)
+        lookup = next(s['$lookup'] for s in stages if '$lookup' in s)
+        self.assertEqual(lookup['let'], {'authorId': '$authorId'})
+
+    def test_batch_include_fetches_local_and_foreign_objects(self):
+        author = LinkedAuthor(name='A', posts=[
+            {'title': 'P1', 'content': 'C1'},
+            {'title': 'P2', 'content': 'C2'}])
+        author.save()
+        LinkedAuthor(name='B', posts=[{'title': 'P3', 'content': 'C3'}]).save()
+        posts = LinkedPost.find().order('title') \
+                          .include('author', strategy='batch').exec()
+        self.assertEqual([p.author.name for p in posts], ['A', 'A', 'B'])
+        self.assertIs(posts[0].author, posts[1].author)
+        authors = LinkedAuthor.find().order('name').include(
+            'posts', LinkedPost.find().order('title', -1), 'batch').exec()
+        self.assertEqual([p.title for p in authors[0].posts], ['P2', 'P1'])
+        self.assertEqual([p.title for p in authors[1].posts], ['P3'])
+
+    def test_batch_include_fetches_many_many_and_join_table_objects(self):
+        singer1 = LinkedSinger(name='S1')
+        singer2 = LinkedSinger(name='S2')
+        LinkedSong(name='A', singers=[singer1, singer2]).save()
+        LinkedSong(name='B', singers=[singer1]).save()
+        songs = LinkedSong.find().order('name') \
+                          .include('singers', strategy='batch').exec()
+        self.assertEqual([s.name for s in songs[0].singers], ['S1', 'S2'])
+        self.assertEqual([s.name for s in songs[1].singers], ['S1'])
+        singer = LinkedSinger.id(singer1.id) \
+                             .include('songs', strategy='batch').exec()
+        self.assertEqual(sorted(s.name for s in singer.songs), ['A', 'B'])
+        course = LinkedCourse(name='C')
+        LinkedStudent(name='T', courses=[course]).save()
+        student = LinkedStudent.one().include('courses', strategy='batch') \
+                               .exec()
+        self.assertEqual([c.name for c in student.courses], ['C'])
+
+    def test_batch_include_keeps_order_of_sorted_subquery(self):
+        singer1 = LinkedSinger(name='S1')
+        singer2 = LinkedSinger(name='S2')
+        LinkedSong(name='A', singers=[singer1, singer2]).save()
+        LinkedSong(name='B', singers=[singer1]).save()
+        docs = list(Connection.get_collection(LinkedSong).find().sort('name'))
+        load(LinkedSong, [Subquery('singers', LinkedSinger.find()
+                                   .order('name', -1), 'batch')], docs)
+        self.assertEqual([s['name'] for s in docs[0]['singers']], ['S2', 'S1'])
+        self.assertEqual([s['name'] for s in docs[1]['singers']], ['S1'])
+        LinkedStudent(name='T', courses=[LinkedCourse(name='C1'),
+                                         LinkedCourse(name='C2')]).save()
+        student = LinkedStudent.one().include(
+            'courses', LinkedCourse.find().order('name', -1), 'batch').exec()
+        self.assertEqual([c.name for c in student.courses], ['C2', 'C1'])
+
+    def test_batch_include_stitches_picked_and_omitted_objects(self):
+        LinkedAuthor(name='A', posts=[
+            {'title': 'P1', 'content': 'C1'},
+            {'title': 'P2', 'content': 'C2'}]).save()
+        posts = LinkedPost.find().order('title').include(
+            'author', LinkedAuthor.one().pick(['name']), 'batch').exec()
+        self.assertEqual([p.author.name for p in posts], ['A', 'A'])
+        authors = LinkedAuthor.find().include(
+            'posts', LinkedPost.find().order('title').pick(['id', 'title']),
+            'batch').exec()
+        self.assertEqual([p.title for p in authors[0].posts], ['P1', 'P2'])
+        authors = LinkedAuthor.find().include(
+            'posts', LinkedPost.find().order('title').omit(['content']),
+            'batch').exec()
+        self.assertEqual([p.title for p in authors[0].posts], ['P1', 'P2'])
+        self.assertIsNone(authors[0].posts[0].content)
+        LinkedStudent(name='T', courses=[LinkedCourse(name='C')]).save()
+        student = LinkedStudent.one().include(
+            'courses', LinkedCourse.find().pick(['name']), 'batch').exec()
+        self.assertEqual([c.name for c in student.courses], ['C'])
+
+    def test_batch_include_loads_nested_levels(self):
+        LinkedAuthor(name='A', posts=[
+            {'title': 'P1', 'content': 'C1'},
+            {'title': 'P2', 'content': 'C2'}]).save()
+        user = LinkedUser(name='U', profile=LinkedProfile(name='P')).save()
+        posts = LinkedPost.find().order('title').include(
+            'author', LinkedAuthor.find().include('posts', strategy='batch'),
+            'batch').exec()
+        self.assertEqual(len(posts[0].author.posts), 2)
+        profile = LinkedProfile.one().include(
+            'user', LinkedUser.find().include('profile'), 'batch').exec()
+        self.assertEqual(profile.user.id, user.id)
+        self.assertIs(profile.user.profile, profile)
+
+    def test_batch_include_is_loaded_per_iterated_batch(self):
+        for i in range(5):
+            LinkedPost(title=f'P{i}', content='C',
+                       author=LinkedAuthor(name=f'A{i}')).save()
+        query = LinkedPost.iterate().order('title').batch_size(2)
+        names = [p.author.name for p
+                 in query.include('author', strategy='batch').exec()]
+        self.assertEqual(names, [f'A{i}' for i in range(5)])
+
+    def test_iterate_window_bounds_identity_map(self):
+        author = LinkedAuthor(name='A')
+        for i in range(4):
+            LinkedPost(title=f'P{i}', content='C', author=author).save()
+        query = LinkedPost.iterate().order('title').include('author')
+        posts = list(query.window(2).exec())
+        self.assertIs(posts[0].author, posts[1].author)
+        self.assertIsNot(posts[1].author, posts[2].author)
+        self.assertIs(posts[2].author, posts[3].author)
+        posts = list(LinkedPost.iterate().include('author').exec())
+        self.assertIs(posts[0].author, posts[3].author)
+        with self.assertRaises(ValueError):
+            LinkedPost.iterate().window(0)
+
+    def test_batch_include_raises_for_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            LinkedPost.find().include('author', strategy='join')
@@ -12,6 +12,9 @@ from tests.classes.linked_favorite import LinkedCourse, LinkedStudent
 from tests.classes.simple_record import SimpleRecord
 from tests.classes.linked_album import LinkedAlbum, LinkedArtist
 from tests.classes.linked_song import LinkedSinger, LinkedSong
+from tests.classes.linked_article import LinkedArticle, LinkedWriter
+from jsonclasses.excs import UniqueConstraintException
+from jsonclasses_pymongo.excs import LinkedObjectNotSavedException
 
 
 class TestSave(TestCase):
@@ -41,6 +44,10 @@ class TestSave(TestCase):
         collection.delete_many({})
         collection = Connection.get_collection(LinkedPost)
         collection.delete_many({})
+        collection = Connection.get_collection(LinkedArticle)
+        collection.delete_many({})
+        collection = Connection.get_collection(LinkedWriter)
+        collection.delete_many({})
         collection = Connection.get_collection(LinkedProfile)
         collection.delete_many({})
         collection = Connection.get_collection(LinkedUser)
@@ -137,6 +144,87 @@ class TestSave(TestCase):
                              {'_id', 'title', 'content', 'authorId',
                               'updatedAt', 'createdAt'})
 
+    def test_save_many_saves_objects_into_database(self):
+        songs = [SimpleSong(name=f'S{i}', year=2020, artist='A')
+                 for i in range(5)]
+        result = SimpleSong.save_many(songs, chunk_size=2)
+        self.assertEqual(len(result.saved), 5)
+        self.assertEqual(result.failures, [])
+        collection = Connection.get_collection(SimpleSong)
+        self.assertEqual(collection.count_documents({}), 5)
+        for song in songs:
+            self.assertFalse(song.is_new)
+
+    def test_save_many_saves_shared_linked_objects_once(self):
+        author = LinkedAuthor(name='A')
+        posts = [LinkedPost(title=f'P{i}', content='C', author=author)
+                 for i in range(3)]
+        LinkedPost.save_many(posts)
+        collection = Connection.get_collection(LinkedAuthor)
+        self.assertEqual(collection.count_documents({}), 1)
+        collection = Connection.get_collection(LinkedPost)
+        self.assertEqual(collection.count_documents({'authorId': ObjectId(author.id)}), 3)
+
+    def test_save_many_keeps_roots_sharing_linked_objects_of_failed_roots(self):
+        LinkedArticle(title='T0').save()
+        writer = LinkedWriter(name='W')
+        articles = [LinkedArticle(title=f'T{i}', writer=writer)
+                    for i in range(3)]
+        result = LinkedArticle.save_many(articles)
+        self.assertEqual(result.saved, articles[1:])
+        self.assertEqual([f.index for f in result.failures], [0])
+        self.assertTrue(articles[0].is_new)
+        self.assertFalse(writer.is_new)
+        collection = Connection.get_collection(LinkedWriter)
+        self.assertEqual(collection.count_documents({}), 1)
+        collection = Connection.get_collection(LinkedArticle)
+        matcher = {'writerId': ObjectId(writer.id)}
+        self.assertEqual(collection.count_documents(matcher), 2)
+        articles[0].title = 'T3'
+        result = LinkedArticle.save_many(articles[:1])
+        self.assertEqual(result.failures, [])
+        self.assertFalse(articles[0].is_new)
+        self.assertEqual(collection.count_documents(matcher), 3)
+
+    def test_save_many_fails_roots_sharing_unsaved_linked_objects(self):
+        LinkedWriter(name='W').save()
+        writer = LinkedWriter(name='W')
+        articles = [LinkedArticle(title=f'T{i}', writer=writer)
+                    for i in range(3)]
+        result = LinkedArticle.save_many(articles)
+        self.assertEqual(result.saved, [])
+        self.assertEqual([f.index for f in result.failures], [0, 1, 2])
+        for failure in result.failures[1:]:
+            self.assertIsInstance(failure.exception,
+                                  LinkedObjectNotSavedException)
+        self.assertTrue(writer.is_new)
+        collection = Connection.get_collection(LinkedArticle)
+        self.assertEqual(collection.count_documents({}), 0)
+        writer.name = 'V'
+        result = LinkedArticle.save_many(articles)
+        self.assertEqual(len(result.saved), 3)
+        self.assertEqual(collection.count_documents({}), 3)
+
+    def test_save_many_reports_roots_whose_unlinked_objects_fail(self):
+        LinkedWriter(name='V').save()
+        writer = LinkedWriter(name='W')
+        articles = [LinkedArticle(title='T0', writer=writer),
+                    LinkedArticle(title='T1')]
+        LinkedArticle.save_many(articles)
+        articles[0].writer = None
+        writer.name = 'V'
+        articles[1].title = 'T2'
+        result = LinkedArticle.save_many(articles)
+        self.assertEqual(result.saved, articles[1:])
+        self.assertEqual([f.index for f in result.failures], [0])
+        self.assertEqual(result.failures[0].object, articles[0])
+        self.assertIsInstance(result.failures[0].exception,
+                              UniqueConstraintException)
+        self.assertEqual(articles[0].unlinked_objects['writer'], [writer])
+        collection = Connection.get_collection(LinkedArticle)
+        self.assertNotIn('writerId', collection.find_one({'title': 'T0'}))
+        self.assertEqual(collection.count_documents({'title': 'T2'}), 1)
+
     def test_object_is_not_new_after_saved(self):
         song = SimpleSong(name='Long', year=2020, artist='Thao')
         self.assertEqual(song.is_new, True)
@@ -406,3 +494,13 @@ class TestSave(TestCase):
         self.assertEqual(record.desc, 'b')
         self.assertEqual(record.age, 1)
         self.assertEqual(record.score, 3.0)
+
+    def test_save_uses_new_collection_after_reconnect(self):
+        collection = Connection.get_collection(SimpleSong)
+        connection = Connection.from_class(SimpleSong)
+        connection.disconnect()
+        connection.connect()
+        self.assertIsNot(Connection.get_collection(SimpleSong), collection)
+        SimpleSong(name='A', year=2020, artist='B').save()
+        collection = Connection.get_collection(SimpleSong)
+        self.assertEqual(collection.count_documents({}), 1)
@@ -1,7 +1,9 @@
 from __future__ import annotations
 from unittest import TestCase
+from pymongo.errors import DuplicateKeyError
 from jsonclasses.excs import UniqueConstraintException
 from jsonclasses_pymongo.connection import Connection
+from jsonclasses_pymongo.command import BatchCommand, InsertOneCommand
 from tests.classes.simple_person import SimplePerson
 from tests.classes.simple_singer import SimpleSinger
 from tests.classes.simple_album import SimpleAlbum
@@ -66,3 +68,23 @@ class TestUniqueRecord(TestCase):
         one.save()
         two = SimpleAlbum()
         two.save()
+
+    def test_bulk_write_raises_duplicate_key_error(self):
+        collection = Connection.get_collection(SimplePerson)
+        commands = [InsertOneCommand(collection, {'name': 'Tsuan Tsiu'}),
+                    InsertOneCommand(collection, {'name': 'Tsuan Tsiu'})]
+        self.assertRaisesRegex(DuplicateKeyError,
+                               'index: name_1 dup key',
+                               BatchCommand(commands).execute)
+
+    def test_save_many_reports_unique_rule_violations(self):
+        SimplePerson(name='Tsuan Tsiu').save()
+        people = [SimplePerson(name='A'),
+                  SimplePerson(name='Tsuan Tsiu'),
+                  SimplePerson(name='B')]
+        result = SimplePerson.save_many(people)
+        self.assertEqual(len(result.saved), 2)
+        self.assertEqual(len(result.failures), 1)
+        self.assertEqual(result.failures[0].index, 1)
+        self.assertIsInstance(result.failures[0].exception,
+                              UniqueConstraintException)